@@ -10,37 +10,61 @@ def _():
     import matplotlib.pyplot as plt
     import math
 
-    from typing import List, Optional, ClassVar
+    from typing import Callable, Deque, List, Optional, ClassVar
+    from collections import deque
     import random
     import numpy as np
     import pickle
+    import queue
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
     import os
+    import sys
+    import time
 
     import json
+    import hashlib
+    import re
+    import csv
+    import tempfile
 
-    from pydantic import StrictInt, field_validator, Field
+    from pydantic import ConfigDict, StrictInt, field_validator, Field
     from pydantic.dataclasses import dataclass
     from dataclasses import fields
     from copy import deepcopy
     import marimo as mo
 
     return (
+        Callable,
+        ConfigDict,
+        Deque,
         Field,
         List,
         Optional,
         StrictInt,
+        ThreadPoolExecutor,
+        csv,
         dataclass,
         deepcopy,
+        deque,
         field_validator,
         fields,
+        hashlib,
         json,
         math,
         mo,
         networks,
+        np,
         os,
         pickle,
         plt,
+        queue,
         random,
+        re,
+        sys,
+        tempfile,
+        threading,
+        time,
     )
 
 
@@ -197,6 +221,56 @@ def _(StrictInt, dataclass, field_validator):
     return Int256, Uint256
 
 
+@app.cell
+def _(mo, sys):
+    # Checked arrays with the semantics of `Uint256`/`Int256` and forked workers, shared with the prover boost notebook
+    _shared = str(mo.notebook_dir().parents[1] / "shared")
+    if _shared not in sys.path:
+        sys.path.append(_shared)
+    from uint256_array import Int256Array, Uint256Array
+    from parallel import fork_map
+
+    return Int256Array, Uint256Array, fork_map
+
+
+@app.cell
+def _(Int256, Int256Array, Uint256, Uint256Array, random):
+    def check_arrays_match_scalars(count: int = 1000, seed: int = 0):
+        rng = random.Random(f"{seed}/uint256_array")
+        a = [rng.randrange(2**128) for _ in range(count)]
+        b = [rng.randrange(1, 2**128) for _ in range(count)]
+        d = [rng.randrange(1, 2**64) for _ in range(count)]
+        big, small = (
+            [max(x, y) for x, y in zip(a, b)],
+            [min(x, y) for x, y in zip(a, b)],
+        )
+
+        A, B, D = Uint256Array(a), Uint256Array(b), Uint256Array(d)
+        expected = [Uint256(x) for x in a]
+        assert (A + B).tolist() == [(x + Uint256(y)).value for x, y in zip(expected, b)]
+        assert (A * B).tolist() == [(x * Uint256(y)).value for x, y in zip(expected, b)]
+        assert (A / B).tolist() == [(x / Uint256(y)).value for x, y in zip(expected, b)]
+        assert (Uint256Array(big) - Uint256Array(small)).tolist() == [
+            (Uint256(x) - Uint256(y)).value for x, y in zip(big, small)
+        ]
+        for round_up in (False, True):
+            assert A.mul_div(B, D, round_up).tolist() == [
+                x.mul_div(Uint256(y), Uint256(z), round_up).value
+                for x, y, z in zip(expected, b, d)
+            ]
+        assert (-Int256Array(small)).tolist() == [(-Int256(x)).value for x in small]
+
+        # Same failures as the scalars, with the index of the first offending value
+        try:
+            Uint256Array(small) - Uint256Array(big)
+            raise AssertionError("Expected an underflow")
+        except ValueError as e:
+            assert "underflow" in str(e)
+
+    check_arrays_match_scalars()
+    return
+
+
 @app.cell
 def _(Uint256):
     MIN_BASE_FEE_PER_BLOB_GAS = Uint256(1)
@@ -252,6 +326,8 @@ def _(Uint256):
     assert d == e, f"Expected {d} to be {e}"
     return (
         BLOB_BASE_FEE_UPDATE_FRACTION,
+        BLOB_SIZE_IN_FIELDS,
+        GAS_PER_BLOB,
         MIN_BASE_FEE_PER_BLOB_GAS,
         fake_exponential,
     )
@@ -269,28 +345,113 @@ def _(mo):
     return
 
 
+@app.cell
+def _(ThreadPoolExecutor, deque, queue, threading):
+    class BlockStream:
+        """
+        Fetches L1 blocks in order in a background thread, into a queue that is consumed (once) by iterating the stream.
+        At most `max_pending` blocks wait in the queue, beyond that the fetcher waits for the consumer (backpressure).
+        With `workers > 1` that many blocks are fetched concurrently, e.g., when the RPC latency dominates.
+        """
+
+        _DONE = object()
+
+        def __init__(
+            self,
+            fetch,
+            block_numbers,
+            max_pending: int = 256,
+            workers: int = 1,
+        ):
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.error = None
+            self.closed = threading.Event()
+            self.thread = threading.Thread(
+                target=self._produce,
+                args=(fetch, list(block_numbers), workers),
+                daemon=True,
+            )
+            self.thread.start()
+
+        def _put(self, item) -> bool:
+            while not self.closed.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def _produce(self, fetch, block_numbers, workers: int):
+            try:
+                with ThreadPoolExecutor(workers) as pool:
+                    # Keep at most `workers` fetches ahead, the results go out in order
+                    pending = deque()
+                    numbers = iter(block_numbers)
+                    for number in numbers:
+                        pending.append(pool.submit(fetch, number))
+                        if len(pending) < workers:
+                            continue
+                        if not self._put(pending.popleft().result()):
+                            return
+                    while pending:
+                        if not self._put(pending.popleft().result()):
+                            return
+            except Exception as e:
+                self.error = e
+            finally:
+                self._put(self._DONE)
+
+        def __iter__(self):
+            try:
+                while True:
+                    item = self.queue.get()
+                    if item is self._DONE:
+                        if self.error is not None:
+                            raise RuntimeError(
+                                "Fetching the L1 blocks failed"
+                            ) from self.error
+                        return
+                    yield item
+            finally:
+                self.close()
+
+        def close(self):
+            """
+            Stops the fetcher, e.g., when the consumer stops early.
+            """
+            self.closed.set()
+
+    return (BlockStream,)
+
+
+@app.cell
+def _(Uint256, dataclass, json_serializable):
+    @json_serializable
+    @dataclass
+    class L1BlockSub:
+        number: Uint256
+        timestamp: Uint256
+        blob_fee: Uint256
+        base_fee: Uint256
+        excess_blob_gas: Uint256
+
+    return (L1BlockSub,)
+
+
 @app.cell
 def _(
     BLOB_BASE_FEE_UPDATE_FRACTION,
+    BlockStream,
+    L1BlockSub,
     MIN_BASE_FEE_PER_BLOB_GAS,
     Uint256,
-    dataclass,
     fake_exponential,
-    json_serializable,
     mo,
     networks,
     os,
     pickle,
 ):
-    @json_serializable
-    @dataclass
-    class L1BlockSub:
-        number: Uint256
-        timestamp: Uint256
-        blob_fee: Uint256
-        base_fee: Uint256
-        excess_blob_gas: Uint256
-
     def get_l1_block_sub(block_number: int) -> L1BlockSub:
         block = networks.provider.web3.eth.get_block(block_number)
         blob_fee = fake_exponential(
@@ -306,6 +467,19 @@ def _(
             timestamp=Uint256(block.timestamp),
         )
 
+    def stream_blocks(
+        start_number: int, number_of_blocks: int, **kwargs
+    ) -> BlockStream:
+        """
+        Streams the blocks from the node as they are fetched, see `simulate_stream` to simulate them as they arrive.
+        """
+        networks.parse_network_choice("ethereum:mainnet:node").__enter__()
+        return BlockStream(
+            get_l1_block_sub,
+            range(start_number, start_number + number_of_blocks + 1),
+            **kwargs,
+        )
+
     @mo.cache
     def get_blocks(start_number: int, number_of_blocks: int):
         if os.path.exists("blocks.pkl"):
@@ -317,11 +491,7 @@ def _(
                     == start_number + number_of_blocks
                 ):
                     return candidated_blocks
-        networks.parse_network_choice("ethereum:mainnet:node").__enter__()
-        blocks = [
-            get_l1_block_sub(i)
-            for i in range(start_number, start_number + number_of_blocks + 1)
-        ]
+        blocks = list(stream_blocks(start_number, number_of_blocks))
         with open("blocks.pkl", "wb") as f:
             pickle.dump(blocks, f)
         return blocks
@@ -334,7 +504,7 @@ def _(
     blocks_to_pull = 2000
 
     blocks = get_blocks(block_start_number, blocks_to_pull)
-    return (blocks,)
+    return blocks, stream_blocks
 
 
 @app.cell
@@ -355,6 +525,243 @@ def _(blocks, plt):
     return (block_numbers,)
 
 
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Synthetic L1 traces
+
+    The collected range is short and fairly calm, so to stress the oracle and the congestion logic we can also generate traces.
+    The base fee follows EIP-1559, e.g., it moves by up to 12.5% per block depending on how full the block is compared to the target.
+    The excess blob gas follows EIP-4844, e.g., it grows by the blob gas used above the target and is floored at 0, and the blob fee is derived from it using `fake_exponential`.
+
+    Spikes are injected as regimes where blocks are (close to) full for a while.
+    The trace is stored as columns, but behaves like the list of `L1BlockSub` from `get_blocks`, so it can be used anywhere `blocks` is.
+    """)
+    return
+
+
+@app.cell
+def _(L1BlockSub, Uint256, np):
+    class L1Trace:
+        """
+        A columnar L1 trace with the fields of `L1BlockSub` as int64 columns.
+        Indexing returns an `L1BlockSub` (created on access), slicing returns an `L1Trace`.
+        """
+
+        FIELDS = ("number", "timestamp", "blob_fee", "base_fee", "excess_blob_gas")
+
+        def __init__(self, number, timestamp, blob_fee, base_fee, excess_blob_gas):
+            self.number = np.asarray(number, dtype=np.int64)
+            self.timestamp = np.asarray(timestamp, dtype=np.int64)
+            self.blob_fee = np.asarray(blob_fee, dtype=np.int64)
+            self.base_fee = np.asarray(base_fee, dtype=np.int64)
+            self.excess_blob_gas = np.asarray(excess_blob_gas, dtype=np.int64)
+
+        @classmethod
+        def from_blocks(cls, blocks):
+            return cls(**{f: [getattr(b, f).value for b in blocks] for f in cls.FIELDS})
+
+        def __len__(self) -> int:
+            return len(self.number)
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return L1Trace(**{f: getattr(self, f)[index] for f in self.FIELDS})
+            return L1BlockSub(
+                **{f: Uint256(int(getattr(self, f)[index])) for f in self.FIELDS}
+            )
+
+        def __iter__(self):
+            for i in range(len(self)):
+                yield self[i]
+
+    return (L1Trace,)
+
+
+@app.cell
+def _(
+    BLOB_BASE_FEE_UPDATE_FRACTION,
+    GAS_PER_BLOB,
+    L1Trace,
+    List,
+    MIN_BASE_FEE_PER_BLOB_GAS,
+    Optional,
+    StrictInt,
+    Uint256,
+    dataclass,
+    fake_exponential,
+    np,
+):
+    L1_BLOCK_TIME = 12
+    BASE_FEE_MAX_CHANGE_DENOMINATOR = 8
+    MAX_BLOBS_PER_BLOCK = 6
+    TARGET_BLOBS_PER_BLOCK = 3
+    # Fees are stored as int64 columns, a spike that goes on for long enough will be capped here
+    MAX_FEE = 2**62
+    # Demand reacts to the fees once per chunk, within a chunk everything is vectorized
+    CHUNK_SIZE = 256
+
+    @dataclass
+    class SpikeRegime:
+        """
+        For `length` blocks from `start`, the blocks use `gas_fullness` and `blob_fullness` of their limits on average (1.0 is full).
+        Demand does not back off from the higher fees while the spike lasts.
+        """
+
+        start: StrictInt
+        length: StrictInt
+        gas_fullness: float = 0.95
+        blob_fullness: float = 1.0
+
+    def generate_l1_trace(
+        number_of_blocks: int,
+        seed: int = 0,
+        start_number: int = 0,
+        start_timestamp: int = 0,
+        base_fee: int = int(10e9),
+        excess_blob_gas: int = 0,
+        gas_fullness: float = 0.5,
+        blob_fullness: float = 0.5,
+        gas_noise: float = 0.25,
+        mean_reversion: float = 0.5,
+        missed_slot_probability: float = 0.01,
+        spikes: Optional[List[SpikeRegime]] = None,
+    ) -> L1Trace:
+        """
+        Generates an L1 trace following the EIP-1559 base fee and EIP-4844 excess blob gas dynamics.
+        Outside of spikes, blocks use `gas_fullness` and `blob_fullness` of their limits on average, where 0.5 is the target.
+
+        On their own both are random walks, so to keep long traces around the starting fees, demand backs off when fees are
+        above them (and picks up when below) such that `mean_reversion` of the (log) deviation is undone per `CHUNK_SIZE` blocks.
+        """
+        rng = np.random.default_rng(seed)
+
+        gas = np.full(number_of_blocks, gas_fullness)
+        blobs = np.full(number_of_blocks, blob_fullness)
+        elastic = np.ones(number_of_blocks)
+        for spike in spikes or []:
+            gas[spike.start : spike.start + spike.length] = spike.gas_fullness
+            blobs[spike.start : spike.start + spike.length] = spike.blob_fullness
+            elastic[spike.start : spike.start + spike.length] = 0
+        gas_noise = rng.normal(0, gas_noise, number_of_blocks)
+
+        # A change in fullness of `s` moves the log base fee by ~ s / 4 per block and the log blob fee by
+        # ~ s * MAX_BLOBS_PER_BLOCK * GAS_PER_BLOB / BLOB_BASE_FEE_UPDATE_FRACTION per block
+        gas_elasticity = mean_reversion * 4 / CHUNK_SIZE
+        blob_elasticity = mean_reversion / (
+            CHUNK_SIZE
+            * MAX_BLOBS_PER_BLOCK
+            * GAS_PER_BLOB.value
+            / BLOB_BASE_FEE_UPDATE_FRACTION.value
+        )
+
+        log_base_fee = np.empty(number_of_blocks)
+        excess = np.empty(number_of_blocks, dtype=np.int64)
+        log_fee, last_change = np.log(base_fee), 0.0
+        last_excess, last_delta = excess_blob_gas, 0
+
+        for start in range(0, number_of_blocks, CHUNK_SIZE):
+            chunk = slice(start, min(start + CHUNK_SIZE, number_of_blocks))
+
+            # EIP-1559: the base fee of block n + 1 moves by (used - target) / target / 8 of the base fee of block n
+            backoff = gas_elasticity * (log_fee - np.log(base_fee))
+            gas_used = np.clip(
+                gas[chunk] - elastic[chunk] * backoff + gas_noise[chunk], 0, 1
+            )
+            change = np.log1p((2 * gas_used - 1) / BASE_FEE_MAX_CHANGE_DENOMINATOR)
+            log_base_fee[chunk] = (
+                log_fee + last_change + np.cumsum(np.concatenate(([0.0], change[:-1])))
+            )
+            log_fee, last_change = log_base_fee[chunk][-1], change[-1]
+
+            # EIP-4844: excess_n = max(excess_{n - 1} + used_{n - 1} - target, 0), unrolled as a running minimum
+            backoff = blob_elasticity * (
+                (last_excess - excess_blob_gas) / BLOB_BASE_FEE_UPDATE_FRACTION.value
+            )
+            blobs_used = rng.binomial(
+                MAX_BLOBS_PER_BLOCK,
+                np.clip(blobs[chunk] - elastic[chunk] * backoff, 0, 1),
+            )
+            delta = (blobs_used - TARGET_BLOBS_PER_BLOCK) * GAS_PER_BLOB.value
+            walk = np.cumsum(np.concatenate(([last_delta], delta[:-1])))
+            excess[chunk] = walk - np.minimum(np.minimum.accumulate(walk), -last_excess)
+            last_excess, last_delta = excess[chunk][-1], delta[-1]
+
+        base_fees = np.floor(np.exp(np.minimum(log_base_fee, np.log(MAX_FEE))))
+
+        # The excess only takes a few distinct values, so we can afford the exact `fake_exponential` for each
+        unique_excess, inverse = np.unique(excess, return_inverse=True)
+        unique_blob_fee = np.array(
+            [
+                min(
+                    fake_exponential(
+                        MIN_BASE_FEE_PER_BLOB_GAS,
+                        Uint256(int(x)),
+                        BLOB_BASE_FEE_UPDATE_FRACTION,
+                    ).value,
+                    MAX_FEE,
+                )
+                for x in unique_excess
+            ],
+            dtype=np.int64,
+        )
+
+        # The number of L1 slots until the next block, more than one if slots are missed
+        block_times = L1_BLOCK_TIME * rng.geometric(
+            1 - missed_slot_probability, number_of_blocks
+        )
+        return L1Trace(
+            number=start_number + np.arange(number_of_blocks),
+            timestamp=start_timestamp
+            + np.concatenate(([0], np.cumsum(block_times[:-1]))),
+            blob_fee=unique_blob_fee[inverse],
+            base_fee=base_fees.astype(np.int64),
+            excess_blob_gas=excess,
+        )
+
+    return SpikeRegime, generate_l1_trace
+
+
+@app.cell
+def _(L1Trace, SpikeRegime, blocks, generate_l1_trace, plt, time):
+    def synthetic_trace_example():
+        last = L1Trace.from_blocks(blocks[-1:])
+        settings = dict(
+            start_number=int(last.number[0]) + 1,
+            start_timestamp=int(last.timestamp[0]) + 12,
+            base_fee=int(last.base_fee[0]),
+            excess_blob_gas=int(last.excess_blob_gas[0]),
+        )
+
+        start = time.time()
+        long_trace = generate_l1_trace(5_000_000, **settings)
+        print(
+            f"Generated {len(long_trace)} L1 blocks in {time.time() - start:.2f} seconds"
+        )
+
+        trace = generate_l1_trace(
+            20_000,
+            spikes=[
+                SpikeRegime(start=5_000, length=100),
+                SpikeRegime(start=12_000, length=400, gas_fullness=0.7),
+            ],
+            **settings,
+        )
+        fig, ax = plt.subplots(figsize=(12, 4))
+        ax.plot(trace.number, trace.base_fee, label="Base Fee (wei)")
+        ax.plot(trace.number, trace.blob_fee, label="Blob Gas Price (wei)")
+        ax.set_yscale("log")
+        ax.set_xlabel("Block Number")
+        ax.set_ylabel("Fee (wei)")
+        ax.set_title("Synthetic L1 trace with spikes")
+        ax.legend()
+        ax.grid(True)
+        return ax
+
+    synthetic_trace_example()
+    return
+
+
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
@@ -369,15 +776,21 @@ def _(mo):
 
 @app.cell
 def _(
+    Callable,
+    ConfigDict,
+    Deque,
     Field,
     Int256,
-    List,
     Optional,
+    StrictInt,
     Uint256,
     dataclass,
+    deque,
     fake_exponential,
+    field_validator,
     json_serializable,
     math,
+    np,
 ):
     @dataclass
     class Tx:
@@ -400,6 +813,81 @@ def _(
         def size_in_fields(self) -> Uint256:
             return Uint256(math.ceil(self.size_in_bytes().value / 32))
 
+    class TxBatch:
+        """
+        The txs of a block as int64 columns, with the same defaults and sizes as `Tx`.
+        Indexing returns a `Tx` (created on access), slicing (or indexing with a mask or an index array) returns a `TxBatch`.
+        """
+
+        FIELDS = (
+            "mana_spent",
+            "nullifiers",
+            "notes",
+            "public_state_diffs",
+            "encrypted_logs_size",
+        )
+
+        def __init__(
+            self,
+            mana_spent,
+            nullifiers=1,
+            notes=0,
+            public_state_diffs=1 + 2 + 2 + 2,
+            encrypted_logs_size=256,
+        ):
+            self.mana_spent = np.asarray(mana_spent, dtype=np.int64).reshape(-1)
+            count = len(self.mana_spent)
+            self.nullifiers = np.broadcast_to(
+                np.asarray(nullifiers, dtype=np.int64), count
+            )
+            self.notes = np.broadcast_to(np.asarray(notes, dtype=np.int64), count)
+            self.public_state_diffs = np.broadcast_to(
+                np.asarray(public_state_diffs, dtype=np.int64), count
+            )
+            self.encrypted_logs_size = np.broadcast_to(
+                np.asarray(encrypted_logs_size, dtype=np.int64), count
+            )
+
+        @classmethod
+        def from_txs(cls, txs):
+            return cls(**{f: [getattr(tx, f).value for tx in txs] for f in cls.FIELDS})
+
+        def __len__(self) -> int:
+            return len(self.mana_spent)
+
+        @classmethod
+        def concatenate(cls, batches):
+            if not batches:
+                return cls(mana_spent=[])
+            return cls(
+                **{
+                    f: np.concatenate([getattr(b, f) for b in batches])
+                    for f in cls.FIELDS
+                }
+            )
+
+        def __getitem__(self, index):
+            if isinstance(index, (int, np.integer)):
+                return Tx(
+                    **{f: Uint256(int(getattr(self, f)[index])) for f in self.FIELDS}
+                )
+            # Slices, masks and index arrays
+            return TxBatch(**{f: getattr(self, f)[index] for f in self.FIELDS})
+
+        def __iter__(self):
+            for i in range(len(self)):
+                yield self[i]
+
+        def size_in_bytes(self):
+            return (
+                32 * self.nullifiers
+                + 64 * self.public_state_diffs
+                + self.notes * (32 + self.encrypted_logs_size)
+            )
+
+        def size_in_fields(self):
+            return -(-self.size_in_bytes() // 32)
+
     @json_serializable
     @dataclass
     class BlockHeader:
@@ -411,18 +899,27 @@ def _(
         blobs_needed: Uint256
         size_in_fields: Uint256
 
-    @dataclass
+    @dataclass(config=ConfigDict(arbitrary_types_allowed=True))
     class Block:
         l1_block_number: Uint256
         block_number: Uint256
         slot_number: Uint256
         timestamp: Uint256
-        txs: list[Tx]
+        txs: list[Tx] | TxBatch
+
+        def size_in_bytes(self) -> Uint256:
+            if isinstance(self.txs, TxBatch):
+                return Uint256(int(self.txs.size_in_bytes().sum()))
+            return sum((tx.size_in_bytes() for tx in self.txs), start=Uint256(0))
 
         def size_in_fields(self) -> Uint256:
+            if isinstance(self.txs, TxBatch):
+                return Uint256(int(self.txs.size_in_fields().sum()))
             return sum((tx.size_in_fields() for tx in self.txs), start=Uint256(0))
 
         def mana_spent(self) -> Uint256:
+            if isinstance(self.txs, TxBatch):
+                return Uint256(int(self.txs.mana_spent.sum()))
             return sum((tx.mana_spent for tx in self.txs), start=Uint256(0))
 
         def blobs_needed(self) -> Uint256:
@@ -461,6 +958,17 @@ def _(
                 return self.pre
             return self.post
 
+        def known_until(self, slot_number: Uint256) -> Uint256:
+            """
+            The last slot for which `value_at` is already fixed, after photographing `slot_number`.
+            A change queued in a later slot takes effect `LATENCY` slots after it at the earliest.
+            """
+            first_change = max(
+                slot_number + Uint256(1),
+                self.slot_of_change + (self.LIFETIME - self.LATENCY),
+            )
+            return first_change + self.LATENCY - Uint256(1)
+
         def queue_change(self, slot_number: Uint256, fees: L1Fees):
             # If the value have been active `self.LIFETIME - self.LATENCY` we can queue the next
             if slot_number >= self.slot_of_change + (self.LIFETIME - self.LATENCY):
@@ -470,6 +978,43 @@ def _(
                 assert slot_number + self.LATENCY <= self.slot_of_change + self.LIFETIME
                 self.slot_of_change = slot_number + self.LATENCY
 
+        def queue_changes(self, from_slot: Uint256, to_slot: Uint256, fees: L1Fees):
+            """
+            Same as calling `queue_change(slot, fees)` for every slot in [from_slot, to_slot], but in constant time.
+            The first change is queued as soon as allowed, after that a change is queued every `LIFETIME` slots.
+            """
+            first = max(from_slot, self.slot_of_change + (self.LIFETIME - self.LATENCY))
+            if first > to_slot:
+                return
+            assert first + self.LATENCY <= self.slot_of_change + self.LIFETIME
+
+            changes = (to_slot - first) / self.LIFETIME + Uint256(1)
+            self.pre = self.post if changes == Uint256(1) else fees
+            self.post = fees
+            self.slot_of_change = (
+                first + (changes - Uint256(1)) * self.LIFETIME + self.LATENCY
+            )
+
+        def queue_changes_at(
+            self,
+            from_slot: Uint256,
+            to_slot: Uint256,
+            fees_at: Callable[[Uint256], L1Fees],
+        ):
+            """
+            Same as calling `queue_change(slot, fees_at(slot))` for every slot in [from_slot, to_slot], in constant time.
+            Changes are queued every `LIFETIME` slots, so only the last two changes, within the last `2 * LIFETIME` slots,
+            are left in `pre` and `post`. The slots before them are skipped with `queue_changes`, which only moves `slot_of_change`.
+            """
+            tail = Uint256(2) * self.LIFETIME
+            slot = from_slot
+            if to_slot >= from_slot + tail:
+                slot = to_slot - tail + Uint256(1)
+                self.queue_changes(from_slot, slot - Uint256(1), fees_at(slot))
+            while slot <= to_slot:
+                self.queue_change(slot, fees_at(slot))
+                slot += Uint256(1)
+
     # New fee asset pricing constants
     ETH_PER_FEE_ASSET_PRECISION = Uint256(int(1e12))
     MIN_ETH_PER_FEE_ASSET = Uint256(
@@ -490,6 +1035,43 @@ def _(
             default_factory=lambda: INITIAL_ETH_PER_FEE_ASSET
         )
 
+    @dataclass
+    class FeeHeaderHistory:
+        """
+        The most recent `capacity` fee headers, the model itself only ever looks at the last two.
+        Indexing works like a list over the headers still held, e.g., `[-1]` is the latest and `[-2]` its parent.
+        When a header is evicted it is passed to `sink` (if any), for callers that need the full history.
+        """
+
+        capacity: StrictInt = 64
+        sink: Optional[Callable[[FeeHeader], None]] = None
+        headers: Deque[FeeHeader] = Field(default_factory=lambda: deque([FeeHeader()]))
+        # Number of headers appended, including the evicted ones
+        count: StrictInt = 1
+
+        @field_validator("capacity")
+        def check_capacity(cls, v):
+            if v < 2:
+                raise ValueError(f"Capacity must hold at least 2 headers, got {v}")
+            return v
+
+        def append(self, header: FeeHeader):
+            if len(self.headers) == self.capacity:
+                evicted = self.headers.popleft()
+                if self.sink is not None:
+                    self.sink(evicted)
+            self.headers.append(header)
+            self.count += 1
+
+        def __getitem__(self, index: int) -> FeeHeader:
+            return self.headers[index]
+
+        def __len__(self) -> int:
+            return len(self.headers)
+
+        def __iter__(self):
+            return iter(self.headers)
+
     @json_serializable
     @dataclass
     class ManaBaseFeeComponents:
@@ -498,22 +1080,56 @@ def _(
         congestion_cost: Uint256
         congestion_multiplier: Uint256
 
+    @json_serializable
+    @dataclass
+    class FeeQuote:
+        """
+        The mana base fee components in the current slot, and bounds on them in `slot_number`, see `FeeModel.quote`.
+        """
+
+        slot_number: Uint256
+        current: ManaBaseFeeComponents
+        lower: ManaBaseFeeComponents
+        upper: ManaBaseFeeComponents
+
+        def mana_base_fee_bounds(self) -> tuple[Uint256, Uint256]:
+            return tuple(
+                c.sequencer_cost + c.prover_cost + c.congestion_cost
+                for c in (self.lower, self.upper)
+            )
+
     @json_serializable
     @dataclass
     class OracleInput:
         fee_asset_price_modifier: Int256
 
+    @json_serializable
+    @dataclass
+    class CongestionPolicy:
+        """
+        Maps the excess mana to a congestion multiplier with `CONGESTION_MULTIPLIER_DIVISOR` precision.
+        The default is the fake exponential, subclass it and override `multiplier` to try other functions.
+        `multiplier_float` is the same function in float64 over an array of excess mana, for `Float64FeeModel`.
+        """
+
+        def multiplier(self, excess_mana: Uint256, update_fraction: Uint256) -> Uint256:
+            return fake_exponential(Uint256(int(1e9)), excess_mana, update_fraction)
+
+        def multiplier_float(self, excess_mana, update_fraction: float):
+            return 1e9 * np.exp(excess_mana / update_fraction)
+
     @dataclass
     class FeeModel:
         """
-        The fee model here will not be perfect, it does not take into account for example that there might be slots with no txs, in reality
-        it should be possible for the model, to take this into account mainly impact the `calc_excess_mana` function.
+        The fee model here will not be perfect, but it is close to what we will be running on L1.
+        Slots without a block are added with `add_slot(None)`, or for a run of empty slots, in one go with `add_empty_slots`.
         """
 
         AZTEC_SLOT_DURATION = Uint256(36)
         AZTEC_EPOCH_DURATION = Uint256(32)
         CONGESTION_MULTIPLIER_DIVISOR = Uint256(int(1e9))
         GAS_PER_BLOB = Uint256(2**17)
+        UPDATE_FRACTION_SCALE = Uint256(854_700_854)
 
         mana_target: Uint256
         l1_gas_per_block_proposed: Uint256
@@ -525,7 +1141,15 @@ def _(
         # Below is mutable
         current_timestamp: Uint256
         l1_gas_oracle: L1GasOracle
-        fee_headers: List[FeeHeader] = Field(default_factory=lambda: [FeeHeader()])
+        fee_headers: FeeHeaderHistory = Field(default_factory=FeeHeaderHistory)
+
+        congestion_policy: CongestionPolicy = Field(default_factory=CongestionPolicy)
+        slot_duration: Uint256 = Field(
+            default_factory=lambda: FeeModel.AZTEC_SLOT_DURATION
+        )
+        update_fraction_scale: Uint256 = Field(
+            default_factory=lambda: FeeModel.UPDATE_FRACTION_SCALE
+        )
 
         def set_timestamp(self, timestamp: Uint256):
             self.current_timestamp = timestamp
@@ -533,7 +1157,7 @@ def _(
         def current_slot_number(self) -> Uint256:
             return (
                 self.current_timestamp - self.genesis_timestamp
-            ) / FeeModel.AZTEC_SLOT_DURATION
+            ) / self.slot_duration
 
         def photograph(self, l1_fees: L1Fees):
             self.l1_gas_oracle.queue_change(self.current_slot_number(), l1_fees)
@@ -545,13 +1169,18 @@ def _(
             """
             A bit of magic for the fake exponential and integer math. Computing the divisor this way should ensure
             that the multiplier will increase by at most a factor of ~ 1.125 every block.
+            The scale defaults to `UPDATE_FRACTION_SCALE` but is a field such that it can be tuned.
             """
-            return Uint256((self.mana_target.value * 854_700_854) // 100_000_000)
+            return Uint256(
+                (self.mana_target.value * self.update_fraction_scale.value)
+                // 100_000_000
+            )
 
         def compute_sequencer_costs(
-            self, block: Optional[Block], real=False
+            self, block: Optional[Block], real=False, l1_fees: Optional[L1Fees] = None
         ) -> Uint256:
-            l1_fees = self.current_l1_fees()
+            if l1_fees is None:
+                l1_fees = self.current_l1_fees()
 
             l1_gas = self.l1_gas_per_block_proposed
             execution = l1_gas * l1_fees.base_fee
@@ -571,8 +1200,9 @@ def _(
                 Uint256(1), self.mana_target, round_up=True
             )
 
-        def compute_prover_costs(self):
-            l1_fees = self.current_l1_fees()
+        def compute_prover_costs(self, l1_fees: Optional[L1Fees] = None):
+            if l1_fees is None:
+                l1_fees = self.current_l1_fees()
             l1_gas = self.l1_gas_per_epoch_verified
             execution = l1_gas.mul_div(
                 l1_fees.base_fee, FeeModel.AZTEC_EPOCH_DURATION, round_up=True
@@ -588,17 +1218,29 @@ def _(
             """
             return self.fee_headers[-1].eth_per_fee_asset
 
+        def congestion_multiplier(self) -> Uint256:
+            return self.congestion_policy.multiplier(
+                self.calc_excess_mana(), self.fee_update_fraction()
+            )
+
         def mana_base_fee_components(
-            self, block: Optional[Block], in_fee_asset: bool = False
+            self,
+            block: Optional[Block],
+            in_fee_asset: bool = False,
+            l1_fees: Optional[L1Fees] = None,
+            congestion_multiplier: Optional[Uint256] = None,
+            eth_per_fee_asset: Optional[Uint256] = None,
         ) -> ManaBaseFeeComponents:
-            sequencer_cost = self.compute_sequencer_costs(block, real=True)
-            prover_cost = self.compute_prover_costs()
-
-            congestion_multiplier = fake_exponential(
-                Uint256(int(1e9)),
-                self.calc_excess_mana(),
-                self.fee_update_fraction(),
+            """
+            The components at the current state, the L1 fees, multiplier and price can be overridden to evaluate other states.
+            """
+            sequencer_cost = self.compute_sequencer_costs(
+                block, real=True, l1_fees=l1_fees
             )
+            prover_cost = self.compute_prover_costs(l1_fees)
+
+            if congestion_multiplier is None:
+                congestion_multiplier = self.congestion_multiplier()
 
             total = sequencer_cost + prover_cost
 
@@ -610,7 +1252,9 @@ def _(
                 # Convert from wei (ETH) to fee asset using ETH/AZTEC ratio
                 # fee_asset = wei * ETH_PER_FEE_ASSET_PRECISION / eth_per_fee_asset
                 # We round up to ensure the fee is always enough
-                eth_price = self.eth_per_fee_asset()
+                eth_price = eth_per_fee_asset
+                if eth_price is None:
+                    eth_price = self.eth_per_fee_asset()
                 return ManaBaseFeeComponents(
                     sequencer_cost=sequencer_cost.mul_div(
                         ETH_PER_FEE_ASSET_PRECISION, eth_price, round_up=True
@@ -652,16 +1296,79 @@ def _(
                 )
             return components.sequencer_cost + components.prover_cost
 
-        def calc_excess_mana(self) -> Uint256:
+        def quote(
+            self, slots_ahead: Uint256 = Uint256(0), in_fee_asset: bool = False
+        ) -> FeeQuote:
+            """
+            The mana base fee components (of an empty block) now, and bounds on them `slots_ahead` slots from now.
+            Every slot in between moves the excess mana by at most `mana_target` (a block spends at most twice the target),
+            so the congestion multiplier stays between the multipliers at those bounds, e.g., at most ~1.125 times higher per slot.
+            The L1 fees are the oracle's `pre` or `post` until `l1_gas_oracle.known_until`, further out they are not known yet and we raise.
+            The fee asset price moves at most ±1% per slot.
+            Assumes the current slot has been photographed, and a congestion policy that does not decrease with the excess mana.
+            The work does not depend on the history, e.g., a quote takes about as long as `mana_base_fee_components`.
+            """
+            slot_number = self.current_slot_number()
+            quoted_slot = slot_number + slots_ahead
+            known_until = self.l1_gas_oracle.known_until(slot_number)
+            if quoted_slot > known_until:
+                raise ValueError(
+                    f"Cannot quote slot {quoted_slot.value}, the L1 fees are only known until slot {known_until.value}"
+                )
+            l1_fees = self.l1_gas_oracle.value_at(quoted_slot)
+
+            excess = self.calc_excess_mana()
+            change = self.mana_target * slots_ahead
+            update_fraction = self.fee_update_fraction()
+            multipliers = (
+                self.congestion_policy.multiplier(
+                    excess - change if excess > change else Uint256(0), update_fraction
+                ),
+                self.congestion_policy.multiplier(excess + change, update_fraction),
+            )
+
+            # Every step is floored, so the lowest price may be up to a wei per step below the exact product
+            n = slots_ahead.value
+            bps = MAX_FEE_ASSET_PRICE_MODIFIER_BPS.value
+            price = self.eth_per_fee_asset().value
+            prices = (
+                max(
+                    MIN_ETH_PER_FEE_ASSET.value,
+                    price * (10000 - bps) ** n // 10000**n - n,
+                ),
+                min(
+                    MAX_ETH_PER_FEE_ASSET.value, price * (10000 + bps) ** n // 10000**n
+                ),
+            )
+            # A lower fee (in fee asset) comes with a higher price
+            lower, upper = (
+                self.mana_base_fee_components(
+                    None,
+                    in_fee_asset,
+                    l1_fees=l1_fees,
+                    congestion_multiplier=multiplier,
+                    eth_per_fee_asset=Uint256(eth_price),
+                )
+                for multiplier, eth_price in zip(multipliers, reversed(prices))
+            )
+            return FeeQuote(
+                slot_number=quoted_slot,
+                current=self.mana_base_fee_components(None, in_fee_asset),
+                lower=lower,
+                upper=upper,
+            )
+
+        def calc_excess_mana(self, empty_slots: Uint256 = Uint256(0)) -> Uint256:
             """
-            Calculate the excess mana in the last block.
-            Should be updated to take into account that there might be slots with no txs.
+            Calculate the excess mana in the last block, or after `empty_slots` empty slots following it.
+            An empty slot decays the excess by `mana_target` until it hits 0, so we can skip the whole run at once.
             """
             spent = self.fee_headers[-1].mana_used
             excess = self.fee_headers[-1].excess_mana
-            if excess + spent < self.mana_target:
+            target = self.mana_target * (empty_slots + Uint256(1))
+            if excess + spent < target:
                 return Uint256(0)
-            return excess + spent - self.mana_target
+            return excess + spent - target
 
         def add_slot(
             self, block: Optional[Block], oracle_input: Optional[OracleInput] = None
@@ -707,13 +1414,50 @@ def _(
             )
             self.fee_headers.append(new_header)
 
+        def add_empty_slots(
+            self,
+            count: Uint256,
+            l1_fees: Optional[L1Fees | Callable[[Uint256], L1Fees]] = None,
+        ):
+            """
+            Same as running `count` empty slots from the current one, e.g., for every slot photographing `l1_fees` (if given),
+            calling `add_slot(None)` and moving the timestamp to the next slot, but in constant time.
+            `l1_fees` is either fixed for the whole run, or a function giving the fees photographed in a slot.
+            The run is stored as a single fee header, equal to the header of the last of the empty slots.
+            """
+            if count == Uint256(0):
+                return
+            slot_number = self.current_slot_number()
+            if isinstance(l1_fees, L1Fees):
+                self.l1_gas_oracle.queue_changes(
+                    slot_number, slot_number + count - Uint256(1), l1_fees
+                )
+            elif l1_fees is not None:
+                self.l1_gas_oracle.queue_changes_at(
+                    slot_number, slot_number + count - Uint256(1), l1_fees
+                )
+
+            self.fee_headers.append(
+                FeeHeader(
+                    excess_mana=self.calc_excess_mana(count - Uint256(1)),
+                    mana_used=Uint256(0),
+                    eth_per_fee_asset=self.fee_headers[-1].eth_per_fee_asset,
+                )
+            )
+            self.set_timestamp(
+                self.genesis_timestamp + (slot_number + count) * self.slot_duration
+            )
+
     return (
         Block,
         BlockHeader,
+        CongestionPolicy,
         INITIAL_ETH_PER_FEE_ASSET,
         ETH_PER_FEE_ASSET_PRECISION,
         FeeHeader,
+        FeeHeaderHistory,
         FeeModel,
+        FeeQuote,
         L1Fees,
         L1GasOracle,
         MAX_ETH_PER_FEE_ASSET,
@@ -722,6 +1466,7 @@ def _(
         ManaBaseFeeComponents,
         OracleInput,
         Tx,
+        TxBatch,
     )
 
 
@@ -736,6 +1481,11 @@ def _(mo):
     We will keep collecting transactions from a "randomized" mempool until we have either reached the mana target, or the mempool size limit.
     We only collect transactions find the fee acceptable (another sampling) and don't force us beyond the limit.
     The size of the transactions are also drawn from a distribution.
+
+    All the randomness comes from seeded `RandomStreams`, so a run is reproducible.
+
+    Rather than visiting every L1 block, the simulation is driven by a `SlotScheduler` that maps the L1 blocks to slots up front.
+    We only act on the first L1 block of every slot, that is where we photograph the L1 fees for the oracle and build the block.
     """)
     return
 
@@ -769,184 +1519,540 @@ def _(Uint256):
 
 @app.cell
 def _(
-    BlockHeader,
-    FeeHeader,
+    CongestionPolicy,
+    FeeModel,
     L1Fees,
     L1GasOracle,
-    ManaBaseFeeComponents,
-    OracleInput,
+    Optional,
     Uint256,
-    dataclass,
-    json_serializable,
+    WEI_PER_MANA,
 ):
-    @json_serializable
-    @dataclass
-    class TestPointOutputs:
-        eth_per_fee_asset_at_execution: (
-            Uint256  # Price used for this checkpoint's fee calculation
+    def create_fee_model(
+        blocks,
+        oracle_cls: type = L1GasOracle,
+        congestion_policy: Optional[CongestionPolicy] = None,
+        slot_duration: Uint256 = FeeModel.AZTEC_SLOT_DURATION,
+        mana_target: Optional[Uint256] = None,
+        update_fraction_scale: Optional[Uint256] = None,
+    ) -> FeeModel:
+        """
+        The fee model with the parameters used throughout the notebook, starting at `blocks[0]`.
+        The oracle class, congestion policy, slot duration, mana target and update fraction scale can be swapped out to compare other setups.
+        """
+        return FeeModel(
+            mana_target=mana_target or Uint256(int(75_000_000)),
+            l1_gas_per_block_proposed=Uint256(int(300_000)),
+            l1_gas_per_epoch_verified=Uint256(int(3_600_000)),
+            proving_cost_per_mana=Uint256(int(WEI_PER_MANA)),
+            l1_gas_oracle=oracle_cls(
+                pre=L1Fees(blob_fee=Uint256(1), base_fee=Uint256(int(1e9))),
+                post=L1Fees(
+                    blob_fee=blocks[0].blob_fee,
+                    base_fee=blocks[0].base_fee,
+                ),
+                slot_of_change=oracle_cls.LIFETIME,
+            ),
+            genesis_timestamp=blocks[0].timestamp - slot_duration,
+            current_timestamp=blocks[0].timestamp,
+            congestion_policy=congestion_policy or CongestionPolicy(),
+            slot_duration=slot_duration,
+            update_fraction_scale=update_fraction_scale
+            or FeeModel.UPDATE_FRACTION_SCALE,
         )
-        mana_base_fee_components_in_wei: ManaBaseFeeComponents
-        mana_base_fee_components_in_fee_asset: ManaBaseFeeComponents
-        l1_fee_oracle_output: L1Fees  # value_at(now)
-        l1_gas_oracle_values: L1GasOracle
 
-    @json_serializable
-    @dataclass
-    class TestPoint:
-        block_header: BlockHeader
-        parent_fee_header: FeeHeader
-        fee_header: FeeHeader
-        oracle_input: OracleInput
-        outputs: TestPointOutputs
+    return (create_fee_model,)
+
+
+@app.cell
+def _(L1Trace, Uint256, np):
+    class SlotScheduler:
+        """
+        Maps the L1 blocks to slots once (a `searchsorted` of the slot boundaries over the timestamps), such that a
+        simulation only needs to act on the first L1 block of every slot rather than scanning every L1 block.
+        The first L1 block is the only one where the oracle can queue a change (at most one per slot) and the one at
+        which we are building the block.
+
+        Iterating gives `(slot_number, l1_block_index)` for every slot after `after_slot` that have an L1 block.
+        """
+
+        def __init__(
+            self,
+            timestamps,
+            genesis_timestamp: int,
+            slot_duration: int,
+            after_slot: int = 0,
+        ):
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            self.slot_duration = slot_duration
+            self.l1_block_slots = (timestamps - genesis_timestamp) // slot_duration
+
+            slots = np.arange(
+                max(after_slot + 1, self.l1_block_slots[0]),
+                self.l1_block_slots[-1] + 1,
+            )
+            boundaries = genesis_timestamp + slots * slot_duration
+            first_index = np.searchsorted(timestamps, boundaries, side="left")
+            has_l1_block = timestamps[first_index] < boundaries + slot_duration
+
+            self.slot_numbers = slots[has_l1_block]
+            self.l1_block_indices = first_index[has_l1_block]
+
+        @classmethod
+        def for_model(cls, blocks, fee_model, after_slot: int = 0):
+            return cls(
+                blocks.timestamp
+                if isinstance(blocks, L1Trace)
+                else [b.timestamp.value for b in blocks],
+                fee_model.genesis_timestamp.value,
+                fee_model.slot_duration.value,
+                after_slot,
+            )
+
+        def __len__(self) -> int:
+            return len(self.slot_numbers)
+
+        def __iter__(self):
+            for slot_number, index in zip(
+                self.slot_numbers.tolist(), self.l1_block_indices.tolist()
+            ):
+                yield Uint256(slot_number), index
+
+    return (SlotScheduler,)
+
+
+@app.cell
+def _(
+    BlockHeader,
+    FeeHeader,
+    L1Fees,
+    L1GasOracle,
+    ManaBaseFeeComponents,
+    OracleInput,
+    Uint256,
+    dataclass,
+    json_serializable,
+):
+    @json_serializable
+    @dataclass
+    class TestPointOutputs:
+        eth_per_fee_asset_at_execution: (
+            Uint256  # Price used for this checkpoint's fee calculation
+        )
+        mana_base_fee_components_in_wei: ManaBaseFeeComponents
+        mana_base_fee_components_in_fee_asset: ManaBaseFeeComponents
+        l1_fee_oracle_output: L1Fees  # value_at(now)
+        l1_gas_oracle_values: L1GasOracle
+
+    @json_serializable
+    @dataclass
+    class TestPoint:
+        block_header: BlockHeader
+        parent_fee_header: FeeHeader
+        fee_header: FeeHeader
+        oracle_input: OracleInput
+        outputs: TestPointOutputs
 
     return TestPoint, TestPointOutputs
 
 
+@app.cell
+def _(random):
+    class RandomStreams:
+        """
+        Independent random streams per component (e.g. "mempool", "tx_mana", "fee_acceptance" and "oracle"), all derived from one seed.
+        A stream can further be keyed, e.g., by slot number, such that a component sees the same draws in that slot no matter how
+        many draws other components (or earlier slots) made. Two runs with the same seed, but different parameters, therefore
+        see the same demand (common random numbers).
+        """
+
+        def __init__(self, seed: int = 0):
+            self.seed = seed
+            self.streams = {}
+
+        def stream(self, name: str, *keys) -> random.Random:
+            # Seeding with a string hashes it with sha512, so this is stable across processes
+            if keys:
+                return random.Random(f"{self.seed}/{name}/{'/'.join(map(str, keys))}")
+            if name not in self.streams:
+                self.streams[name] = random.Random(f"{self.seed}/{name}")
+            return self.streams[name]
+
+    return (RandomStreams,)
+
+
 @app.cell
 def _(
     Block,
-    FeeModel,
     Int256,
     L1Fees,
-    L1GasOracle,
     MANA_PER_BASE_TX,
     OracleInput,
+    SlotScheduler,
     TestPoint,
     TestPointOutputs,
-    Tx,
+    TxBatch,
     Uint256,
-    WEI_PER_MANA,
-    blocks,
     random,
 ):
-    fee_model = FeeModel(
-        mana_target=Uint256(int(75_000_000)),
-        l1_gas_per_block_proposed=Uint256(int(300_000)),
-        l1_gas_per_epoch_verified=Uint256(int(3_600_000)),
-        proving_cost_per_mana=Uint256(int(WEI_PER_MANA)),
-        l1_gas_oracle=L1GasOracle(
-            pre=L1Fees(blob_fee=Uint256(1), base_fee=Uint256(int(1e9))),
-            post=L1Fees(
-                blob_fee=blocks[0].blob_fee,
-                base_fee=blocks[0].base_fee,
-            ),
-            slot_of_change=L1GasOracle.LIFETIME,
-        ),
-        genesis_timestamp=blocks[0].timestamp - FeeModel.AZTEC_SLOT_DURATION,
-        current_timestamp=blocks[0].timestamp,
-    )
-
     def generate_random_with_min(
-        mean: Uint256, std_dev: Uint256, min_value: Uint256
+        rng: random.Random, mean: Uint256, std_dev: Uint256, min_value: Uint256
     ) -> Uint256:
         while True:
-            value = int(random.gauss(mean.value, std_dev.value))
+            value = int(rng.gauss(mean.value, std_dev.value))
             if value >= min_value.value:
                 return Uint256(value)
 
     MEMPOOL_SIZE = 5000
 
-    l2_blocks = []
-    test_points = []
+    # The draws of the randomized mempool, shared by `randomized_txs` and the `SlotDemand` of the policy evaluation
+    def sample_planned_mana(rng: random.Random, mana_target: Uint256) -> Uint256:
+        return min(
+            generate_random_with_min(rng, mana_target, mana_target, Uint256(0)),
+            mana_target * Uint256(2),
+        )
+
+    def sample_tx_mana(rng: random.Random) -> Uint256:
+        return generate_random_with_min(
+            rng,
+            MANA_PER_BASE_TX * Uint256(2),
+            Uint256(500_000),
+            MANA_PER_BASE_TX,
+        )
+
+    def sample_acceptable_fee(rng: random.Random, real_cost: Uint256) -> Uint256:
+        return generate_random_with_min(
+            rng, real_cost, Uint256(2) * real_cost, Uint256(0)
+        )
+
+    def randomized_txs(
+        streams,
+        slot_number: Uint256,
+        mana_target: Uint256,
+        real_cost: Uint256,
+        mana_base_fee: Uint256,
+        scale: float = 1.0,
+    ) -> TxBatch:
+        """
+        The txs of a block built from a randomized mempool, until the planned mana is reached or the mempool is exhausted.
+        `scale` multiplies the planned mana (and its cap) and the mempool size, e.g., 2 for twice the demand at every price.
+        The block never spends more than twice the target.
+        """
+        mempool_rng = streams.stream("mempool", slot_number.value)
+        tx_mana_rng = streams.stream("tx_mana", slot_number.value)
+        fee_acceptance_rng = streams.stream("fee_acceptance", slot_number.value)
+
+        mana_spent_block = Uint256(0)
+        mana_planned_for_block = sample_planned_mana(mempool_rng, mana_target)
+        if scale != 1:
+            mana_planned_for_block = Uint256(int(mana_planned_for_block.value * scale))
+        mempool_size = int(MEMPOOL_SIZE * scale)
+
+        txs = []
+        count = 0
+
+        while (
+            abs(mana_planned_for_block.value - mana_spent_block.value)
+            >= MANA_PER_BASE_TX.value
+            and count < mempool_size
+        ):
+            count += 1
+            mana_spent_tx = sample_tx_mana(tx_mana_rng)
+            within_bounds = mana_spent_tx + mana_spent_block <= mana_target * Uint256(2)
+            acceptable_mana_base_fee = sample_acceptable_fee(
+                fee_acceptance_rng, real_cost
+            )
 
-    last_slot = Uint256(0)
+            is_fee_acceptable = acceptable_mana_base_fee >= mana_base_fee
 
-    for l1_block in blocks:
+            if within_bounds and is_fee_acceptable:
+                txs.append(mana_spent_tx.value)
+                mana_spent_block += mana_spent_tx
+        return TxBatch(mana_spent=txs)
+
+    def simulate_slot(
+        fee_model, l1_block, slot_number, block_number, streams, demand=None
+    ):
+        """
+        Photographs the L1 fees at the first L1 block of the slot, and builds a block from a randomized mempool.
+        A `demand` replaces the randomized mempool, it is called as `demand(timestamp, real_cost, mana_base_fee, mana_target)`
+        and returns the txs of the block as a `TxBatch`.
+        Returns the block and its test point.
+        """
         fee_model.set_timestamp(l1_block.timestamp)
-        # We try to photograph the l1 fees at every l1 block
+        # The first l1 block of the slot is the only one where the oracle can queue a change
         fee_model.photograph(
             L1Fees(blob_fee=l1_block.blob_fee, base_fee=l1_block.base_fee)
         )
 
-        slot_number = fee_model.current_slot_number()
+        oracle_rng = streams.stream("oracle", slot_number.value)
+
+        cost = fee_model.mana_base_fee_components(None)
+        cost_in_fee_asset = fee_model.mana_base_fee_components(None, in_fee_asset=True)
 
-        # We are in the next slot, let us create a block!
-        if slot_number > last_slot:
-            last_slot = slot_number
+        real_cost = cost.sequencer_cost + cost.prover_cost
+        mana_base_fee = real_cost + cost.congestion_cost
 
-            cost = fee_model.mana_base_fee_components(None)
-            cost_in_fee_asset = fee_model.mana_base_fee_components(
-                None, in_fee_asset=True
+        if demand is not None:
+            txs = demand(
+                l1_block.timestamp, real_cost, mana_base_fee, fee_model.mana_target
             )
+        else:
+            txs = randomized_txs(
+                streams, slot_number, fee_model.mana_target, real_cost, mana_base_fee
+            )
+
+        block = Block(
+            l1_block_number=l1_block.number,
+            timestamp=l1_block.timestamp,
+            slot_number=slot_number,
+            block_number=block_number,
+            txs=txs,
+        )
 
-            real_cost = cost.sequencer_cost + cost.prover_cost
-            mana_base_fee = real_cost + cost.congestion_cost
+        # Deciding oracle movements. Modifier is in basis points (-100 to +100, representing -1% to +1%)
+        # Using a Gaussian distribution centered slightly above 0 to simulate typical price movement
+        oracle_input = OracleInput(
+            fee_asset_price_modifier=Int256(
+                int(max(-100, min(100, oracle_rng.gauss(1, 50))))
+            ),
+        )
 
-            mana_spent_block = Uint256(0)
-            mana_planned_for_block = min(
-                generate_random_with_min(
-                    fee_model.mana_target,
-                    fee_model.mana_target,
-                    Uint256(0),
-                ),
-                fee_model.mana_target * Uint256(2),
+        eth_per_fee_asset_at_execution = fee_model.eth_per_fee_asset()
+        fee_model.add_slot(block, oracle_input)
+
+        test_point = TestPoint(
+            block_header=block.compute_header(),
+            fee_header=fee_model.fee_headers[-1],
+            parent_fee_header=fee_model.fee_headers[-2],
+            oracle_input=oracle_input,
+            outputs=TestPointOutputs(
+                eth_per_fee_asset_at_execution=eth_per_fee_asset_at_execution,
+                mana_base_fee_components_in_wei=cost,
+                mana_base_fee_components_in_fee_asset=cost_in_fee_asset,
+                l1_fee_oracle_output=fee_model.current_l1_fees(),
+                l1_gas_oracle_values=fee_model.l1_gas_oracle.copy(),
+            ),
+        )
+        return block, test_point
+
+    def simulate(
+        blocks, fee_model, streams, sinks=(), demand=None, after_slot=0, block_number=0
+    ):
+        """
+        Runs the fee model over the L1 blocks, building a block every slot.
+        Every sink is called with `(l1_block, block, test_point)` for every slot, e.g., to collect statistics along the way.
+        See `simulate_slot` for the `demand`.
+        To continue a model that already has blocks, pass the slot and the number of its last block.
+        """
+        l2_blocks = []
+        test_points = []
+        for slot_number, l1_block_index in SlotScheduler.for_model(
+            blocks, fee_model, after_slot
+        ):
+            # We are in the next slot, let us create a block!
+            block, test_point = simulate_slot(
+                fee_model,
+                blocks[l1_block_index],
+                slot_number,
+                Uint256(block_number + len(l2_blocks) + 1),
+                streams,
+                demand,
             )
+            for sink in sinks:
+                sink(blocks[l1_block_index], block, test_point)
+            l2_blocks.append(block)
+            test_points.append(test_point)
+        return l2_blocks, test_points
 
-            txs = []
-            count = 0
+    return (
+        MEMPOOL_SIZE,
+        randomized_txs,
+        sample_acceptable_fee,
+        sample_planned_mana,
+        sample_tx_mana,
+        simulate,
+        simulate_slot,
+    )
 
-            while (
-                abs(mana_planned_for_block.value - mana_spent_block.value)
-                >= MANA_PER_BASE_TX.value
-                and count < MEMPOOL_SIZE
-            ):
-                count += 1
-                mana_spent_tx = generate_random_with_min(
-                    MANA_PER_BASE_TX * Uint256(2),
-                    Uint256(500_000),
-                    MANA_PER_BASE_TX,
-                )
-                within_bounds = (
-                    mana_spent_tx + mana_spent_block
-                    <= fee_model.mana_target * Uint256(2)
-                )
-                acceptable_mana_base_fee = generate_random_with_min(
-                    real_cost, Uint256(2) * real_cost, Uint256(0)
-                )
 
-                is_fee_acceptable = acceptable_mana_base_fee >= mana_base_fee
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    The simulation outputs are cached on disk, keyed by a hash of the model (its parameters and constants), the L1 trace and the seed.
+    Rerunning with the same inputs, also after restarting the notebook, loads the results instead of simulating again.
+    The key also includes the code, e.g., the notebook itself and the shared modules, so changing the model (or any other code) invalidates the cache.
+    Use `sim_cache.clear()` to free the space taken by the stale entries, otherwise they are evicted once the cache grows beyond its size limit.
+    """)
+    return
 
-                if within_bounds and is_fee_acceptable:
-                    txs.append(Tx(mana_spent=mana_spent_tx))
-                    mana_spent_block += mana_spent_tx
 
-            block = Block(
-                l1_block_number=l1_block.number,
-                timestamp=l1_block.timestamp,
-                slot_number=slot_number,
-                block_number=Uint256(len(l2_blocks) + 1),
-                txs=txs,
-            )
-
-            # Deciding oracle movements. Modifier is in basis points (-100 to +100, representing -1% to +1%)
-            # Using a Gaussian distribution centered slightly above 0 to simulate typical price movement
-            oracle_input = OracleInput(
-                fee_asset_price_modifier=Int256(
-                    int(max(-100, min(100, random.gauss(1, 50))))
-                ),
-            )
+@app.cell
+def _(Callable, L1Trace, hashlib, mo, np, os, pickle, re):
+    class DiskCache:
+        """
+        A content addressed cache on disk. Values are pickled into a file named by the sha256 of their key,
+        and the least recently used files are evicted when the directory grows beyond `max_bytes`.
+        Every key includes the contents of the `code_paths`, e.g., the notebook itself, so editing the code
+        that computes the values never serves stale results.
+        """
 
-            eth_per_fee_asset_at_execution = fee_model.eth_per_fee_asset()
-            fee_model.add_slot(block, oracle_input)
-
-            test_points.append(
-                TestPoint(
-                    block_header=block.compute_header(),
-                    fee_header=fee_model.fee_headers[-1],
-                    parent_fee_header=fee_model.fee_headers[-2],
-                    oracle_input=oracle_input,
-                    outputs=TestPointOutputs(
-                        eth_per_fee_asset_at_execution=eth_per_fee_asset_at_execution,
-                        mana_base_fee_components_in_wei=cost,
-                        mana_base_fee_components_in_fee_asset=cost_in_fee_asset,
-                        l1_fee_oracle_output=fee_model.current_l1_fees(),
-                        l1_gas_oracle_values=fee_model.l1_gas_oracle.copy(),
-                    ),
+        def __init__(self, directory: str, max_bytes: int = 2**30, code_paths=()):
+            self.directory = directory
+            self.max_bytes = max_bytes
+            self.code_version = self.file_digest(*code_paths)
+            os.makedirs(directory, exist_ok=True)
+
+        @staticmethod
+        def file_digest(*paths) -> str:
+            h = hashlib.sha256()
+            for path in sorted(map(str, paths)):
+                with open(path, "rb") as f:
+                    data = f.read()
+                h.update(len(data).to_bytes(8, "big"))
+                h.update(data)
+            return h.hexdigest()
+
+        @staticmethod
+        def digest(*parts) -> str:
+            h = hashlib.sha256()
+            for part in parts:
+                if isinstance(part, np.ndarray):
+                    data = f"{part.dtype}{part.shape}".encode() + part.tobytes()
+                elif isinstance(part, L1Trace):
+                    data = b"".join(getattr(part, f).tobytes() for f in part.FIELDS)
+                else:
+                    text = repr(part)
+                    # The default repr contains the address, which differs every run so the key would never hit
+                    if re.search(r" at 0x[0-9a-fA-F]+", text):
+                        raise ValueError(
+                            f"Cannot use {text} in a cache key, its repr depends on its address"
+                        )
+                    data = text.encode()
+                h.update(len(data).to_bytes(8, "big"))
+                h.update(data)
+            return h.hexdigest()
+
+        @staticmethod
+        def constants(obj) -> dict:
+            """
+            The upper case class attributes of the object and its fields, e.g., `AZTEC_SLOT_DURATION` or the oracle `LIFETIME`.
+            """
+            found = {}
+            for value in [obj, *vars(obj).values()]:
+                for cls in reversed(type(value).__mro__):
+                    for name, attr in vars(cls).items():
+                        if name.isupper():
+                            found[f"{cls.__qualname__}.{name}"] = attr
+            return found
+
+        def get_or_compute(self, compute: Callable, *parts):
+            path = os.path.join(
+                self.directory, f"{self.digest(self.code_version, *parts)}.pkl"
+            )
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                # Touch it, the modification time is what the eviction orders by
+                os.utime(path)
+                return value
+
+            value = compute()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(value, f)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                # E.g., classes created inside a function cannot be pickled, we just don't cache those
+                os.remove(tmp_path)
+                print(
+                    f"Not caching {os.path.basename(path)}, the value cannot be pickled: {e}"
                 )
+                return value
+            os.replace(tmp_path, path)
+            self.evict()
+            return value
+
+        def evict(self):
+            entries = sorted(
+                (e.stat().st_mtime, e.stat().st_size, e.path)
+                for e in os.scandir(self.directory)
+                if e.name.endswith(".pkl")
             )
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry_path in entries:
+                if total <= self.max_bytes:
+                    break
+                os.remove(entry_path)
+                total -= size
+
+        def clear(self):
+            for e in os.scandir(self.directory):
+                os.remove(e.path)
+
+    # The notebook and the shared modules it imports
+    sim_cache = DiskCache(
+        ".sim_cache",
+        code_paths=[
+            __file__,
+            *(mo.notebook_dir().parents[1] / "shared").glob("*.py"),
+        ],
+    )
+    return DiskCache, sim_cache
 
-            l2_blocks.append(block)
-    return fee_model, l2_blocks, test_points
+
+@app.cell
+def _(
+    BlobPacker,
+    MANA_PER_BASE_TX,
+    MEMPOOL_SIZE,
+    OnlineStatsSink,
+    RandomStreams,
+    blocks,
+    create_fee_model,
+    sim_cache,
+    simulate,
+):
+    _seed = 0
+    _blob_packer_configs = [
+        (max_delay, split_blocks)
+        for max_delay in (0, 1, 2, 4, 8)
+        for split_blocks in (True, False)
+    ]
+
+    def _simulate():
+        fee_model = create_fee_model(blocks)
+        blob_packers = {config: BlobPacker(*config) for config in _blob_packer_configs}
+        online_stats = OnlineStatsSink(fee_model.AZTEC_EPOCH_DURATION.value)
+        l2_blocks, test_points = simulate(
+            blocks,
+            fee_model,
+            RandomStreams(_seed),
+            sinks=[*blob_packers.values(), online_stats],
+        )
+        for packer in blob_packers.values():
+            packer.finish(blocks[-1].blob_fee.value)
+        online_stats.finish()
+        return fee_model, l2_blocks, test_points, blob_packers, online_stats
+
+    _initial_model = create_fee_model(blocks)
+    (
+        fee_model,
+        l2_blocks,
+        test_points,
+        blob_packers,
+        online_stats,
+    ) = sim_cache.get_or_compute(
+        _simulate,
+        "simulate",
+        _initial_model,
+        sim_cache.constants(_initial_model),
+        MANA_PER_BASE_TX,
+        MEMPOOL_SIZE,
+        blocks,
+        _seed,
+        _blob_packer_configs,
+    )
+    return blob_packers, fee_model, l2_blocks, online_stats, test_points
 
 
 @app.cell(hide_code=True)
@@ -1100,140 +2206,3278 @@ def _(block_numbers, blocks, l2_blocks, plt, test_points):
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
-    ## Points of interest
-
-    - The multiplier makes the base fee more unstable, it might be better to consider a different function to see if we can stabilize it.
-    """)
-    return
+    ## Fee quotes
 
+    A wallet wants to know the mana base fee at the time its tx lands, which may be a few slots after it is sent.
+    `FeeModel.quote(slots_ahead)` gives the current components with lower and upper bounds on them `slots_ahead` slots from now, computed from the current state alone.
+    The bounds hold whatever blocks and price updates come in between, but only as far as the oracle has already fixed the L1 fees (`L1GasOracle.known_until`).
 
-@app.cell(hide_code=True)
-def _(mo):
-    mo.md(r"""
-    ## To test with sol
+    Below we check the bounds against the simulation, quoting from every slot for every slot until the horizon.
     """)
     return
 
 
 @app.cell
 def _(
-    INITIAL_ETH_PER_FEE_ASSET,
-    ETH_PER_FEE_ASSET_PRECISION,
-    MAX_ETH_PER_FEE_ASSET,
-    MAX_FEE_ASSET_PRICE_MODIFIER_BPS,
-    MIN_ETH_PER_FEE_ASSET,
-    fee_model,
+    L1Fees,
+    RandomStreams,
+    SlotScheduler,
+    Uint256,
+    blocks,
+    create_fee_model,
+    deepcopy,
+    simulate_slot,
 ):
-    # Constants for the fee maths!
-    def get_solidity_code():
-        return f"""
-        uint256 internal constant PROVING_COST_PER_MANA = {fee_model.proving_cost_per_mana.to_dict()};
+    def check_fee_quotes(count: int = 120, seed: int = 0):
+        fee_model = create_fee_model(blocks[:count])
+        streams = RandomStreams(seed)
+        quotes = []
+        outputs = {}
+        for slot_number, index in SlotScheduler.for_model(blocks[:count], fee_model):
+            l1_block = blocks[index]
+            # Quote from the state after photographing the slot, the same state the block is built on
+            quoting = deepcopy(fee_model)
+            quoting.set_timestamp(l1_block.timestamp)
+            quoting.photograph(
+                L1Fees(blob_fee=l1_block.blob_fee, base_fee=l1_block.base_fee)
+            )
+            horizon = quoting.l1_gas_oracle.known_until(slot_number) - slot_number
+            for n in range(horizon.value + 1):
+                quotes.append(
+                    (
+                        quoting.quote(Uint256(n)),
+                        quoting.quote(Uint256(n), in_fee_asset=True),
+                    )
+                )
 
-        // Fee asset pricing constants (ETH/AZTEC ratio with 1e12 precision)
-        uint256 internal constant ETH_PER_FEE_ASSET_PRECISION = {ETH_PER_FEE_ASSET_PRECISION.to_dict()};
-        uint256 internal constant MIN_ETH_PER_FEE_ASSET = {MIN_ETH_PER_FEE_ASSET.to_dict()};
-        uint256 internal constant MAX_ETH_PER_FEE_ASSET = {MAX_ETH_PER_FEE_ASSET.to_dict()};
-        int256 internal constant MAX_FEE_ASSET_PRICE_MODIFIER_BPS = {MAX_FEE_ASSET_PRICE_MODIFIER_BPS.to_dict()};
-        uint256 internal constant INITIAL_ETH_PER_FEE_ASSET = {INITIAL_ETH_PER_FEE_ASSET.to_dict()};
+            _, test_point = simulate_slot(
+                fee_model, l1_block, slot_number, Uint256(len(outputs) + 1), streams
+            )
+            outputs[slot_number.value] = test_point.outputs
+
+        checked = 0
+        for quote_in_wei, quote_in_fee_asset in quotes:
+            if quote_in_wei.slot_number.value not in outputs:
+                continue
+            out = outputs[quote_in_wei.slot_number.value]
+            for quote, actual in (
+                (quote_in_wei, out.mana_base_fee_components_in_wei),
+                (quote_in_fee_asset, out.mana_base_fee_components_in_fee_asset),
+            ):
+                for name in (
+                    "sequencer_cost",
+                    "prover_cost",
+                    "congestion_cost",
+                    "congestion_multiplier",
+                ):
+                    lower, value, upper = (
+                        getattr(c, name) for c in (quote.lower, actual, quote.upper)
+                    )
+                    assert lower <= value <= upper, (quote, name, value)
+            checked += 1
+        return checked
+
+    return (check_fee_quotes,)
+
+
+@app.cell
+def _(Uint256, check_fee_quotes, fee_model, mo, time):
+    def _quotes_per_second(duration: float = 0.5):
+        horizon = (
+            fee_model.l1_gas_oracle.known_until(fee_model.current_slot_number())
+            - fee_model.current_slot_number()
+        )
+        quotes = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            fee_model.quote(Uint256(quotes % (horizon.value + 1)))
+            quotes += 1
+        return quotes / (time.perf_counter() - start)
+
+    _lower, _upper = fee_model.quote(Uint256(1)).mana_base_fee_bounds()
+    mo.md(
+        f"""
+        {check_fee_quotes()} quotes checked against the simulation, all within bounds.
+        At the end of the run the mana base fee next slot is between {_lower.value} and {_upper.value} wei, at {_quotes_per_second():.0f} quotes per second.
         """
+    )
+    return
 
-    get_solidity_code()
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    The same quotes are served over a local socket by `quote_server.py`, to test wallet and sequencer integrations against the model.
+    It runs the cell below (and the cells it depends on) without the rest of the notebook, and advances the model over a synthetic L1 trace, so it works offline.
+    See `quote_benchmark.py` for a load generator.
+    """)
     return
 
 
 @app.cell
-def _(
+def quote_server_refs(
+    Block,
+    Int256,
+    L1Fees,
+    L1Trace,
+    OracleInput,
+    SlotScheduler,
+    TxBatch,
     Uint256,
-    blocks,
-    dataclass,
-    fee_model,
-    json,
-    json_serializable,
-    test_points,
+    create_fee_model,
+    generate_l1_trace,
 ):
-    @json_serializable
-    @dataclass
-    class L1Metadata:
-        block_number: Uint256
-        timestamp: Uint256
-        blob_fee: Uint256
-        base_fee: Uint256
-
-    def get_json():
-        return {
-            "l1_metadata": [
-                L1Metadata(
-                    block_number=x.number,
-                    timestamp=x.timestamp,
-                    blob_fee=x.blob_fee,
-                    base_fee=x.base_fee,
-                ).to_dict()
-                for x in blocks
-            ],
-            "points": [x.to_dict() for x in test_points],
-            "proving_cost": fee_model.proving_cost_per_mana.to_dict(),
-        }
-
-    def get_dump():
-        return json.dumps(get_json())
-
-    # Create a json object that we can throw at foundry tests
-    get_dump()
-    return
+    quote_server_api = dict(
+        Block=Block,
+        Int256=Int256,
+        L1Fees=L1Fees,
+        L1Trace=L1Trace,
+        OracleInput=OracleInput,
+        SlotScheduler=SlotScheduler,
+        TxBatch=TxBatch,
+        Uint256=Uint256,
+        create_fee_model=create_fee_model,
+        generate_l1_trace=generate_l1_trace,
+    )
+    return (quote_server_api,)
 
 
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
-    # Bandwidth
+    ## Blob packing
 
-    In Etheruem, the bandwidth consumed by a validator as noted in the Eth 2.0 book is ~3.5mb/s.
+    The sequencer cost assumes that every block pays for its own blobs, rounding up to whole blobs, so a partially filled blob is paid in full.
+    If a block's payload can share blobs with the following blocks, we can save some of that, at the cost of publishing the data a bit later.
 
-    If we follow the assumption that Ethereum transactions are 700 bytes, and have 15 txs per second, the 180 transaction per block will "require" 0.01mb/s, so there is a good chunk of overhead etc.
+    The `BlobPacker` runs alongside the simulation (as a sink) and publishes a blob as soon as it is full, or when the oldest data in it has waited `max_delay` slots.
+    With `split_blocks` the blobs are one stream of fields and a payload simply continues in the next blob, otherwise only the partial blob left over by a block is placed, first-fit, into the open blobs.
+    A `max_delay` of 0 is the per block baseline.
     """)
     return
 
 
 @app.cell
-def _():
-    ETH_TX_BANDWIDTH = 700
-    ETH_BLOCK_BANDWIDTH = ETH_TX_BANDWIDTH * 15
+def _(BLOB_SIZE_IN_FIELDS, GAS_PER_BLOB):
+    class BlobPacker:
+        """
+        Packs the block payloads into blobs across consecutive blocks, and tracks the blobs and DA cost against the per block baseline.
+        Blobs are paid at the blob fee of the slot they are published in. Every slot is constant work (or linear in the open blobs without splitting).
+        """
 
-    ETH_MB_PER_SEC = ETH_BLOCK_BANDWIDTH / 1024 / 1024
-    print(f"Tx Bandwidth: {ETH_MB_PER_SEC:.2f} MB/s -> {ETH_MB_PER_SEC * 8:.2f} mbit/s")
+        def __init__(self, max_delay: int = 2, split_blocks: bool = True):
+            self.max_delay = max_delay
+            self.split_blocks = split_blocks
+            # [fields used, slot of the oldest data in it]
+            self.open_blobs = []
+            self.blobs = 0
+            self.da_cost = 0
+            self.baseline_blobs = 0
+            self.baseline_da_cost = 0
+
+        def __call__(self, l1_block, block, test_point):
+            self.add_block(
+                block.slot_number.value,
+                block.size_in_fields().value,
+                l1_block.blob_fee.value,
+            )
 
-    ETH_FACTOR = 3.5 / ETH_MB_PER_SEC
+        def _publish(self, count: int, blob_fee: int):
+            self.blobs += count
+            self.da_cost += count * GAS_PER_BLOB.value * blob_fee
+
+        def add_block(self, slot_number: int, size_in_fields: int, blob_fee: int):
+            blob_size = BLOB_SIZE_IN_FIELDS.value
+            baseline = -(-size_in_fields // blob_size)
+            self.baseline_blobs += baseline
+            self.baseline_da_cost += baseline * GAS_PER_BLOB.value * blob_fee
+
+            remaining = size_in_fields
+            if self.split_blocks and self.open_blobs:
+                taken = min(remaining, blob_size - self.open_blobs[0][0])
+                self.open_blobs[0][0] += taken
+                remaining -= taken
+
+            # Whole blobs worth of data can go out right away
+            self._publish(remaining // blob_size, blob_fee)
+            remaining %= blob_size
+
+            if remaining > 0:
+                target = next(
+                    (b for b in self.open_blobs if blob_size - b[0] >= remaining), None
+                )
+                if target is None:
+                    self.open_blobs.append([remaining, slot_number])
+                else:
+                    target[0] += remaining
+
+            # Publish the full blobs, and the ones that cannot wait any longer
+            keep = [
+                b
+                for b in self.open_blobs
+                if b[0] < blob_size and b[1] + self.max_delay > slot_number
+            ]
+            self._publish(len(self.open_blobs) - len(keep), blob_fee)
+            self.open_blobs = keep
+
+        def finish(self, blob_fee: int):
+            self._publish(len(self.open_blobs), blob_fee)
+            self.open_blobs = []
+
+        def summary(self) -> dict:
+            return {
+                "blobs": self.blobs,
+                "baseline_blobs": self.baseline_blobs,
+                "da_cost_in_wei": self.da_cost,
+                "baseline_da_cost_in_wei": self.baseline_da_cost,
+                "da_cost_saved": 1 - self.da_cost / self.baseline_da_cost
+                if self.baseline_da_cost
+                else 0.0,
+            }
+
+    return (BlobPacker,)
 
-    print(f"ETH_FACTOR: {ETH_FACTOR:.2f}")
-    return (ETH_FACTOR,)
+
+@app.cell
+def _(blob_packers, mo):
+    mo.ui.table(
+        [
+            {"max_delay": max_delay, "split_blocks": split_blocks, **packer.summary()}
+            for (max_delay, split_blocks), packer in blob_packers.items()
+        ],
+        selection=None,
+    )
+    return
 
 
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""
-    We call this overhead for the `ETH_FACTOR`. The overhead is due to the gossiping across the nodes, the transactions that might not actually make it, the block headers etc.
+    ## Rolling statistics
 
-    We don't expect to have as big of an overhead, for the simple reason that we do not expect to have as many nodes. Nevertheless, it is a good thing to keep in mind when thinking about the bandwidth requirements.
+    Keeping every test point is fine for a few days of L1 blocks, but not for runs over months or years of (synthetic) blocks.
+    The `OnlineStatsSink` runs alongside the simulation and keeps the mean, max and quantiles of the base fee components, the congestion multiplier, the mana used and the oracle lag in fixed memory.
+    The oracle lag is the relative difference between the base fee the oracle reports and the actual L1 base fee.
+
+    The quantiles come from a `QuantileSketch`, counting the values in logarithmically sized buckets (like DDSketch), such that every quantile is within a relative error of `relative_accuracy` of the exact one.
+    The number of buckets only grows with the range of the values, e.g., less than 2100 to cover 1 wei to 1 ether at 1%, and sketches can be merged.
+    For every epoch it records a summary of the epoch itself and of a rolling window of the last `window_epochs` epochs, next to the statistics of the whole run.
     """)
     return
 
 
 @app.cell
-def _(ETH_FACTOR):
-    AZTEC_TX_BANDWIDTH = 80 * 1024
-    AZTEC_BLOCK_BANDWIDTH = AZTEC_TX_BANDWIDTH * 10
-    AZTEC_MB_PER_SEC = AZTEC_BLOCK_BANDWIDTH / 1024 / 1024
-    print(
-        f"Bandwidth: {AZTEC_MB_PER_SEC:.2f} MB/s -> {AZTEC_MB_PER_SEC * 8:.2f} mbit/s"
-    )
+def _(Callable, Optional, deque, math):
+    class QuantileSketch:
+        """
+        Quantiles of non-negative values within a relative error of `relative_accuracy`, in memory logarithmic in their range.
+        """
 
-    ASSUMED_AZTEC_FACTOR = max(1, ETH_FACTOR / 32)
+        def __init__(self, relative_accuracy: float = 0.01):
+            self.relative_accuracy = relative_accuracy
+            self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+            self.log_gamma = math.log(self.gamma)
+            # Bucket `i` counts the values in (gamma^(i-1), gamma^i]
+            self.buckets = {}
+            self.zeros = 0
+            self.count = 0
+
+        def add(self, value: float):
+            if value < 0:
+                raise ValueError(
+                    f"QuantileSketch only supports non-negative values: {value}"
+                )
+            self.count += 1
+            if value == 0:
+                self.zeros += 1
+                return
+            i = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[i] = self.buckets.get(i, 0) + 1
+
+        def merge(self, other: "QuantileSketch"):
+            if other.gamma != self.gamma:
+                raise ValueError("Cannot merge sketches with a different accuracy")
+            self.count += other.count
+            self.zeros += other.zeros
+            for i, count in other.buckets.items():
+                self.buckets[i] = self.buckets.get(i, 0) + count
+
+        def quantile(self, q: float) -> float:
+            if self.count == 0:
+                return math.nan
+            rank = q * (self.count - 1)
+            seen = self.zeros
+            if rank < seen:
+                return 0.0
+            for i in sorted(self.buckets):
+                seen += self.buckets[i]
+                if seen > rank:
+                    # The value with the smallest relative error to anything in the bucket
+                    return 2 * self.gamma**i / (self.gamma + 1)
+            return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    class RunningStats:
+        """
+        Count, mean, max and quantiles of a stream of values.
+        """
 
-    print(f"ASSUMED_AZTEC_FACTOR: {ASSUMED_AZTEC_FACTOR:.2f}")
+        def __init__(self, relative_accuracy: float = 0.01):
+            self.count = 0
+            self.total = 0
+            self.max = -math.inf
+            self.sketch = QuantileSketch(relative_accuracy)
+
+        def add(self, value):
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self.sketch.add(value)
+
+        def merge(self, other: "RunningStats"):
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+            self.sketch.merge(other.sketch)
+
+        def summary(self, quantiles) -> dict:
+            result = {
+                "mean": self.total / self.count if self.count else math.nan,
+                "max": self.max if self.count else math.nan,
+            }
+            for q in quantiles:
+                # The sketch rounds within its accuracy, the max is exact
+                result[f"p{round(q * 100)}"] = min(self.sketch.quantile(q), self.max)
+            return result
+
+    class OnlineStatsSink:
+        """
+        A sink for `simulate` summarizing every epoch, a rolling window of epochs and the whole run in fixed memory.
+        Only the last `history` epoch summaries are kept, pass `on_epoch` to stream them elsewhere instead.
+        Call `finish` after the simulation to summarize the last (partial) epoch.
+        """
+
+        METRICS = (
+            "sequencer_cost",
+            "prover_cost",
+            "congestion_cost",
+            "mana_base_fee",
+            "congestion_multiplier",
+            "mana_used",
+            "oracle_lag",
+        )
+        QUANTILES = (0.5, 0.9, 0.99)
+
+        def __init__(
+            self,
+            epoch_duration: int = 32,
+            window_epochs: int = 8,
+            history: int = 1024,
+            relative_accuracy: float = 0.01,
+            on_epoch: Optional[Callable] = None,
+        ):
+            self.epoch_duration = epoch_duration
+            self.relative_accuracy = relative_accuracy
+            self.on_epoch = on_epoch
+            self.epoch = None
+            self.current = self._new_stats()
+            self.window = deque(maxlen=window_epochs)
+            self.total = self._new_stats()
+            self.epochs = deque(maxlen=history)
+
+        def _new_stats(self) -> dict:
+            return {name: RunningStats(self.relative_accuracy) for name in self.METRICS}
+
+        @staticmethod
+        def values(l1_block, block, test_point) -> dict:
+            cost = test_point.outputs.mana_base_fee_components_in_wei
+            oracle_base_fee = test_point.outputs.l1_fee_oracle_output.base_fee.value
+            l1_base_fee = l1_block.base_fee.value
+            return {
+                "sequencer_cost": cost.sequencer_cost.value,
+                "prover_cost": cost.prover_cost.value,
+                "congestion_cost": cost.congestion_cost.value,
+                "mana_base_fee": cost.sequencer_cost.value
+                + cost.prover_cost.value
+                + cost.congestion_cost.value,
+                "congestion_multiplier": cost.congestion_multiplier.value,
+                "mana_used": test_point.block_header.mana_spent.value,
+                "oracle_lag": abs(oracle_base_fee - l1_base_fee) / l1_base_fee
+                if l1_base_fee
+                else 0.0,
+            }
+
+        def __call__(self, l1_block, block, test_point):
+            epoch = test_point.block_header.slot_number.value // self.epoch_duration
+            if self.epoch is not None and epoch != self.epoch:
+                self._close_epoch()
+            self.epoch = epoch
+            for name, value in self.values(l1_block, block, test_point).items():
+                self.current[name].add(value)
+                self.total[name].add(value)
+
+        def _close_epoch(self):
+            self.window.append(self.current)
+            window = self._new_stats()
+            for stats in self.window:
+                for name in self.METRICS:
+                    window[name].merge(stats[name])
+
+            summary = {
+                "epoch": self.epoch,
+                "slots": self.current[self.METRICS[0]].count,
+                "current": {
+                    name: stats.summary(self.QUANTILES)
+                    for name, stats in self.current.items()
+                },
+                "window": {
+                    name: stats.summary(self.QUANTILES)
+                    for name, stats in window.items()
+                },
+            }
+            self.epochs.append(summary)
+            if self.on_epoch is not None:
+                self.on_epoch(summary)
+            self.current = self._new_stats()
+
+        def finish(self):
+            if self.epoch is not None and self.current[self.METRICS[0]].count > 0:
+                self._close_epoch()
+
+        def summary(self) -> list[dict]:
+            return [
+                {"metric": name, **stats.summary(self.QUANTILES)}
+                for name, stats in self.total.items()
+            ]
+
+    return OnlineStatsSink, QuantileSketch
+
+
+@app.cell
+def _(QuantileSketch, np):
+    def check_quantile_sketch():
+        # Every quantile within the relative accuracy of the exact (nearest rank) one
+        _rng = np.random.default_rng(0)
+        values = np.concatenate([np.zeros(100), _rng.lognormal(20, 3, 10_000)])
+        sketch = QuantileSketch(0.01)
+        for v in values:
+            sketch.add(float(v))
+        values.sort()
+        for q in (0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0):
+            exact = values[int(q * (len(values) - 1))]
+            assert abs(sketch.quantile(q) - exact) <= 0.01 * exact + 1e-9, q
+
+        # Merging is the same as adding everything to one sketch
+        a, b = QuantileSketch(0.01), QuantileSketch(0.01)
+        for i, v in enumerate(values):
+            (a if i % 2 else b).add(float(v))
+        a.merge(b)
+        assert a.buckets == sketch.buckets and a.zeros == sketch.zeros
+
+    check_quantile_sketch()
+    return
+
+
+@app.cell
+def _(mo, online_stats, plt):
+    def plot_rolling_stats():
+        epochs = [summary["epoch"] for summary in online_stats.epochs]
+        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 7), sharex=True)
+
+        for q in ("p50", "p90", "p99"):
+            ax1.plot(
+                epochs,
+                [s["window"]["mana_base_fee"][q] for s in online_stats.epochs],
+                label=f"Mana base fee {q} (rolling)",
+            )
+        ax1.plot(
+            epochs,
+            [s["current"]["mana_base_fee"]["max"] for s in online_stats.epochs],
+            label="Mana base fee max (epoch)",
+            linestyle=":",
+        )
+        ax1.set_ylabel("Mana BaseFee (wei)")
+        ax1.set_title("Mana base fee per epoch")
+        ax1.legend()
+        ax1.grid(True)
+
+        for q in ("p50", "p99"):
+            ax2.plot(
+                epochs,
+                [s["window"]["oracle_lag"][q] for s in online_stats.epochs],
+                label=f"Oracle lag {q} (rolling)",
+            )
+        ax2.set_xlabel("Epoch")
+        ax2.set_ylabel("Relative error")
+        ax2.set_title("Oracle base fee vs L1 base fee")
+        ax2.legend()
+        ax2.grid(True)
+
+        plt.tight_layout()
+        return fig
+
+    mo.vstack(
+        [
+            mo.ui.table(online_stats.summary(), selection=None),
+            plot_rolling_stats(),
+        ]
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## State growth
+
+    Besides the fees, the txs of the simulation also tell us how fast the world state grows, e.g., how much disk a node needs and how much it has to insert when syncing.
+    Every nullifier and note adds a leaf to the nullifier and note hash trees, and a public state diff either updates an existing leaf or adds a new one to the public data tree (a `new_public_data_fraction` of them).
+    A leaf of the (indexed) nullifier tree stores the value with a pointer to the next one (72 bytes), a note hash leaf is a single hash (32 bytes) and a public data leaf is a slot, a value and a pointer (104 bytes).
+    On top of the leaves a node stores the hashes of the tree above them, about one per leaf, and the depth is what the leaves need out of the `TREE_HEIGHT` of the tree.
+
+    `StateGrowth` accumulates the leaves per block (as a sink, or from the blocks after the fact), and `project` extends the run by resampling its blocks, such that months of traffic can be projected without simulating them.
+    """)
+    return
+
+
+@app.cell
+def _(TxBatch, math, np):
+    class StateGrowth:
+        """
+        Leaves added to the nullifier, note hash and public data trees per block, stored as columns.
+        """
+
+        TREES = ("nullifier", "note_hash", "public_data")
+        LEAF_BYTES = {
+            "nullifier": 32 + 8 + 32,
+            "note_hash": 32,
+            "public_data": 32 + 32 + 8 + 32,
+        }
+        HASH_BYTES = 32
+        TREE_HEIGHT = 40
+
+        def __init__(self, new_public_data_fraction: float = 0.5, initial_leaves=None):
+            self.new_public_data_fraction = new_public_data_fraction
+            self.initial_leaves = dict.fromkeys(self.TREES, 0) | (initial_leaves or {})
+            self._chunks = []
+            self._pending = []
+
+        def __call__(self, l1_block, block, test_point):
+            txs = (
+                block.txs
+                if isinstance(block.txs, TxBatch)
+                else TxBatch.from_txs(block.txs)
+            )
+            self._pending.append(
+                (
+                    block.timestamp.value,
+                    int(txs.nullifiers.sum()),
+                    int(txs.notes.sum()),
+                    int(txs.public_state_diffs.sum()),
+                )
+            )
+
+        @classmethod
+        def from_blocks(cls, blocks, **kwargs):
+            growth = cls(**kwargs)
+            for block in blocks:
+                growth(None, block, None)
+            return growth
+
+        def add_blocks(self, timestamps, nullifiers, notes, public_state_diffs):
+            """
+            Adds many blocks at once, one value per block in every column.
+            """
+            self._flush()
+            self._chunks.append(
+                np.stack(
+                    [
+                        np.asarray(c, dtype=np.int64)
+                        for c in (timestamps, nullifiers, notes, public_state_diffs)
+                    ]
+                )
+            )
+
+        def _flush(self):
+            if self._pending:
+                self._chunks.append(np.array(self._pending, dtype=np.int64).T)
+                self._pending = []
+
+        def columns(self):
+            """
+            The timestamps, nullifiers, notes and public state diffs of every block.
+            """
+            self._flush()
+            if not self._chunks:
+                return np.zeros((4, 0), dtype=np.int64)
+            if len(self._chunks) > 1:
+                self._chunks = [np.concatenate(self._chunks, axis=1)]
+            return self._chunks[0]
+
+        def __len__(self) -> int:
+            return self.columns().shape[1]
+
+        def growth(self) -> dict:
+            """
+            The timestamps, and per tree the leaves, bytes and depth after every block.
+            """
+            timestamps, nullifiers, notes, diffs = self.columns()
+            added = {
+                "nullifier": np.cumsum(nullifiers),
+                "note_hash": np.cumsum(notes),
+                # Expected number of new leaves, floored
+                "public_data": np.floor(
+                    np.cumsum(diffs) * self.new_public_data_fraction
+                ).astype(np.int64),
+            }
+            result = {"timestamp": timestamps}
+            for tree in self.TREES:
+                leaves = self.initial_leaves[tree] + added[tree]
+                result[tree] = {
+                    "leaves": leaves,
+                    "bytes": leaves * self.LEAF_BYTES[tree]
+                    + np.maximum(leaves - 1, 0) * self.HASH_BYTES,
+                    "depth": np.ceil(np.log2(np.maximum(leaves, 1))).astype(np.int64),
+                }
+            return result
+
+        def summary(self) -> list[dict]:
+            growth = self.growth()
+            timestamps = growth["timestamp"]
+            days = (
+                (timestamps[-1] - timestamps[0]) / 86400
+                if len(timestamps) > 1
+                else math.nan
+            )
+            rows = []
+            for tree in self.TREES:
+                leaves = growth[tree]["leaves"]
+                size = growth[tree]["bytes"]
+                rows.append(
+                    {
+                        "tree": tree,
+                        "leaves": int(leaves[-1]) if len(leaves) else 0,
+                        "bytes": int(size[-1]) if len(size) else 0,
+                        "depth": int(growth[tree]["depth"][-1]) if len(leaves) else 0,
+                        "capacity_used": float(leaves[-1]) / 2**self.TREE_HEIGHT
+                        if len(leaves)
+                        else 0.0,
+                        "leaves_per_day": float(
+                            (leaves[-1] - self.initial_leaves[tree]) / days
+                        )
+                        if len(leaves)
+                        else math.nan,
+                    }
+                )
+            return rows
+
+        def project(self, days: float, seed: int = 0) -> "StateGrowth":
+            """
+            A copy extended by `days` of blocks drawn (with replacement) from the blocks so far, at the same number of blocks per second.
+            """
+            timestamps, *counts = self.columns()
+            if len(timestamps) < 2:
+                raise ValueError("Need at least 2 blocks to project from")
+            seconds = int(days * 86400)
+            duration = timestamps[-1] - timestamps[0]
+            blocks = int(round(seconds * (len(timestamps) - 1) / duration))
+            rng = np.random.default_rng(seed)
+            picks = rng.integers(0, len(timestamps), blocks)
+
+            projected = StateGrowth(self.new_public_data_fraction, self.initial_leaves)
+            projected.add_blocks(timestamps, *counts)
+            projected.add_blocks(
+                timestamps[-1]
+                + np.linspace(seconds / blocks, seconds, blocks).astype(np.int64),
+                *(column[picks] for column in counts),
+            )
+            return projected
+
+    return (StateGrowth,)
+
+
+@app.cell
+def _(StateGrowth, l2_blocks, mo, plt):
+    def state_growth_projection(horizons=(30, 90, 180, 365)):
+        simulated = StateGrowth.from_blocks(l2_blocks)
+        rows = [
+            {"days": days, **row}
+            for days in horizons
+            for row in simulated.project(days).summary()
+        ]
+
+        growth = simulated.project(max(horizons)).growth()
+        elapsed_days = (growth["timestamp"] - growth["timestamp"][0]) / 86400
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 4))
+        for tree in StateGrowth.TREES:
+            ax1.plot(elapsed_days, growth[tree]["leaves"], label=tree)
+            ax2.plot(elapsed_days, growth[tree]["bytes"] / 2**30, label=tree)
+        ax1.set_ylabel("Leaves")
+        ax2.set_ylabel("GiB")
+        for ax in (ax1, ax2):
+            ax.set_xlabel("Days")
+            ax.legend()
+            ax.grid(True)
+        ax1.set_title("Projected tree leaves")
+        ax2.set_title("Projected tree size")
+        plt.tight_layout()
+        return mo.vstack([mo.ui.table(rows, selection=None), fig])
+
+    state_growth_projection()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Proving capacity
+
+    `compute_prover_costs` charges a flat `proving_cost_per_mana` and the verification gas spread over the epoch, as if the provers could always keep up.
+    `ProvingCapacity` checks whether they can: `parallelism` provers each proving a mana in `seconds_per_mana`, working through the blocks in order as they come in (or only once the epoch is over).
+    When all the blocks of an epoch are proven, the root rollup takes another `epoch_overhead` seconds, and the proof has to land within `proof_submission_window` slots after the end of the epoch.
+    Work that is not done by the end of an epoch is the backlog carried into the next one.
+
+    The default parameters are placeholders to play with, rather than measured numbers.
+    Scaling the mana of the simulated blocks shows at what sustained load the proving turns into the bottleneck, next to the capacity `parallelism / seconds_per_mana`.
+    """)
+    return
+
+
+@app.cell
+def _(dataclass, np):
+    @dataclass
+    class ProvingCapacity:
+        parallelism: int = 400
+        seconds_per_mana: float = 1e-4
+        epoch_overhead: float = 600.0
+        proof_submission_window: int = 32
+        prove_as_blocks_arrive: bool = True
+
+        def mana_per_second(self) -> float:
+            return self.parallelism / self.seconds_per_mana
+
+        @staticmethod
+        def done_times(available, work):
+            """
+            The provers work through the blocks in order, a block is done at max(available, previous done) + work.
+            This recursion (Lindley's) unrolls to a running max, so it stays vectorized.
+            """
+            total = np.cumsum(work)
+            return total + np.maximum.accumulate(available - (total - work))
+
+        def prove(
+            self,
+            slot_numbers,
+            timestamps,
+            mana,
+            genesis_timestamp: int,
+            slot_duration: int = 36,
+            epoch_duration: int = 32,
+        ) -> dict:
+            """
+            The proving of every epoch with blocks, given the slot number, timestamp and mana of every block (in order).
+            Returns columns with one value per epoch.
+            """
+            slot_numbers = np.asarray(slot_numbers, dtype=np.int64)
+            mana = np.asarray(mana, dtype=np.float64)
+            epochs = slot_numbers // epoch_duration
+            epoch_ends = (
+                genesis_timestamp + (epochs + 1) * epoch_duration * slot_duration
+            )
+            available = (
+                np.asarray(timestamps, dtype=np.float64)
+                if self.prove_as_blocks_arrive
+                else epoch_ends.astype(np.float64)
+            )
+
+            work = mana * self.seconds_per_mana / self.parallelism
+            done = self.done_times(available, work)
+
+            last = np.append(np.flatnonzero(np.diff(epochs)), len(epochs) - 1)
+            epoch_end = epoch_ends[last]
+            blocks_done = done[last]
+            finished = np.maximum(blocks_done, epoch_end) + self.epoch_overhead
+            deadline = epoch_end + self.proof_submission_window * slot_duration
+            backlog_seconds = np.maximum(blocks_done - epoch_end, 0)
+            return {
+                "epoch": epochs[last],
+                "mana": np.add.reduceat(mana, np.append(0, last[:-1] + 1)),
+                "latency": finished - epoch_end,
+                "backlog_mana": backlog_seconds * self.mana_per_second(),
+                "on_time": finished <= deadline,
+            }
+
+    def _check_done_times(count: int = 10_000, seed: int = 0):
+        # The running max against the recursion itself, with idle gaps and backlogs both showing up
+        rng = np.random.default_rng(seed)
+        available = np.cumsum(rng.exponential(36.0, count))
+        work = rng.exponential(30.0, count)
+        expected = np.empty(count)
+        previous = -np.inf
+        for i in range(count):
+            previous = max(available[i], previous) + work[i]
+            expected[i] = previous
+        assert np.allclose(ProvingCapacity.done_times(available, work), expected)
+
+    _check_done_times()
+    return (ProvingCapacity,)
+
+
+@app.cell
+def _(ProvingCapacity, fee_model, l2_blocks, mo, np, plt):
+    def proving_capacity_sweep(scales=(0.5, 1, 1.5, 1.75, 2, 3, 4)):
+        capacity = ProvingCapacity()
+        slot_numbers = [b.slot_number.value for b in l2_blocks]
+        timestamps = [b.timestamp.value for b in l2_blocks]
+        mana = np.array([b.mana_spent().value for b in l2_blocks], dtype=np.float64)
+        duration = timestamps[-1] - timestamps[0]
+
+        def prove(scale, prover=capacity):
+            return prover.prove(
+                slot_numbers,
+                timestamps,
+                mana * scale,
+                fee_model.genesis_timestamp.value,
+                fee_model.slot_duration.value,
+                fee_model.AZTEC_EPOCH_DURATION.value,
+            )
+
+        rows = []
+        for scale in scales:
+            result = prove(scale)
+            rows.append(
+                {
+                    "mana_scale": scale,
+                    "mana_per_second": mana.sum() * scale / duration,
+                    "utilization": mana.sum()
+                    * scale
+                    / duration
+                    / capacity.mana_per_second(),
+                    "max_latency_s": float(result["latency"].max()),
+                    "max_backlog_mana": float(result["backlog_mana"].max()),
+                    "epochs_late": int((~result["on_time"]).sum()),
+                    "epochs": len(result["epoch"]),
+                }
+            )
+
+        fig, ax = plt.subplots(figsize=(12, 4))
+        for scale in scales[::2]:
+            result = prove(scale)
+            ax.plot(result["epoch"], result["latency"], label=f"{scale}x the mana")
+        ax.axhline(
+            capacity.proof_submission_window * fee_model.slot_duration.value,
+            color="black",
+            linestyle=":",
+            label="Proof submission window",
+        )
+        ax.set_xlabel("Epoch")
+        ax.set_ylabel("Seconds after the epoch")
+        ax.set_title(
+            f"Epoch proving latency, capacity {capacity.mana_per_second():.3g} mana/s"
+        )
+        ax.legend()
+        ax.grid(True)
+        return mo.vstack([mo.ui.table(rows, selection=None), fig])
+
+    proving_capacity_sweep()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Points of interest
+
+    - The multiplier makes the base fee more unstable, it might be better to consider a different function to see if we can stabilize it.
+    """)
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Comparing policies
+
+    To try out other functions, both the L1 gas oracle and the congestion multiplier are pluggable.
+    An oracle policy is a subclass of `L1GasOracle` (overriding `queue_change` and `value_at` or simply the `LIFETIME` and `LATENCY`), and a congestion policy is a subclass of `CongestionPolicy` (overriding `multiplier`).
+
+    The evaluator runs all the policies side by side in a single pass over the L1 blocks.
+    Every policy sees the same demand, e.g., the same planned block sizes, the same txs in the mempool and the same willingness to pay (relative to their own real cost), so the difference in outcome is due to the policy alone.
+
+    For every policy we report:
+
+    - **tracking error**: the mean relative difference between the real cost (sequencer + prover) charged and the real cost had the oracle been following the L1 fees without any delay, with the same mana target (a smaller target alone would otherwise look like a worse oracle).
+    - **fee volatility**: the standard deviation of the relative change in the mana base fee (including congestion) from one slot to the next.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Callable,
+    CongestionPolicy,
+    L1Fees,
+    L1GasOracle,
+    Uint256,
+    dataclass,
+    json_serializable,
+    np,
+):
+    def queueing_oracle(lifetime: int, latency: int) -> type:
+        """
+        Returns an `L1GasOracle` using a different LIFETIME/LATENCY queueing policy.
+        """
+
+        @json_serializable
+        @dataclass
+        class QueueingL1GasOracle(L1GasOracle):
+            LIFETIME = Uint256(lifetime)
+            LATENCY = Uint256(latency)
+
+        return QueueingL1GasOracle
+
+    @json_serializable
+    @dataclass
+    class SpotL1GasOracle(L1GasOracle):
+        """
+        Follows the L1 fees without any delay, used as the reference when computing the tracking error.
+        """
+
+        def known_until(self, slot_number: Uint256) -> Uint256:
+            # The next slot can change the fees right away
+            return slot_number
+
+        def queue_change(self, slot_number: Uint256, fees: L1Fees):
+            self.pre = self.post
+            self.post = fees
+            self.slot_of_change = slot_number
+
+        def queue_changes(self, from_slot: Uint256, to_slot: Uint256, fees: L1Fees):
+            if from_slot > to_slot:
+                return
+            self.pre = self.post if from_slot == to_slot else fees
+            self.post = fees
+            self.slot_of_change = to_slot
+
+    @json_serializable
+    @dataclass
+    class EmaL1GasOracle(L1GasOracle):
+        """
+        Moves `post` 1 / SMOOTHING of the way towards the photographed fees, at most once per slot and without latency.
+        """
+
+        SMOOTHING = Uint256(4)
+
+        def known_until(self, slot_number: Uint256) -> Uint256:
+            return slot_number
+
+        def queue_change(self, slot_number: Uint256, fees: L1Fees):
+            if slot_number <= self.slot_of_change:
+                return
+
+            def towards(current: Uint256, target: Uint256) -> Uint256:
+                if target >= current:
+                    return current + (target - current) / self.SMOOTHING
+                return current - (current - target) / self.SMOOTHING
+
+            self.pre = self.post
+            self.post = L1Fees(
+                blob_fee=towards(self.post.blob_fee, fees.blob_fee),
+                base_fee=towards(self.post.base_fee, fees.base_fee),
+            )
+            self.slot_of_change = slot_number
+
+        def queue_changes(self, from_slot: Uint256, to_slot: Uint256, fees: L1Fees):
+            # The steps shrink geometrically, so we are stuck at `fees` (or within SMOOTHING of it) after a few dozen slots
+            slot = max(from_slot, self.slot_of_change + Uint256(1))
+            while slot <= to_slot:
+                post = self.post
+                self.queue_change(slot, fees)
+                if self.post == post:
+                    self.slot_of_change = to_slot
+                    return
+                slot += Uint256(1)
+
+        def queue_changes_at(
+            self,
+            from_slot: Uint256,
+            to_slot: Uint256,
+            fees_at: Callable[[Uint256], L1Fees],
+        ):
+            # Every photograph moves the average, so with changing fees there is nothing to skip
+            slot = max(from_slot, self.slot_of_change + Uint256(1))
+            while slot <= to_slot:
+                self.queue_change(slot, fees_at(slot))
+                slot += Uint256(1)
+
+    @json_serializable
+    @dataclass
+    class NoCongestion(CongestionPolicy):
+        def multiplier(self, excess_mana: Uint256, update_fraction: Uint256) -> Uint256:
+            return Uint256(int(1e9))
+
+        def multiplier_float(self, excess_mana, update_fraction: float):
+            return np.full_like(excess_mana, 1e9, dtype=np.float64)
+
+    @json_serializable
+    @dataclass
+    class LinearCongestion(CongestionPolicy):
+        """
+        The first order term of the fake exponential, e.g., 1 + excess / update_fraction.
+        """
+
+        def multiplier(self, excess_mana: Uint256, update_fraction: Uint256) -> Uint256:
+            return Uint256(int(1e9)) + Uint256(int(1e9)).mul_div(
+                excess_mana, update_fraction
+            )
+
+        def multiplier_float(self, excess_mana, update_fraction: float):
+            return 1e9 + 1e9 * excess_mana / update_fraction
+
+    @json_serializable
+    @dataclass
+    class CappedCongestion(CongestionPolicy):
+        """
+        The fake exponential, but never more than `cap` (with 1e9 precision).
+        """
+
+        cap: Uint256
+
+        def multiplier(self, excess_mana: Uint256, update_fraction: Uint256) -> Uint256:
+            return min(super().multiplier(excess_mana, update_fraction), self.cap)
+
+        def multiplier_float(self, excess_mana, update_fraction: float):
+            return np.minimum(
+                super().multiplier_float(excess_mana, update_fraction),
+                float(self.cap.value),
+            )
+
+    return (
+        CappedCongestion,
+        EmaL1GasOracle,
+        LinearCongestion,
+        NoCongestion,
+        SpotL1GasOracle,
+        queueing_oracle,
+    )
+
+
+@app.cell
+def _(
+    Block,
+    CongestionPolicy,
+    Field,
+    L1Fees,
+    L1GasOracle,
+    MANA_PER_BASE_TX,
+    MEMPOOL_SIZE,
+    Optional,
+    RandomStreams,
+    SlotScheduler,
+    SpotL1GasOracle,
+    TxBatch,
+    Uint256,
+    create_fee_model,
+    dataclass,
+    np,
+    sample_acceptable_fee,
+    sample_planned_mana,
+    sample_tx_mana,
+):
+    @dataclass
+    class FeePolicy:
+        oracle_cls: type = L1GasOracle
+        congestion_policy: CongestionPolicy = Field(default_factory=CongestionPolicy)
+        # None uses the default of `create_fee_model`
+        mana_target: Optional[Uint256] = None
+        update_fraction_scale: Optional[Uint256] = None
+
+    class SlotDemand:
+        """
+        The demand for a single slot, with the same draws as `randomized_txs`, so with the same seed (and policy) it matches `simulate`.
+        The planned mana and the mana of the txs are sampled lazily, but only once, such that every policy sees the same txs.
+        The fee a tx accepts is drawn around the real cost of the policy looking at it, so every `select` replays the
+        fee acceptance stream of the slot from its start.
+        """
+
+        def __init__(self, streams, slot_number: Uint256, mana_target: Uint256):
+            self.streams = streams
+            self.slot_number = slot_number
+            self.tx_mana_rng = streams.stream("tx_mana", slot_number.value)
+            self.mana_target = mana_target
+            self.planned = sample_planned_mana(
+                streams.stream("mempool", slot_number.value), mana_target
+            ).value
+            self.mana = []
+
+        def _extend(self, count: int):
+            while len(self.mana) < count:
+                self.mana.append(sample_tx_mana(self.tx_mana_rng).value)
+
+        def select(
+            self,
+            real_cost: Uint256,
+            mana_base_fee: Uint256,
+            mana_target: Optional[Uint256] = None,
+        ) -> TxBatch:
+            """
+            Collects txs like the simulation above, until the planned mana is reached or the mempool is exhausted.
+            The demand does not depend on the policy, but the block limit does, so a policy can pass its own `mana_target`.
+            """
+            limit = 2 * (mana_target or self.mana_target).value
+            fee_acceptance_rng = self.streams.stream(
+                "fee_acceptance", self.slot_number.value
+            )
+            spent = 0
+            txs = []
+            count = 0
+            while (
+                abs(self.planned - spent) >= MANA_PER_BASE_TX.value
+                and count < MEMPOOL_SIZE
+            ):
+                self._extend(count + 1)
+                within_bounds = self.mana[count] + spent <= limit
+                is_fee_acceptable = (
+                    sample_acceptable_fee(fee_acceptance_rng, real_cost)
+                    >= mana_base_fee
+                )
+                if within_bounds and is_fee_acceptable:
+                    txs.append(self.mana[count])
+                    spent += self.mana[count]
+                count += 1
+            return TxBatch(mana_spent=txs)
+
+    def evaluate_policies(
+        blocks,
+        policies: dict[str, FeePolicy],
+        seed: int = 0,
+        demand_mana_target: Optional[Uint256] = None,
+    ):
+        """
+        Runs every policy over the same L1 blocks and the same demand in a single pass.
+        Every policy is compared with a reference of its own: the same mana target and update fraction scale with a spot oracle,
+        such that the tracking error and cost recovery measure the lag of its oracle, not the difference in parameters.
+        The demand is planned around `demand_mana_target` (the default mana target unless given) for every policy,
+        a policy's mana target changes the capacity of a block, not what users want to spend.
+        Returns the metrics per policy and the per slot series used to compute them.
+        """
+        streams = RandomStreams(seed)
+
+        default = create_fee_model(blocks)
+        demand_mana_target = demand_mana_target or default.mana_target
+        models, references = {}, {}
+        for name, p in policies.items():
+            models[name] = create_fee_model(
+                blocks,
+                p.oracle_cls,
+                p.congestion_policy,
+                mana_target=p.mana_target,
+                update_fraction_scale=p.update_fraction_scale,
+            )
+            references[name] = create_fee_model(
+                blocks,
+                SpotL1GasOracle,
+                mana_target=p.mana_target,
+                update_fraction_scale=p.update_fraction_scale,
+            )
+        series = {
+            name: {
+                "real_cost": [],
+                "reference_cost": [],
+                "mana_base_fee": [],
+                "mana_spent": [],
+            }
+            for name in policies
+        }
+
+        for block_number, (slot_number, l1_block_index) in enumerate(
+            SlotScheduler.for_model(blocks, default), start=1
+        ):
+            l1_block = blocks[l1_block_index]
+            l1_fees = L1Fees(blob_fee=l1_block.blob_fee, base_fee=l1_block.base_fee)
+            for model in [*references.values(), *models.values()]:
+                model.set_timestamp(l1_block.timestamp)
+                model.photograph(l1_fees)
+
+            demand = SlotDemand(streams, slot_number, demand_mana_target)
+
+            for name, model in models.items():
+                cost = model.mana_base_fee_components(None)
+                real_cost = cost.sequencer_cost + cost.prover_cost
+                mana_base_fee = real_cost + cost.congestion_cost
+
+                block = Block(
+                    l1_block_number=l1_block.number,
+                    timestamp=l1_block.timestamp,
+                    slot_number=slot_number,
+                    block_number=Uint256(block_number),
+                    txs=demand.select(real_cost, mana_base_fee, model.mana_target),
+                )
+                model.add_slot(block)
+
+                series[name]["real_cost"].append(real_cost.value)
+                series[name]["reference_cost"].append(
+                    references[name].mana_base_fee(None).value
+                )
+                series[name]["mana_base_fee"].append(mana_base_fee.value)
+                series[name]["mana_spent"].append(block.mana_spent().value)
+
+        metrics = {}
+        for name, s in series.items():
+            real_cost = np.array(s["real_cost"], dtype=float)
+            reference_costs = np.array(s["reference_cost"], dtype=float)
+            fees = np.array(s["mana_base_fee"], dtype=float)
+            spent = np.array(s["mana_spent"], dtype=float)
+            metrics[name] = {
+                "tracking_error": float(
+                    np.mean(np.abs(real_cost - reference_costs) / reference_costs)
+                ),
+                "fee_volatility": float(np.std(np.diff(fees) / fees[:-1])),
+                "mean_mana_base_fee": float(np.mean(fees)),
+                "mean_mana_spent": float(np.mean(spent)),
+                # The fees collected over what the included mana actually cost at spot L1 prices
+                "cost_recovery": float(
+                    np.sum(fees * spent) / max(np.sum(reference_costs * spent), 1.0)
+                ),
+            }
+        return metrics, series
+
+    return FeePolicy, SlotDemand, evaluate_policies
+
+
+@app.cell
+def _(
+    CappedCongestion,
+    EmaL1GasOracle,
+    FeePolicy,
+    LinearCongestion,
+    NoCongestion,
+    Uint256,
+    blocks,
+    evaluate_policies,
+    l2_blocks,
+    mo,
+    plt,
+    queueing_oracle,
+):
+    policy_metrics, policy_series = evaluate_policies(
+        blocks,
+        {
+            "default": FeePolicy(),
+            "lifetime 10, latency 4": FeePolicy(oracle_cls=queueing_oracle(10, 4)),
+            "ema oracle": FeePolicy(oracle_cls=EmaL1GasOracle),
+            "no congestion": FeePolicy(congestion_policy=NoCongestion()),
+            "linear congestion": FeePolicy(congestion_policy=LinearCongestion()),
+            "congestion capped at 2x": FeePolicy(
+                congestion_policy=CappedCongestion(cap=Uint256(int(2e9)))
+            ),
+        },
+    )
+    # With the same seed, the default policy sees the same demand as the simulation above
+    assert policy_series["default"]["mana_spent"] == [
+        b.mana_spent().value for b in l2_blocks
+    ]
+
+    def plot_policies():
+        fig, ax = plt.subplots(figsize=(12, 4))
+        for name, s in policy_series.items():
+            ax.plot(s["mana_base_fee"], label=name, linewidth=0.75)
+        ax.set_xlabel("Slot")
+        ax.set_ylabel("Mana BaseFee (wei)")
+        ax.set_title("Mana base fee per policy")
+        ax.legend()
+        ax.grid(True)
+        return ax
+
+    mo.vstack(
+        [
+            mo.ui.table(
+                [{"policy": name, **m} for name, m in policy_metrics.items()],
+                selection=None,
+            ),
+            plot_policies(),
+        ]
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Tuning parameters
+
+    A grid over the mana target, the update fraction scale (the `854_700_854` in `fee_update_fraction`) and the oracle LIFETIME/LATENCY quickly grows beyond what we can simulate.
+    Instead we use successive halving: random candidates are all evaluated on a short prefix of the trace, the best `1/eta` of them continue on an `eta` times longer prefix, and so on until the survivors are replayed on the full trace.
+    Every round runs its candidates in one pass of `evaluate_policies`, so they all see the same demand.
+
+    The objective maps the metrics of a candidate to a loss (lower is better), e.g., the fee volatility, or the tracking error with a penalty when the fees do not recover the costs.
+    """)
+    return
+
+
+@app.cell
+def _(
+    FeeModel,
+    FeePolicy,
+    Uint256,
+    evaluate_policies,
+    math,
+    queueing_oracle,
+    random,
+):
+    def sample_policy(rng: random.Random) -> FeePolicy:
+        """
+        A random candidate, the mana target and update fraction scale are log-uniform within a factor 4 of their defaults.
+        """
+        lifetime = rng.randint(2, 20)
+        return FeePolicy(
+            oracle_cls=queueing_oracle(lifetime, rng.randint(1, lifetime)),
+            mana_target=Uint256(int(75_000_000 * 2 ** rng.uniform(-2, 2))),
+            update_fraction_scale=Uint256(
+                int(FeeModel.UPDATE_FRACTION_SCALE.value * 2 ** rng.uniform(-2, 2))
+            ),
+        )
+
+    def describe_policy(policy: FeePolicy) -> dict:
+        return {
+            "lifetime": policy.oracle_cls.LIFETIME.value,
+            "latency": policy.oracle_cls.LATENCY.value,
+            "mana_target": policy.mana_target.value,
+            "update_fraction_scale": policy.update_fraction_scale.value,
+        }
+
+    def volatility_objective(metrics: dict) -> float:
+        return metrics["fee_volatility"]
+
+    def tracking_objective(metrics: dict) -> float:
+        # Every percent of costs not recovered weighs as much as 10% of tracking error
+        shortfall = max(0.0, 1.0 - metrics["cost_recovery"])
+        return metrics["tracking_error"] + 10 * shortfall
+
+    def successive_halving(
+        blocks,
+        objective,
+        candidates: int = 27,
+        eta: int = 3,
+        min_blocks: int = 200,
+        seed: int = 0,
+    ):
+        """
+        Returns the candidates of the last round ranked by loss as `(name, policy, loss)`, and per round the trace length and the losses.
+        """
+        rng = random.Random(f"{seed}/successive_halving")
+        policies = {f"candidate {i}": sample_policy(rng) for i in range(candidates)}
+        rounds = (
+            int(math.log(len(blocks) / min_blocks, eta))
+            if len(blocks) > min_blocks
+            else 0
+        )
+
+        history = []
+        for r in range(rounds + 1):
+            length = len(blocks) // eta ** (rounds - r)
+            metrics, _ = evaluate_policies(blocks[:length], policies, seed)
+            losses = {}
+            for name, m in metrics.items():
+                loss = objective(m)
+                losses[name] = loss if math.isfinite(loss) else math.inf
+            ranked = sorted(policies, key=losses.get)
+            history.append({"length": length, "losses": losses})
+            if r < rounds:
+                keep = max(1, math.ceil(len(ranked) / eta))
+                policies = {name: policies[name] for name in ranked[:keep]}
+
+        return [(name, policies[name], losses[name]) for name in ranked], history
+
+    return (
+        describe_policy,
+        successive_halving,
+        tracking_objective,
+        volatility_objective,
+    )
+
+
+@app.cell
+def _(mo):
+    tuning_button = mo.ui.run_button(label="Run parameter search")
+    tuning_button
+    return (tuning_button,)
+
+
+@app.cell
+def _(
+    blocks,
+    describe_policy,
+    mo,
+    successive_halving,
+    tracking_objective,
+    tuning_button,
+):
+    mo.stop(not tuning_button.value)
+
+    _ranking, _history = successive_halving(blocks, tracking_objective)
+    mo.vstack(
+        [
+            mo.ui.table(
+                [
+                    {"candidate": name, "loss": loss, **describe_policy(policy)}
+                    for name, policy, loss in _ranking
+                ],
+                selection=None,
+            ),
+            mo.ui.table(
+                [
+                    {
+                        "round": r,
+                        "l1_blocks": h["length"],
+                        "candidates": len(h["losses"]),
+                        "best_loss": min(h["losses"].values()),
+                    }
+                    for r, h in enumerate(_history)
+                ],
+                selection=None,
+            ),
+        ]
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Float64 exploration
+
+    For interactive tuning the exact `Uint256` maths is more than we need, and slow.
+    With the mana spent, the oracle's L1 fees and the price modifiers of every slot taken from a simulation, `Float64FeeModel` recomputes the fees of all slots at once in float64 for other parameters.
+    The excess mana is a running max over the cumulative mana spent, the fake exponential is `exp` and nothing is rounded, so the results are close to, but not the same as, the exact ones.
+    Note that the demand is fixed here, e.g., it does not react to the fees of the new parameters.
+
+    `spot_check` recomputes a random slot out of every `check_every` with the exact integer maths (using `FeeModel.mana_base_fee_components` with the state of that slot) and reports the largest relative divergence.
+    The float results are fine for exploring, but only the exact path should be used for test vectors.
+    """)
+    return
+
+
+@app.cell
+def _(
+    L1Fees,
+    MAX_ETH_PER_FEE_ASSET,
+    MIN_ETH_PER_FEE_ASSET,
+    Uint256,
+    np,
+    random,
+):
+    def fee_inputs(test_points) -> dict:
+        """
+        The inputs of the fee maths of every slot of a simulation, as int64 columns.
+        """
+        return {
+            "mana_spent": np.array(
+                [tp.block_header.mana_spent.value for tp in test_points], dtype=np.int64
+            ),
+            "base_fee": np.array(
+                [tp.outputs.l1_fee_oracle_output.base_fee.value for tp in test_points],
+                dtype=np.int64,
+            ),
+            "blob_fee": np.array(
+                [tp.outputs.l1_fee_oracle_output.blob_fee.value for tp in test_points],
+                dtype=np.int64,
+            ),
+            "price_modifier_bps": np.array(
+                [tp.oracle_input.fee_asset_price_modifier.value for tp in test_points],
+                dtype=np.int64,
+            ),
+        }
+
+    class Float64FeeModel:
+        """
+        The fee maths of a `FeeModel` (from its current state on) in float64, over all slots at once.
+        """
+
+        COMPONENTS = (
+            "sequencer_cost",
+            "prover_cost",
+            "congestion_cost",
+            "congestion_multiplier",
+        )
+
+        def __init__(self, fee_model):
+            self.fee_model = fee_model
+            self.mana_target = float(fee_model.mana_target.value)
+            self.update_fraction = float(fee_model.fee_update_fraction().value)
+            self.divisor = float(fee_model.CONGESTION_MULTIPLIER_DIVISOR.value)
+            header = fee_model.fee_headers[-1]
+            self.start_excess = max(
+                header.excess_mana.value
+                + header.mana_used.value
+                - fee_model.mana_target.value,
+                0,
+            )
+            self.start_price = header.eth_per_fee_asset.value
+
+        def excess_mana(self, mana_spent):
+            # The excess is a random walk reflected at 0: the walk minus its running minimum (when below 0)
+            walk = self.start_excess + np.concatenate(
+                [[0.0], np.cumsum(mana_spent[:-1] - self.mana_target)]
+            )
+            return walk - np.minimum(np.minimum.accumulate(walk), 0)
+
+        def eth_per_fee_asset(self, price_modifier_bps):
+            growth = np.concatenate(
+                [[1.0], np.cumprod(1 + price_modifier_bps[:-1] / 10_000)]
+            )
+            return np.clip(
+                self.start_price * growth,
+                MIN_ETH_PER_FEE_ASSET.value,
+                MAX_ETH_PER_FEE_ASSET.value,
+            )
+
+        def components(self, inputs: dict, in_fee_asset: bool = False) -> dict:
+            m = self.fee_model
+            base_fee = inputs["base_fee"].astype(np.float64)
+            blob_fee = inputs["blob_fee"].astype(np.float64)
+            # The same costs as `compute_sequencer_costs` and `compute_prover_costs` for an empty block
+            sequencer_cost = (
+                m.l1_gas_per_block_proposed.value * base_fee
+                + 3 * m.GAS_PER_BLOB.value * blob_fee
+            ) / self.mana_target
+            prover_cost = (
+                m.l1_gas_per_epoch_verified.value
+                * base_fee
+                / m.AZTEC_EPOCH_DURATION.value
+                / self.mana_target
+                + m.proving_cost_per_mana.value
+            )
+            # The model's own congestion policy, such that the float mode only differs by rounding
+            multiplier = m.congestion_policy.multiplier_float(
+                self.excess_mana(inputs["mana_spent"].astype(np.float64)),
+                self.update_fraction,
+            )
+            total = sequencer_cost + prover_cost
+            result = {
+                "sequencer_cost": sequencer_cost,
+                "prover_cost": prover_cost,
+                "congestion_cost": total * multiplier / self.divisor - total,
+                "congestion_multiplier": multiplier,
+            }
+            if in_fee_asset:
+                scale = 1e12 / self.eth_per_fee_asset(
+                    inputs["price_modifier_bps"].astype(np.float64)
+                )
+                for name in self.COMPONENTS[:3]:
+                    result[name] = result[name] * scale
+            return result
+
+        def exact_states(self, inputs: dict):
+            """
+            The exact excess mana and price of every slot, with the integer maths of `add_slot` (cheap, no fee maths).
+            """
+            target = self.fee_model.mana_target.value
+            excess, price = self.start_excess, self.start_price
+            excesses, prices = [], []
+            for spent, modifier in zip(
+                inputs["mana_spent"].tolist(), inputs["price_modifier_bps"].tolist()
+            ):
+                excesses.append(excess)
+                prices.append(price)
+                excess = max(excess + spent - target, 0)
+                price = max(
+                    MIN_ETH_PER_FEE_ASSET.value,
+                    min(
+                        price * (10_000 + modifier) // 10_000,
+                        MAX_ETH_PER_FEE_ASSET.value,
+                    ),
+                )
+            return excesses, prices
+
+        def exact_components(
+            self,
+            inputs: dict,
+            slot: int,
+            excess: int,
+            price: int,
+            in_fee_asset: bool = False,
+        ):
+            m = self.fee_model
+            return m.mana_base_fee_components(
+                None,
+                in_fee_asset,
+                l1_fees=L1Fees(
+                    blob_fee=Uint256(int(inputs["blob_fee"][slot])),
+                    base_fee=Uint256(int(inputs["base_fee"][slot])),
+                ),
+                congestion_multiplier=m.congestion_policy.multiplier(
+                    Uint256(excess), m.fee_update_fraction()
+                ),
+                eth_per_fee_asset=Uint256(price),
+            )
+
+        def spot_check(
+            self,
+            inputs: dict,
+            approximate: dict,
+            in_fee_asset: bool = False,
+            check_every: int = 64,
+            seed: int = 0,
+        ) -> dict:
+            """
+            The largest relative divergence of the `approximate` components from the exact ones, over a random slot out of every `check_every`.
+            """
+            rng = random.Random(f"{seed}/spot_check")
+            count = len(inputs["mana_spent"])
+            slots = [
+                rng.randrange(start, min(start + check_every, count))
+                for start in range(0, count, check_every)
+            ]
+            excesses, prices = self.exact_states(inputs)
+            divergence = dict.fromkeys(self.COMPONENTS, 0.0)
+            exact_matches = 0
+            for slot in slots:
+                exact = self.exact_components(
+                    inputs, slot, excesses[slot], prices[slot], in_fee_asset
+                )
+                matches = True
+                for name in self.COMPONENTS:
+                    value = getattr(exact, name).value
+                    approx = approximate[name][slot]
+                    divergence[name] = max(
+                        divergence[name], abs(approx - value) / max(value, 1)
+                    )
+                    matches &= round(approx) == value
+                exact_matches += matches
+            return {
+                "slots_checked": len(slots),
+                "exact_matches": exact_matches,
+                **{
+                    f"max_divergence_{name}": float(d) for name, d in divergence.items()
+                },
+            }
+
+    return Float64FeeModel, fee_inputs
+
+
+@app.cell
+def _(mo):
+    explore_mana_target = mo.ui.slider(
+        label="Mana target (millions)",
+        start=25,
+        stop=200,
+        step=5,
+        value=75,
+        show_value=True,
+    )
+    explore_update_fraction_scale = mo.ui.slider(
+        label="Update fraction scale (millions)",
+        start=200,
+        stop=2000,
+        step=50,
+        value=855,
+        show_value=True,
+    )
+    mo.hstack([explore_mana_target, explore_update_fraction_scale])
+    return explore_mana_target, explore_update_fraction_scale
+
+
+@app.cell
+def _(
+    CappedCongestion,
+    Float64FeeModel,
+    LinearCongestion,
+    NoCongestion,
+    Uint256,
+    blocks,
+    create_fee_model,
+    explore_mana_target,
+    explore_update_fraction_scale,
+    fee_inputs,
+    mo,
+    plt,
+    test_points,
+    time,
+):
+    def explore_fees():
+        inputs = fee_inputs(test_points)
+
+        # With the parameters of the simulation, the exact path must reproduce it
+        default = Float64FeeModel(create_fee_model(blocks))
+        excesses, prices = default.exact_states(inputs)
+        for slot in range(0, len(test_points), 97):
+            assert (
+                default.exact_components(inputs, slot, excesses[slot], prices[slot])
+                == test_points[slot].outputs.mana_base_fee_components_in_wei
+            )
+
+        # The float mode follows the congestion policy of the model, not only the fake exponential
+        for policy in (
+            NoCongestion(),
+            LinearCongestion(),
+            CappedCongestion(cap=Uint256(int(2e9))),
+        ):
+            other = Float64FeeModel(create_fee_model(blocks, congestion_policy=policy))
+            checked = other.spot_check(inputs, other.components(inputs))
+            assert checked["max_divergence_congestion_multiplier"] < 1e-6, (
+                policy,
+                checked,
+            )
+
+        model = Float64FeeModel(
+            create_fee_model(
+                blocks,
+                mana_target=Uint256(explore_mana_target.value * 1_000_000),
+                update_fraction_scale=Uint256(
+                    explore_update_fraction_scale.value * 1_000_000
+                ),
+            )
+        )
+        start = time.perf_counter()
+        components = model.components(inputs)
+        elapsed = time.perf_counter() - start
+        report = model.spot_check(inputs, components)
+
+        simulated = [tp.outputs.mana_base_fee_components_in_wei for tp in test_points]
+        fig, ax = plt.subplots(figsize=(12, 4))
+        ax.plot(
+            [
+                c.sequencer_cost.value + c.prover_cost.value + c.congestion_cost.value
+                for c in simulated
+            ],
+            label="Simulated (exact, default parameters)",
+        )
+        ax.plot(
+            components["sequencer_cost"]
+            + components["prover_cost"]
+            + components["congestion_cost"],
+            label="float64, chosen parameters",
+        )
+        ax.set_xlabel("Slot")
+        ax.set_ylabel("Mana base fee (wei)")
+        ax.set_title("Mana base fee with the same demand, oracle and price moves")
+        ax.legend()
+        ax.grid(True)
+        return mo.vstack(
+            [
+                mo.md(
+                    f"Recomputed {len(test_points)} slots in {elapsed * 1000:.2f}ms, spot-checked against the exact maths:"
+                ),
+                mo.ui.table([report], selection=None),
+                fig,
+            ]
+        )
+
+    explore_fees()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Common random numbers
+
+    Every random draw in the simulation comes from a named stream (mempool sizing, tx mana, fee acceptance and oracle movements) keyed by the slot, all derived from one seed.
+    Two parameter sets run with the same seed therefore face the same demand, and the difference between them is due to the parameters rather than the luck of the draw.
+
+    Comparing on common random numbers removes most of the noise from the difference, so far fewer runs are needed for the same confidence.
+    Below we report the standard error of the difference, and what it would have been with independent seeds; the square of their ratio is how many times more runs independent seeds would need.
+    """)
+    return
+
+
+@app.cell
+def _(RandomStreams, create_fee_model, np, simulate):
+    def compare_common_random_numbers(
+        blocks, config_a: dict, config_b: dict, metric, runs: int = 10, seed: int = 0
+    ) -> dict:
+        """
+        Runs both parameter sets (keyword arguments to `create_fee_model`) `runs` times, run `i` of both using seed `seed + i`.
+        `metric` maps the test points of a run to a number, we report the mean difference (b - a) and its standard errors.
+        """
+        a, b = [], []
+        for i in range(runs):
+            for config, results in ((config_a, a), (config_b, b)):
+                _, test_points = simulate(
+                    blocks, create_fee_model(blocks, **config), RandomStreams(seed + i)
+                )
+                results.append(metric(test_points))
+
+        a, b = np.array(a), np.array(b)
+        standard_error = np.std(b - a, ddof=1) / np.sqrt(runs)
+        independent_standard_error = np.sqrt(
+            (np.var(a, ddof=1) + np.var(b, ddof=1)) / runs
+        )
+        return {
+            "mean_difference": float(np.mean(b - a)),
+            "standard_error": float(standard_error),
+            "independent_standard_error": float(independent_standard_error),
+            "runs_saved_factor": float(
+                (independent_standard_error / standard_error) ** 2
+            ),
+        }
+
+    def mean_mana_base_fee(test_points) -> float:
+        return float(
+            np.mean(
+                [
+                    c.sequencer_cost.value
+                    + c.prover_cost.value
+                    + c.congestion_cost.value
+                    for c in (
+                        x.outputs.mana_base_fee_components_in_wei for x in test_points
+                    )
+                ]
+            )
+        )
+
+    return compare_common_random_numbers, mean_mana_base_fee
+
+
+@app.cell
+def _(mo):
+    crn_button = mo.ui.run_button(
+        label="Compare congestion capped at 2x to the default"
+    )
+    crn_button
+    return (crn_button,)
+
+
+@app.cell
+def _(
+    CappedCongestion,
+    Uint256,
+    blocks,
+    compare_common_random_numbers,
+    crn_button,
+    mean_mana_base_fee,
+    mo,
+):
+    mo.stop(not crn_button.value)
+
+    compare_common_random_numbers(
+        blocks[:300],
+        {},
+        {"congestion_policy": CappedCongestion(cap=Uint256(int(2e9)))},
+        mean_mana_base_fee,
+        runs=5,
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Parallel runs
+
+    Runs over many seeds (or parameter sets) are independent, so they can be spread over processes.
+    The workers are forked, so they see the L1 trace (and everything else defined in the notebook) through copy-on-write pages rather than every worker unpickling its own copy of the blocks.
+    Holding the trace as an `L1Trace` keeps it in a handful of int64 arrays, so their pages are never written and stay shared, no matter the number of workers.
+    Only the results are pickled back.
+    """)
+    return
+
+
+@app.cell
+def _(mo):
+    parallel_button = mo.ui.run_button(label="Run seeds in parallel")
+    parallel_button
+    return (parallel_button,)
+
+
+@app.cell
+def _(
+    L1Trace,
+    RandomStreams,
+    blocks,
+    create_fee_model,
+    fork_map,
+    mean_mana_base_fee,
+    mo,
+    parallel_button,
+    simulate,
+    time,
+):
+    mo.stop(not parallel_button.value)
+
+    _trace = L1Trace.from_blocks(blocks[:300])
+
+    def _mean_fee_for_seed(seed):
+        _, test_points = simulate(_trace, create_fee_model(_trace), RandomStreams(seed))
+        return mean_mana_base_fee(test_points)
+
+    _start = time.time()
+    _fees = fork_map(_mean_fee_for_seed, range(8))
+    mo.md(
+        f"Mean mana base fee over 8 seeds: {sum(_fees) / len(_fees):.0f} wei, took {time.time() - _start:.1f}s"
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Streaming L1 blocks
+
+    Fetching a new range of blocks from the node takes about as long as simulating it, and `get_blocks` has to finish before the simulation can start.
+    A `BlockStream` fetches the blocks in a background thread, and `simulate_stream` simulates every block as soon as it arrives, such that a fresh range takes about the longer of the two instead of their sum.
+    The queue between them is bounded, if the simulation falls behind the fetcher waits, so memory does not grow with the range.
+
+    E.g., `simulate_stream(stream_blocks(20973664, 5000), RandomStreams(0))` for a range that is not in `blocks.pkl` yet.
+    The demo below uses the collected blocks, with an artificial latency per block standing in for the node.
+    """)
+    return
+
+
+@app.cell
+def _(Uint256, create_fee_model, simulate_slot):
+    def simulate_stream(l1_blocks, streams, sinks=(), demand=None, fee_model=None):
+        """
+        Like `simulate`, but consumes the L1 blocks one at a time as they arrive (e.g., from a `BlockStream`).
+        The fee model is created from the first block unless given.
+        Returns the fee model, the L1 blocks, the L2 blocks and the test points.
+        """
+        l1_blocks_seen = []
+        l2_blocks = []
+        test_points = []
+        last_slot = 0
+        for l1_block in l1_blocks:
+            l1_blocks_seen.append(l1_block)
+            if fee_model is None:
+                fee_model = create_fee_model(l1_blocks_seen)
+
+            # The same slots as the `SlotScheduler`, the first L1 block of every slot after the last one
+            slot = (
+                l1_block.timestamp.value - fee_model.genesis_timestamp.value
+            ) // fee_model.slot_duration.value
+            if slot <= last_slot:
+                continue
+            last_slot = slot
+
+            block, test_point = simulate_slot(
+                fee_model,
+                l1_block,
+                Uint256(slot),
+                Uint256(len(l2_blocks) + 1),
+                streams,
+                demand,
+            )
+            for sink in sinks:
+                sink(l1_block, block, test_point)
+            l2_blocks.append(block)
+            test_points.append(test_point)
+        return fee_model, l1_blocks_seen, l2_blocks, test_points
+
+    return (simulate_stream,)
+
+
+@app.cell
+def _(mo):
+    stream_button = mo.ui.run_button(label="Compare fetch then simulate with streaming")
+    stream_button
+    return (stream_button,)
+
+
+@app.cell
+def _(
+    BlockStream,
+    RandomStreams,
+    blocks,
+    create_fee_model,
+    mo,
+    simulate,
+    simulate_stream,
+    stream_button,
+    time,
+):
+    mo.stop(not stream_button.value)
+
+    def _compare_streaming(count: int = 300, latency: float = 0.04):
+        def fetch(i):
+            time.sleep(latency)
+            return blocks[i]
+
+        start = time.time()
+        fetched = list(BlockStream(fetch, range(count)))
+        _, sequential_points = simulate(
+            fetched, create_fee_model(fetched), RandomStreams(0)
+        )
+        sequential = time.time() - start
+
+        start = time.time()
+        _, _, _, streamed_points = simulate_stream(
+            BlockStream(fetch, range(count), max_pending=32), RandomStreams(0)
+        )
+        streamed = time.time() - start
+
+        assert [tp.to_dict() for tp in streamed_points] == [
+            tp.to_dict() for tp in sequential_points
+        ]
+        return (
+            f"{count} blocks at {latency * 1000:.0f}ms each: "
+            f"fetch then simulate took {sequential:.1f}s, streaming took {streamed:.1f}s"
+        )
+
+    mo.md(_compare_streaming())
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Sparse activity
+
+    With little traffic most slots are empty.
+    Rather than adding them one by one, `add_empty_slots` skips a whole run of empty slots in constant time: the excess mana decays by `mana_target` per slot (until it hits 0) and the oracle queues the changes it would have queued along the way.
+    A chain with a small amount of traffic can then be simulated in time proportional to the number of blocks rather than the number of slots.
+
+    Below we first check that skipping gives the same state as adding the empty slots one at a time, and then run a long sparse scenario.
+    """)
+    return
+
+
+@app.cell
+def _(
+    Block,
+    Callable,
+    FeeHeaderHistory,
+    L1Fees,
+    L1Trace,
+    TxBatch,
+    Uint256,
+    blocks,
+    create_fee_model,
+    np,
+    random,
+):
+    def l1_fees_at_slots(l1_blocks, fee_model) -> Callable[[Uint256], L1Fees]:
+        """
+        The L1 fees photographed in a slot, e.g., those of the first L1 block at or after its start.
+        Past the end of the trace it wraps around, such that a short trace can drive a long run.
+        """
+        trace = (
+            l1_blocks
+            if isinstance(l1_blocks, L1Trace)
+            else L1Trace.from_blocks(l1_blocks)
+        )
+        genesis = fee_model.genesis_timestamp.value
+        duration = fee_model.slot_duration.value
+        first = (int(trace.timestamp[0]) - genesis) // duration
+        span = (int(trace.timestamp[-1]) - genesis) // duration - first + 1
+
+        def l1_fees_at(slot_number: Uint256) -> L1Fees:
+            slot = first + (slot_number.value - first) % span
+            index = min(
+                int(
+                    np.searchsorted(
+                        trace.timestamp, genesis + slot * duration, side="left"
+                    )
+                ),
+                len(trace) - 1,
+            )
+            return L1Fees(
+                blob_fee=Uint256(int(trace.blob_fee[index])),
+                base_fee=Uint256(int(trace.base_fee[index])),
+            )
+
+        return l1_fees_at
+
+    def simulate_sparse(
+        fee_model,
+        l1_fees_at: Callable[[Uint256], L1Fees],
+        block_slots: list[int],
+        slots: int,
+        seed: int = 0,
+        fast_forward: bool = True,
+    ):
+        """
+        Runs `slots` slots from the current one, where only the slots in `block_slots` (relative to the start) have a block.
+        Every slot photographs `l1_fees_at(slot_number)`.
+        With `fast_forward` the runs of empty slots are skipped with `add_empty_slots`, otherwise they are added one by one.
+        """
+        rng = random.Random(seed)
+        start = fee_model.current_slot_number().value
+
+        def next_slot():
+            fee_model.set_timestamp(
+                fee_model.current_timestamp + fee_model.slot_duration
+            )
+
+        def skip(count: int):
+            if fast_forward:
+                fee_model.add_empty_slots(Uint256(count), l1_fees_at)
+                return
+            for _ in range(count):
+                fee_model.photograph(l1_fees_at(fee_model.current_slot_number()))
+                fee_model.add_slot(None)
+                next_slot()
+
+        sparse_blocks = []
+        for block_slot in sorted(block_slots):
+            skip(start + block_slot - fee_model.current_slot_number().value)
+
+            fee_model.photograph(l1_fees_at(fee_model.current_slot_number()))
+            block = Block(
+                l1_block_number=blocks[-1].number,
+                timestamp=fee_model.current_timestamp,
+                slot_number=fee_model.current_slot_number(),
+                block_number=Uint256(len(sparse_blocks) + 1),
+                txs=TxBatch(
+                    mana_spent=[
+                        rng.randint(21_000, 500_000) for _ in range(rng.randint(1, 10))
+                    ]
+                ),
+            )
+            fee_model.add_slot(block)
+            sparse_blocks.append(block)
+            next_slot()
+
+        skip(start + slots - fee_model.current_slot_number().value)
+        return sparse_blocks
+
+    # Small check that skipping the empty slots is the same as adding them one by one, with the L1 fees moving along the gaps
+    _block_slots = random.Random(1).sample(range(2_000), 50)
+    _skipping = create_fee_model(blocks)
+    _stepping = create_fee_model(blocks)
+    _l1_fees_at = l1_fees_at_slots(blocks, _skipping)
+    _evicted = []
+    _stepping.fee_headers = FeeHeaderHistory(capacity=2, sink=_evicted.append)
+    simulate_sparse(_skipping, _l1_fees_at, _block_slots, 2_000)
+    simulate_sparse(_stepping, _l1_fees_at, _block_slots, 2_000, fast_forward=False)
+    assert len({_l1_fees_at(Uint256(slot)).base_fee for slot in range(2_000)}) > 1
+    assert len(_evicted) + len(_stepping.fee_headers) == _stepping.fee_headers.count
+    assert _skipping.fee_headers[-1] == _stepping.fee_headers[-1]
+    assert _skipping.l1_gas_oracle == _stepping.l1_gas_oracle
+    assert _skipping.current_timestamp == _stepping.current_timestamp
+    assert _skipping.mana_base_fee_components(
+        None
+    ) == _stepping.mana_base_fee_components(None)
+    return l1_fees_at_slots, simulate_sparse
+
+
+@app.cell
+def _(blocks, create_fee_model, l1_fees_at_slots, random, simulate_sparse):
+    def run_sparse_scenario(slots: int = 10_000_000, block_count: int = 1_000):
+        """
+        A chain with a block every ~10_000 slots, e.g., a handful of blocks a week, with the L1 fees of `blocks` on repeat.
+        """
+        fee_model = create_fee_model(blocks)
+        sparse_blocks = simulate_sparse(
+            fee_model,
+            l1_fees_at_slots(blocks, fee_model),
+            random.Random(2).sample(range(slots), block_count),
+            slots,
+        )
+        print(
+            f"Simulated {slots} slots with {len(sparse_blocks)} blocks using {fee_model.fee_headers.count} fee headers, {len(fee_model.fee_headers)} kept in memory"
+        )
+        return fee_model.mana_base_fee_components(None)
+
+    run_sparse_scenario()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Replaying recorded transactions
+
+    Rather than the randomized mempool, the simulation can replay recorded (or exported) txs, with their arrival time and sizes.
+    The trace is read in chunks from CSV, JSONL or Parquet (which needs `pyarrow`), so it never has to fit in memory.
+    The columns are `timestamp` and `mana_spent`, and optionally `nullifiers`, `notes`, `public_state_diffs`, `encrypted_logs_size` (as for `Tx`) and `max_fee_per_mana`.
+
+    A tx enters the mempool when it arrives, and the block builder takes the txs in arrival order until the block is full, skipping those that are not willing to pay the mana base fee.
+    """)
+    return
+
+
+@app.cell
+def _(TxBatch, csv, json, np, os, tempfile):
+    TX_TRACE_COLUMNS = (
+        "timestamp",
+        "mana_spent",
+        "nullifiers",
+        "notes",
+        "public_state_diffs",
+        "encrypted_logs_size",
+        "max_fee_per_mana",
+    )
+    # The values of empty (or null) optional cells, the same as when the column is left out
+    TX_TRACE_DEFAULTS = {
+        "nullifiers": 1,
+        "notes": 0,
+        "public_state_diffs": 1 + 2 + 2 + 2,
+        "encrypted_logs_size": 256,
+        "max_fee_per_mana": int(np.iinfo(np.int64).max),
+    }
+
+    def read_tx_trace(path: str, chunk_size: int = 65_536, columns=None):
+        """
+        Yields the txs of a trace in chunks of at most `chunk_size`, as dicts of int64 columns.
+        `columns` maps the names above to the names used in the file, if they differ.
+        Empty optional cells take their default, an empty `timestamp` or `mana_spent` raises with its row (counting from 1, without the header).
+        """
+        names = {name: name for name in TX_TRACE_COLUMNS} | (columns or {})
+
+        def missing_value(name: str, row: int) -> int:
+            if name not in TX_TRACE_DEFAULTS:
+                raise ValueError(f"The trace {path} has no {names[name]} in row {row}")
+            return TX_TRACE_DEFAULTS[name]
+
+        def present_columns(available):
+            present = [n for n in TX_TRACE_COLUMNS if names[n] in available]
+            missing = {"timestamp", "mana_spent"} - set(present)
+            if missing:
+                raise ValueError(f"The trace {path} is missing {sorted(missing)}")
+            return present
+
+        def rows_in_chunks(rows, present):
+            buffer = {n: [] for n in present}
+            for number, row in enumerate(rows, start=1):
+                for n in present:
+                    value = row.get(names[n])
+                    buffer[n].append(
+                        missing_value(n, number)
+                        if value is None or value == ""
+                        else int(value)
+                    )
+                if len(buffer["timestamp"]) == chunk_size:
+                    yield {n: np.array(v, dtype=np.int64) for n, v in buffer.items()}
+                    buffer = {n: [] for n in present}
+            if buffer["timestamp"]:
+                yield {n: np.array(v, dtype=np.int64) for n, v in buffer.items()}
+
+        extension = os.path.splitext(path)[1]
+        if extension == ".csv":
+            with open(path, newline="") as f:
+                reader = csv.DictReader(f)
+                yield from rows_in_chunks(reader, present_columns(reader.fieldnames))
+        elif extension == ".jsonl":
+            with open(path) as f:
+                rows = (json.loads(line) for line in f if line.strip())
+                first = next(rows, None)
+                if first is None:
+                    return
+                present = present_columns(first)
+                yield from rows_in_chunks(
+                    (r for part in ([first], rows) for r in part), present
+                )
+        elif extension == ".parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise ImportError("Reading parquet traces needs pyarrow") from e
+            parquet_file = pq.ParquetFile(path)
+            present = present_columns(parquet_file.schema_arrow.names)
+            first_row = 1
+            for batch in parquet_file.iter_batches(
+                batch_size=chunk_size, columns=[names[n] for n in present]
+            ):
+                chunk = {}
+                for n in present:
+                    column = batch.column(names[n])
+                    if column.null_count:
+                        first_null = int(
+                            np.argmax(column.is_null().to_numpy(zero_copy_only=False))
+                        )
+                        column = column.fill_null(
+                            missing_value(n, first_row + first_null)
+                        )
+                    chunk[n] = column.to_numpy(zero_copy_only=False).astype(np.int64)
+                first_row += batch.num_rows
+                yield chunk
+        else:
+            raise ValueError(f"Unsupported trace format {extension}")
+
+    class RecordedDemand:
+        """
+        The demand of recorded txs, to pass to `simulate`. The chunks are read as the simulation reaches their arrival time, and the
+        mempool is capped at `max_pending` txs by dropping the oldest. With a `start_timestamp` the trace is shifted to start then.
+        """
+
+        def __init__(self, chunks, start_timestamp=None, max_pending: int = 100_000):
+            self.chunks = iter(chunks)
+            self.start_timestamp = start_timestamp
+            self.max_pending = max_pending
+            self.offset = None
+            self.upcoming = None
+
+            self.pending = TxBatch(mana_spent=[])
+            self.pending_arrival = np.zeros(0, dtype=np.int64)
+            self.pending_max_fee = np.zeros(0, dtype=np.int64)
+            self.included = 0
+            self.dropped = 0
+
+        def _arrive(self, timestamp: int):
+            arrived = [(self.pending, self.pending_arrival, self.pending_max_fee)]
+            while True:
+                if self.upcoming is None:
+                    chunk = next(self.chunks, None)
+                    if chunk is None:
+                        break
+                    if self.offset is None:
+                        self.offset = (
+                            0
+                            if self.start_timestamp is None
+                            else self.start_timestamp - int(chunk["timestamp"][0])
+                        )
+                    self.upcoming = (
+                        TxBatch(**{f: chunk[f] for f in TxBatch.FIELDS if f in chunk}),
+                        chunk["timestamp"] + self.offset,
+                        chunk.get(
+                            "max_fee_per_mana",
+                            np.full(len(chunk["timestamp"]), np.iinfo(np.int64).max),
+                        ),
+                    )
+                txs, arrival, max_fee = self.upcoming
+                count = int(np.searchsorted(arrival, timestamp, side="right"))
+                arrived.append((txs[:count], arrival[:count], max_fee[:count]))
+                if count < len(arrival):
+                    self.upcoming = (txs[count:], arrival[count:], max_fee[count:])
+                    break
+                self.upcoming = None
+
+            self.pending = TxBatch.concatenate([a[0] for a in arrived])
+            self.pending_arrival = np.concatenate([a[1] for a in arrived])
+            self.pending_max_fee = np.concatenate([a[2] for a in arrived])
+            if len(self.pending_arrival) > self.max_pending:
+                drop = len(self.pending_arrival) - self.max_pending
+                self.dropped += drop
+                self._keep(np.arange(drop, len(self.pending_arrival)))
+
+        def _keep(self, index):
+            self.pending = self.pending[index]
+            self.pending_arrival = self.pending_arrival[index]
+            self.pending_max_fee = self.pending_max_fee[index]
+
+        def __call__(self, timestamp, real_cost, mana_base_fee, mana_target):
+            self._arrive(timestamp.value)
+            willing = self.pending_max_fee >= mana_base_fee.value
+            mana = np.where(willing, self.pending.mana_spent, 0)
+            taken = willing & (np.cumsum(mana) <= 2 * mana_target.value)
+
+            txs = self.pending[taken]
+            self.included += len(txs)
+            self._keep(~taken)
+            return txs
+
+    # Small check that empty optional cells take their default, and an empty required cell names its row
+    with tempfile.TemporaryDirectory() as _directory:
+        _path = os.path.join(_directory, "txs.csv")
+        with open(_path, "w") as _f:
+            _f.write("timestamp,mana_spent,notes,max_fee_per_mana\n1,21000,,\n2,,3,5\n")
+        try:
+            list(read_tx_trace(_path))
+        except ValueError as _e:
+            assert "mana_spent in row 2" in str(_e)
+        else:
+            raise AssertionError("An empty mana_spent should raise")
+        with open(_path, "w") as _f:
+            _f.write(
+                "timestamp,mana_spent,notes,max_fee_per_mana\n1,21000,,\n2,500,3,5\n"
+            )
+        (_chunk,) = read_tx_trace(_path)
+        assert _chunk["notes"].tolist() == [0, 3]
+        assert _chunk["max_fee_per_mana"].tolist() == [np.iinfo(np.int64).max, 5]
+
+    return RecordedDemand, read_tx_trace
+
+
+@app.cell
+def _(mo):
+    replay_button = mo.ui.run_button(label="Replay a recorded trace")
+    replay_button
+    return (replay_button,)
+
+
+@app.cell
+def _(
+    RandomStreams,
+    RecordedDemand,
+    blocks,
+    create_fee_model,
+    json,
+    mo,
+    np,
+    os,
+    plt,
+    read_tx_trace,
+    replay_button,
+    simulate,
+    tempfile,
+):
+    mo.stop(not replay_button.value)
+
+    def replay_example(tx_count: int = 500_000, seed: int = 0):
+        """
+        Writes a stand-in trace (Poisson arrivals at ~1.25x the target rate, with some larger txs) and replays it.
+        """
+        rng = np.random.default_rng(seed)
+        duration = blocks[-1].timestamp.value - blocks[0].timestamp.value
+        arrival = np.sort(rng.integers(0, duration, tx_count))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "txs.jsonl")
+            with open(path, "w") as f:
+                for t in range(tx_count):
+                    f.write(
+                        json.dumps(
+                            {
+                                "timestamp": int(arrival[t]),
+                                "mana_spent": int(rng.integers(21_000, 300_000)),
+                                "notes": int(rng.integers(0, 4)),
+                                "max_fee_per_mana": int(rng.lognormal(21, 0.5)),
+                            }
+                        )
+                        + "\n"
+                    )
+
+            demand = RecordedDemand(
+                read_tx_trace(path), start_timestamp=blocks[0].timestamp.value
+            )
+            fee_model = create_fee_model(blocks)
+            l2_blocks, test_points = simulate(
+                blocks, fee_model, RandomStreams(seed), demand=demand
+            )
+
+        fig, ax = plt.subplots(figsize=(12, 4))
+        ax.plot([b.mana_spent().value for b in l2_blocks], label="Mana spent")
+        ax.axhline(fee_model.mana_target.value, color="grey", label="Target")
+        ax.set_xlabel("Slot")
+        ax.set_ylabel("Mana")
+        ax.set_title("Replayed trace")
+        ax.legend()
+        ax.grid(True)
+        return mo.vstack(
+            [
+                mo.ui.table(
+                    [
+                        {
+                            "txs": tx_count,
+                            "included": demand.included,
+                            "dropped": demand.dropped,
+                            "pending": len(demand.pending),
+                        }
+                    ],
+                    selection=None,
+                ),
+                ax,
+            ]
+        )
+
+    replay_example()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Checkpoints
+
+    A long replay lives in memory only, so if it is interrupted it starts again from `blocks[0]`.
+    A `Checkpointer` runs the simulation like `simulate`, and every `every` blocks writes a snapshot of everything needed to continue: the fee model, the random streams, the demand, the sinks and the position in the L1 blocks.
+    The fee model only holds its last few fee headers, so a snapshot stays small however long the run is.
+
+    Running it again continues from the latest snapshot. Outputs go through sinks that are part of the snapshot, e.g., a `JsonLinesSink` keeps the number of bytes it had written and truncates its file back to it when resumed, so a resumed run writes exactly the same bytes as an uninterrupted one.
+    """)
+    return
+
+
+@app.cell
+def _(DiskCache, SlotScheduler, Uint256, json, os, pickle, simulate_slot):
+    class JsonLinesSink:
+        """
+        Writes the test points to `path`, one JSON object per line. The file is only opened at the first write.
+        Pickling it (as part of a snapshot) flushes the file and keeps the offset. A restored sink truncates the file
+        back to that offset at its first write and appends from there, unpickling alone never touches the file.
+        """
+
+        def __init__(self, path: str):
+            self.path = path
+            self.offset = 0
+            self.file = None
+            self.restored = False
+
+        def _open(self):
+            if not self.restored:
+                self.file = open(self.path, "wb")
+                return
+            # Anything written after the snapshot is written again
+            self.file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+            if self.file.seek(0, os.SEEK_END) < self.offset:
+                self.file.close()
+                self.file = None
+                raise ValueError(
+                    f"{self.path} is shorter than the {self.offset} bytes written before the snapshot"
+                )
+            self.file.truncate(self.offset)
+            self.file.seek(self.offset)
+
+        def __call__(self, l1_block, block, test_point):
+            if self.file is None:
+                self._open()
+            line = json.dumps(test_point.to_dict(), default=str).encode() + b"\n"
+            self.file.write(line)
+            self.offset += len(line)
+
+        def close(self):
+            if self.file is not None:
+                self.file.close()
+
+        def __getstate__(self):
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            return {"path": self.path, "offset": self.offset}
+
+        def __setstate__(self, state):
+            self.__dict__.update(state)
+            self.file = None
+            self.restored = True
+
+    class Checkpointer:
+        """
+        Snapshots of a simulation every `every` blocks, keeping the latest `keep` of them.
+        The snapshots of a run go in a subdirectory keyed by the initial model, the L1 blocks, the seed, and the pickled
+        sinks and demand (e.g., the path of a `JsonLinesSink`), such that another run never resumes from them.
+        The sinks and the demand (if any) must therefore be picklable.
+        """
+
+        def __init__(
+            self, directory: str = ".sim_checkpoints", every: int = 1000, keep: int = 2
+        ):
+            self.directory = directory
+            self.every = every
+            self.keep = keep
+
+        def run_directory(self, blocks, fee_model, streams, sinks, demand=None) -> str:
+            key = DiskCache.digest(
+                fee_model,
+                DiskCache.constants(fee_model),
+                blocks,
+                streams.seed,
+                *(
+                    (type(part).__qualname__, pickle.dumps(part))
+                    for part in [*sinks, demand]
+                ),
+            )
+            return os.path.join(self.directory, key[:16])
+
+        def snapshots(self, directory: str) -> list[str]:
+            if not os.path.isdir(directory):
+                return []
+            return sorted(
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.endswith(".pkl")
+            )
+
+        def save(self, directory: str, state: dict) -> str:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{state['block_number']:012d}.pkl")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            for old in self.snapshots(directory)[: -self.keep]:
+                os.remove(old)
+            return path
+
+        def run(
+            self, blocks, fee_model, streams, sinks=(), demand=None, max_blocks=None
+        ) -> dict:
+            """
+            Simulates like `simulate(blocks, fee_model, streams, sinks, demand)`, resuming from the latest snapshot if any,
+            in which case the given model, streams, sinks and demand are replaced by the ones of the snapshot.
+            `max_blocks` stops after that many blocks in this call, e.g., to interrupt a run on purpose.
+
+            Returns the state at the end: the `fee_model`, `streams`, `sinks`, `demand`, the last `slot_number` and
+            `block_number`, and whether the run is `done`.
+            """
+            directory = self.run_directory(blocks, fee_model, streams, sinks, demand)
+            snapshots = self.snapshots(directory)
+            if snapshots:
+                with open(snapshots[-1], "rb") as f:
+                    state = pickle.load(f)
+            else:
+                state = {
+                    "fee_model": fee_model,
+                    "streams": streams,
+                    "sinks": list(sinks),
+                    "demand": demand,
+                    "slot_number": 0,
+                    "block_number": 0,
+                    "done": False,
+                }
+
+            if state["done"]:
+                return state
+
+            simulated = 0
+            scheduler = SlotScheduler.for_model(
+                blocks, state["fee_model"], after_slot=state["slot_number"]
+            )
+            for slot_number, l1_block_index in scheduler:
+                if simulated == max_blocks:
+                    return state
+                block, test_point = simulate_slot(
+                    state["fee_model"],
+                    blocks[l1_block_index],
+                    slot_number,
+                    Uint256(state["block_number"] + 1),
+                    state["streams"],
+                    state["demand"],
+                )
+                for sink in state["sinks"]:
+                    sink(blocks[l1_block_index], block, test_point)
+                state["slot_number"] = slot_number.value
+                state["block_number"] += 1
+                simulated += 1
+                if state["block_number"] % self.every == 0:
+                    self.save(directory, state)
+
+            state["done"] = True
+            self.save(directory, state)
+            return state
+
+    return Checkpointer, JsonLinesSink
+
+
+@app.cell
+def _(
+    Checkpointer,
+    JsonLinesSink,
+    RandomStreams,
+    blocks,
+    create_fee_model,
+    json,
+    os,
+    pickle,
+    tempfile,
+    test_points,
+):
+    def check_checkpoints(
+        count: int = 150, every: int = 40, interrupt_after: int = 100
+    ):
+        """
+        Interrupts a run between two snapshots, with output written past the last one, and resumes it.
+        """
+        l1_blocks = blocks[: 6 * count]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test_points.jsonl")
+            checkpointer = Checkpointer(os.path.join(directory, "checkpoints"), every)
+
+            def run(max_blocks=None):
+                state = checkpointer.run(
+                    l1_blocks,
+                    create_fee_model(l1_blocks),
+                    RandomStreams(0),
+                    sinks=[JsonLinesSink(path)],
+                    max_blocks=max_blocks,
+                )
+                state["sinks"][0].close()
+                return state
+
+            interrupted = run(interrupt_after)
+            assert not interrupted["done"]
+            assert interrupted["block_number"] % every != 0
+            resumed = run()
+            assert resumed["done"]
+            (run_directory,) = os.listdir(checkpointer.directory)
+            assert (
+                len(
+                    checkpointer.snapshots(
+                        os.path.join(checkpointer.directory, run_directory)
+                    )
+                )
+                == checkpointer.keep
+            )
+
+            # Unpickling a sink, e.g., through a deepcopy, leaves its file alone until it writes
+            pickle.loads(pickle.dumps(JsonLinesSink(path)))
+            # A run writing elsewhere never resumes from the snapshots of this one
+            assert checkpointer.run_directory(
+                l1_blocks,
+                create_fee_model(l1_blocks),
+                RandomStreams(0),
+                [JsonLinesSink(path)],
+            ) != checkpointer.run_directory(
+                l1_blocks,
+                create_fee_model(l1_blocks),
+                RandomStreams(0),
+                [JsonLinesSink(f"{path}.other")],
+            )
+
+            with open(path, "rb") as f:
+                written = f.read()
+        expected = b"".join(
+            json.dumps(tp.to_dict(), default=str).encode() + b"\n"
+            for tp in test_points[: resumed["block_number"]]
+        )
+        assert written == expected
+        return resumed["block_number"]
+
+    check_checkpoints()
+    return
+
+
+@app.cell
+def _(mo):
+    checkpoint_button = mo.ui.run_button(label="Interrupt and resume the full run")
+    checkpoint_button
+    return (checkpoint_button,)
+
+
+@app.cell
+def _(
+    Checkpointer,
+    JsonLinesSink,
+    RandomStreams,
+    blocks,
+    checkpoint_button,
+    create_fee_model,
+    hashlib,
+    mo,
+    os,
+    tempfile,
+    time,
+):
+    mo.stop(not checkpoint_button.value)
+
+    def _interrupt_and_resume(every: int = 100, interrupt_every: int = 250):
+        rows = []
+        with tempfile.TemporaryDirectory() as directory:
+            for name, interrupt_after in (
+                ("uninterrupted", None),
+                (f"interrupted every {interrupt_every} blocks", interrupt_every),
+            ):
+                path = os.path.join(directory, f"{name}.jsonl")
+                # Both runs share the directory, they are told apart by their output path
+                checkpointer = Checkpointer(
+                    os.path.join(directory, "checkpoints"), every
+                )
+                start = time.time()
+                while True:
+                    state = checkpointer.run(
+                        blocks,
+                        create_fee_model(blocks),
+                        RandomStreams(0),
+                        sinks=[JsonLinesSink(path)],
+                        max_blocks=interrupt_after,
+                    )
+                    state["sinks"][0].close()
+                    if state["done"]:
+                        break
+                elapsed = time.time() - start
+                snapshots = checkpointer.snapshots(
+                    checkpointer.run_directory(
+                        blocks,
+                        create_fee_model(blocks),
+                        RandomStreams(0),
+                        [JsonLinesSink(path)],
+                    )
+                )
+                with open(path, "rb") as f:
+                    rows.append(
+                        {
+                            "run": name,
+                            "seconds": round(elapsed, 1),
+                            "blocks": state["block_number"],
+                            "snapshot_kb": round(
+                                os.path.getsize(snapshots[-1]) / 1024, 1
+                            ),
+                            "sha256": hashlib.sha256(f.read()).hexdigest(),
+                        }
+                    )
+
+        assert rows[0]["sha256"] == rows[1]["sha256"]
+        return mo.ui.table(rows, selection=None)
+
+    _interrupt_and_resume()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## What-if branches
+
+    To ask "what if the L1 fees spike here" or "what if demand doubles from slot X", we do not need to rerun the trace from the start for every scenario.
+    `simulate_branches` simulates up to the fork slot once, and then continues every scenario in a forked process, which shares the state of the fork (the model, the blocks and the test points so far) copy-on-write with the others.
+    Every branch starts from its own copy of the model, which is cheap as the model only keeps its last few fee headers.
+
+    A scenario is called as `scenario(blocks, start, fee_model, streams)` with `start` the first L1 block after the fork, and returns the L1 blocks and the demand of the branch, e.g., `fee_spike` or `demand_scale` below.
+    The random streams are keyed by slot, so every branch sees the same draws and differs from the others by its scenario alone.
+    """)
+    return
+
+
+@app.cell
+def _(
+    L1BlockSub,
+    SlotScheduler,
+    Uint256,
+    deepcopy,
+    fork_map,
+    np,
+    randomized_txs,
+    simulate,
+):
+    class PatchedL1Blocks:
+        """
+        The L1 blocks with some replaced by `patches` (by index), without copying the others.
+        """
+
+        def __init__(self, blocks, patches: dict):
+            self.blocks = blocks
+            self.patches = patches
+
+        def __len__(self) -> int:
+            return len(self.blocks)
+
+        def __getitem__(self, index: int):
+            if index < 0:
+                index += len(self.blocks)
+            return self.patches.get(index) or self.blocks[index]
+
+        def __iter__(self):
+            return (self[i] for i in range(len(self.blocks)))
+
+    def fee_spike(factor: int, l1_blocks: int):
+        """
+        The L1 base and blob fees multiplied by `factor` for `l1_blocks` L1 blocks after the fork.
+        """
+
+        def scenario(blocks, start, fee_model, streams):
+            patches = {}
+            for i in range(start, min(start + l1_blocks, len(blocks))):
+                b = blocks[i]
+                patches[i] = L1BlockSub(
+                    number=b.number,
+                    timestamp=b.timestamp,
+                    blob_fee=b.blob_fee * Uint256(factor),
+                    base_fee=b.base_fee * Uint256(factor),
+                    excess_blob_gas=b.excess_blob_gas,
+                )
+            return PatchedL1Blocks(blocks, patches), None
+
+        return scenario
+
+    class ScaledDemand:
+        """
+        The randomized demand of `simulate` (see `randomized_txs`), with `factor` times the planned mana and mempool size.
+        This is `factor` times the demand at every price (up to the block limit), and the same as `simulate` for a factor of 1.
+        """
+
+        def __init__(self, streams, fee_model, factor: float):
+            self.streams = streams
+            self.genesis_timestamp = fee_model.genesis_timestamp.value
+            self.slot_duration = fee_model.slot_duration.value
+            self.factor = factor
+
+        def __call__(self, timestamp, real_cost, mana_base_fee, mana_target):
+            slot_number = (
+                timestamp.value - self.genesis_timestamp
+            ) // self.slot_duration
+            return randomized_txs(
+                self.streams,
+                Uint256(slot_number),
+                mana_target,
+                real_cost,
+                mana_base_fee,
+                self.factor,
+            )
+
+    def demand_scale(factor: float):
+        """
+        `factor` times the demand after the fork, see `ScaledDemand`.
+        """
+
+        def scenario(blocks, start, fee_model, streams):
+            return blocks, ScaledDemand(streams, fee_model, factor)
+
+        return scenario
+
+    def simulate_branches(
+        blocks, fee_model, streams, fork_slot: int, scenarios: dict, processes=None
+    ):
+        """
+        Simulates the slots up to `fork_slot` once, and every scenario after it in forked processes.
+        A scenario of None continues as `simulate` would. The fee model is left at the fork, so it can be forked again.
+        Returns the test points up to the fork, and the test points after the fork per scenario.
+        """
+        scheduler = SlotScheduler.for_model(blocks, fee_model)
+        slots = scheduler.slot_numbers
+        # Both the prefix and the branches need at least one slot
+        if len(slots) < 2 or not slots[0] <= fork_slot < slots[-1]:
+            raise ValueError(
+                f"Cannot fork at slot {fork_slot}, the L1 blocks have slots before and after it only for forks in [{slots[0] if len(slots) else None}, {slots[-1] if len(slots) else None})"
+            )
+        after_fork = int(
+            np.searchsorted(scheduler.slot_numbers, fork_slot, side="right")
+        )
+        start = (
+            int(scheduler.l1_block_indices[after_fork])
+            if after_fork < len(scheduler)
+            else len(blocks)
+        )
+        _, prefix = simulate(blocks[:start], fee_model, streams)
+
+        def run_branch(name):
+            # A worker can run several branches, each starts from its own copy of the (small) model and streams
+            branch_model = deepcopy(fee_model)
+            branch_streams = deepcopy(streams)
+            branch_blocks, demand = (
+                scenarios[name](blocks, start, branch_model, branch_streams)
+                if scenarios[name] is not None
+                else (blocks, None)
+            )
+            _, test_points = simulate(
+                branch_blocks,
+                branch_model,
+                branch_streams,
+                demand=demand,
+                after_slot=fork_slot,
+                block_number=len(prefix),
+            )
+            return test_points
+
+        branches = fork_map(run_branch, list(scenarios), processes)
+        return prefix, dict(zip(scenarios, branches))
+
+    return demand_scale, fee_spike, simulate_branches
+
+
+@app.cell
+def _(mo):
+    branches_button = mo.ui.run_button(label="Simulate what-if branches")
+    branches_button
+    return (branches_button,)
+
+
+@app.cell
+def _(
+    RandomStreams,
+    blocks,
+    branches_button,
+    create_fee_model,
+    demand_scale,
+    fee_spike,
+    mo,
+    plt,
+    simulate_branches,
+    test_points,
+    time,
+):
+    mo.stop(not branches_button.value)
+
+    def _branches_example():
+        def mana_base_fees(points):
+            return [
+                c.sequencer_cost.value + c.prover_cost.value + c.congestion_cost.value
+                for c in (tp.outputs.mana_base_fee_components_in_wei for tp in points)
+            ]
+
+        def mana_spent(points):
+            return sum(tp.block_header.mana_spent.value for tp in points)
+
+        fork_slot = test_points[len(test_points) // 2].block_header.slot_number.value
+        scenarios = {
+            "baseline": None,
+            "L1 fees x10 for an hour": fee_spike(10, 300),
+            "demand x1": demand_scale(1),
+            "demand x2": demand_scale(2),
+            "demand x0.5": demand_scale(0.5),
+        }
+        start = time.time()
+        prefix, branches = simulate_branches(
+            blocks, create_fee_model(blocks), RandomStreams(0), fork_slot, scenarios
+        )
+        elapsed = time.time() - start
+
+        # Continuing without a scenario is the same as the simulation above
+        assert [tp.to_dict() for tp in prefix + branches["baseline"]] == [
+            tp.to_dict() for tp in test_points
+        ]
+        # Scaling the demand by 1 changes nothing, and more demand spends more mana
+        assert [tp.to_dict() for tp in branches.pop("demand x1")] == [
+            tp.to_dict() for tp in branches["baseline"]
+        ]
+        assert mana_spent(branches["demand x2"]) > mana_spent(branches["baseline"])
+        assert mana_spent(branches["demand x0.5"]) < mana_spent(branches["baseline"])
+
+        fig, ax = plt.subplots(figsize=(12, 5))
+        ax.plot(
+            [tp.block_header.slot_number.value for tp in prefix],
+            mana_base_fees(prefix),
+            color="black",
+            label="Before the fork",
+        )
+        for name, branch in branches.items():
+            ax.plot(
+                [tp.block_header.slot_number.value for tp in branch],
+                mana_base_fees(branch),
+                label=name,
+            )
+        ax.axvline(fork_slot, color="grey", linestyle="--")
+        ax.set_xlabel("Slot")
+        ax.set_ylabel("Mana base fee (wei)")
+        ax.set_yscale("log")
+        ax.set_title(
+            f"{len(branches)} branches from slot {fork_slot}, took {elapsed:.1f}s"
+        )
+        ax.legend()
+        ax.grid(True)
+        return ax
+
+    _branches_example()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## To test with sol
+    """)
+    return
+
+
+@app.cell
+def _(
+    INITIAL_ETH_PER_FEE_ASSET,
+    ETH_PER_FEE_ASSET_PRECISION,
+    MAX_ETH_PER_FEE_ASSET,
+    MAX_FEE_ASSET_PRICE_MODIFIER_BPS,
+    MIN_ETH_PER_FEE_ASSET,
+    fee_model,
+):
+    # Constants for the fee maths!
+    def get_solidity_code():
+        return f"""
+        uint256 internal constant PROVING_COST_PER_MANA = {fee_model.proving_cost_per_mana.to_dict()};
+
+        // Fee asset pricing constants (ETH/AZTEC ratio with 1e12 precision)
+        uint256 internal constant ETH_PER_FEE_ASSET_PRECISION = {ETH_PER_FEE_ASSET_PRECISION.to_dict()};
+        uint256 internal constant MIN_ETH_PER_FEE_ASSET = {MIN_ETH_PER_FEE_ASSET.to_dict()};
+        uint256 internal constant MAX_ETH_PER_FEE_ASSET = {MAX_ETH_PER_FEE_ASSET.to_dict()};
+        int256 internal constant MAX_FEE_ASSET_PRICE_MODIFIER_BPS = {MAX_FEE_ASSET_PRICE_MODIFIER_BPS.to_dict()};
+        uint256 internal constant INITIAL_ETH_PER_FEE_ASSET = {INITIAL_ETH_PER_FEE_ASSET.to_dict()};
+        """
+
+    get_solidity_code()
+    return
+
+
+@app.cell
+def _(
+    Uint256,
+    blocks,
+    dataclass,
+    fee_model,
+    json,
+    json_serializable,
+    test_points,
+):
+    @json_serializable
+    @dataclass
+    class L1Metadata:
+        block_number: Uint256
+        timestamp: Uint256
+        blob_fee: Uint256
+        base_fee: Uint256
+
+    def get_json():
+        return {
+            "l1_metadata": [
+                L1Metadata(
+                    block_number=x.number,
+                    timestamp=x.timestamp,
+                    blob_fee=x.blob_fee,
+                    base_fee=x.base_fee,
+                ).to_dict()
+                for x in blocks
+            ],
+            "points": [x.to_dict() for x in test_points],
+            "proving_cost": fee_model.proving_cost_per_mana.to_dict(),
+        }
+
+    def get_dump():
+        return json.dumps(get_json())
+
+    # Create a json object that we can throw at foundry tests
+    get_dump()
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    # Bandwidth
+
+    In Etheruem, the bandwidth consumed by a validator as noted in the Eth 2.0 book is ~3.5mb/s.
+
+    If we follow the assumption that Ethereum transactions are 700 bytes, and have 15 txs per second, the 180 transaction per block will "require" 0.01mb/s, so there is a good chunk of overhead etc.
+    """)
+    return
+
+
+@app.cell
+def _():
+    ETH_TX_BANDWIDTH = 700
+    ETH_BLOCK_BANDWIDTH = ETH_TX_BANDWIDTH * 15
+
+    ETH_MB_PER_SEC = ETH_BLOCK_BANDWIDTH / 1024 / 1024
+    print(f"Tx Bandwidth: {ETH_MB_PER_SEC:.2f} MB/s -> {ETH_MB_PER_SEC * 8:.2f} mbit/s")
+
+    ETH_FACTOR = 3.5 / ETH_MB_PER_SEC
+
+    print(f"ETH_FACTOR: {ETH_FACTOR:.2f}")
+    return (ETH_FACTOR,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    We call this overhead for the `ETH_FACTOR`. The overhead is due to the gossiping across the nodes, the transactions that might not actually make it, the block headers etc.
+
+    We don't expect to have as big of an overhead, for the simple reason that we do not expect to have as many nodes. Nevertheless, it is a good thing to keep in mind when thinking about the bandwidth requirements.
+    """)
+    return
+
+
+@app.cell
+def _(ETH_FACTOR):
+    AZTEC_TX_BANDWIDTH = 80 * 1024
+    AZTEC_BLOCK_BANDWIDTH = AZTEC_TX_BANDWIDTH * 10
+    AZTEC_MB_PER_SEC = AZTEC_BLOCK_BANDWIDTH / 1024 / 1024
+    print(
+        f"Bandwidth: {AZTEC_MB_PER_SEC:.2f} MB/s -> {AZTEC_MB_PER_SEC * 8:.2f} mbit/s"
+    )
+
+    ASSUMED_AZTEC_FACTOR = max(1, ETH_FACTOR / 32)
+
+    print(f"ASSUMED_AZTEC_FACTOR: {ASSUMED_AZTEC_FACTOR:.2f}")
 
     print(
         f"Bandwidth with assumed AZTEC_FACTOR: {AZTEC_MB_PER_SEC * 8 * ASSUMED_AZTEC_FACTOR:.2f} mbit/s"
     )
+    return ASSUMED_AZTEC_FACTOR, AZTEC_TX_BANDWIDTH
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(r"""
+    ## Bandwidth from the simulated blocks
+
+    Rather than assuming ten txs per block, we can use the simulated blocks.
+    Every tx is gossiped with its proof, so it costs `size_in_bytes` plus the proof size for every copy a node receives.
+    In a gossip mesh a node receives a message from up to `mesh_degree` peers, fewer in a network smaller than the mesh, and we apply the `ASSUMED_AZTEC_FACTOR` overhead on top of it (scaled by how full the mesh is).
+    Past `mesh_degree + 1` nodes this sustained bandwidth no longer depends on the size of the network.
+
+    What does grow with the network is the number of hops, about $\log_D N$ for a mesh of degree $D$.
+    The block itself (without the tx proofs, the txs were gossiped already) has to cross all of them within a propagation deadline, so every node forwards it to its mesh peers within its share of that deadline.
+    This burst bandwidth is what limits how large blocks can get as the network grows.
+
+    We compute both per node for every slot and for many network sizes at once, and report the percentiles to size the node links against.
+    """)
+    return
+
+
+@app.cell
+def _(ASSUMED_AZTEC_FACTOR, AZTEC_TX_BANDWIDTH, FeeModel, np):
+    def simulate_bandwidth(
+        l2_blocks,
+        node_counts,
+        gossip_overhead: float = ASSUMED_AZTEC_FACTOR,
+        tx_proof_size_in_bytes: int = AZTEC_TX_BANDWIDTH,
+        mesh_degree: int = 8,
+        slot_duration: int = FeeModel.AZTEC_SLOT_DURATION.value,
+        propagation_deadline: float = 4.0,
+    ) -> dict:
+        """
+        Returns the bandwidth per node in mbit/s, with a row per network size and a column per slot, and its percentiles.
+        The sustained bandwidth (`mbit_per_sec`) assumes the txs of a block are gossiped over the slot leading up to it.
+        The burst bandwidth (`burst_mbit_per_sec`) is needed to forward the block over the ~log_D(N) hops within `propagation_deadline` seconds.
+        """
+        node_counts = np.asarray(node_counts)
+        block_bytes = np.array([b.size_in_bytes().value for b in l2_blocks])
+        bytes_per_slot = block_bytes + tx_proof_size_in_bytes * np.array(
+            [len(b.txs) for b in l2_blocks]
+        )
+
+        peers = np.minimum(mesh_degree, node_counts - 1)
+        mbit_per_sec = (
+            (bytes_per_slot * 8 / 1024 / 1024 / slot_duration)[None, :]
+            * gossip_overhead
+            * (peers / mesh_degree)[:, None]
+        )
+
+        hops = np.maximum(
+            1, np.ceil(np.log(node_counts) / np.log(mesh_degree) - 1e-9)
+        ).astype(int)
+        burst_mbit_per_sec = (block_bytes * 8 / 1024 / 1024 / propagation_deadline)[
+            None, :
+        ] * (peers * hops)[:, None]
+
+        percentiles = [50, 90, 99, 100]
+        return {
+            "node_counts": node_counts,
+            "hops": hops,
+            "mbit_per_sec": mbit_per_sec,
+            "burst_mbit_per_sec": burst_mbit_per_sec,
+            "percentiles": percentiles,
+            "mbit_per_sec_percentiles": np.percentile(
+                mbit_per_sec, percentiles, axis=1
+            ).T,
+            "burst_mbit_per_sec_percentiles": np.percentile(
+                burst_mbit_per_sec, percentiles, axis=1
+            ).T,
+        }
+
+    return (simulate_bandwidth,)
+
+
+@app.cell
+def _(fee_model, l2_blocks, mo, plt, simulate_bandwidth):
+    def plot_bandwidth():
+        bandwidth = simulate_bandwidth(
+            l2_blocks,
+            [2, 4, 8, 16, 100, 1000, 10_000],
+            slot_duration=fee_model.slot_duration.value,
+        )
+
+        fig, ax = plt.subplots(figsize=(12, 4))
+        aztec_l1_block_numbers = [b.l1_block_number.value for b in l2_blocks]
+        for n, series in zip(bandwidth["node_counts"], bandwidth["burst_mbit_per_sec"]):
+            if n in (4, 100, 10_000):
+                ax.plot(
+                    aztec_l1_block_numbers, series, label=f"{n} nodes", linewidth=0.75
+                )
+        ax.set_xlabel("Block Number")
+        ax.set_ylabel("mbit/s per node")
+        ax.set_title("Burst bandwidth per node to propagate the simulated blocks")
+        ax.legend()
+        ax.grid(True)
+
+        table = [
+            {
+                "nodes": int(n),
+                "hops": int(hops),
+                **{
+                    f"p{p} mbit/s": round(float(v), 2)
+                    for p, v in zip(bandwidth["percentiles"], sustained)
+                },
+                **{
+                    f"p{p} burst mbit/s": round(float(v), 2)
+                    for p, v in zip(bandwidth["percentiles"], burst)
+                },
+            }
+            for n, hops, sustained, burst in zip(
+                bandwidth["node_counts"],
+                bandwidth["hops"],
+                bandwidth["mbit_per_sec_percentiles"],
+                bandwidth["burst_mbit_per_sec_percentiles"],
+            )
+        ]
+        return mo.vstack([ax, mo.ui.table(table, selection=None)])
+
+    plot_bandwidth()
     return
 
 
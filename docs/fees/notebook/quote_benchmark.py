@@ -0,0 +1,162 @@
+"""
+A load generator for `quote_server.py`: `clients` connections each keep `pipeline` requests in flight, asking for
+quotes up to `max_slots_ahead` slots ahead (and the current components), and we report the throughput and latency
+seen by the clients next to the server metrics.
+
+By default it starts a server in the same process, so it runs offline, e.g., to compare batch sizes:
+
+    python quote_benchmark.py --clients 32 --pipeline 8
+    python quote_benchmark.py --clients 32 --pipeline 8 --max-batch 1
+
+Use `--port` to run against a server that is already running instead.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from quote_server import QuoteServer, QuoteService, load_model_api
+
+
+async def run_client(
+    host: str,
+    port: int,
+    requests: int,
+    pipeline: int,
+    max_slots_ahead: int,
+    seed: int,
+    latencies: list,
+) -> int:
+    """
+    Sends `requests` requests with at most `pipeline` in flight, returns the number of error responses.
+    """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = {}
+    errors = 0
+    in_flight = asyncio.Semaphore(pipeline)
+
+    async def read_responses():
+        nonlocal errors
+        for _ in range(requests):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(response["id"]))
+            errors += "error" in response
+            in_flight.release()
+
+    reading = asyncio.create_task(read_responses())
+    for request_id in range(requests):
+        await in_flight.acquire()
+        slots_ahead = rng.randint(-1, max_slots_ahead)
+        request = (
+            {"id": request_id, "method": "mana_base_fee_components"}
+            if slots_ahead < 0
+            else {"id": request_id, "method": "quote", "slots_ahead": slots_ahead}
+        )
+        request["in_fee_asset"] = rng.random() < 0.5
+        sent[request_id] = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+    await reading
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def fetch_metrics(host: str, port: int) -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(json.dumps({"id": 0, "method": "metrics"}).encode() + b"\n")
+    response = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return response["result"]
+
+
+async def benchmark(args) -> dict:
+    if args.port is None:
+        service = QuoteService(load_model_api(), args.l1_blocks, args.seed)
+        server = QuoteServer(
+            service,
+            slot_interval=args.slot_interval,
+            max_batch=args.max_batch,
+            batch_window=args.batch_window,
+        )
+        listening = await server.start(args.host, 0)
+        port = listening.sockets[0].getsockname()[1]
+    else:
+        port = args.port
+
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(
+        *(
+            run_client(
+                args.host,
+                port,
+                args.requests,
+                args.pipeline,
+                args.max_slots_ahead,
+                args.seed * 1000 + i,
+                latencies,
+            )
+            for i in range(args.clients)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    metrics = await fetch_metrics(args.host, port)
+    if args.port is None:
+        server.close()
+        await listening.wait_closed()
+
+    latencies_ms = 1000 * np.array(latencies)
+    p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_ms_p50": p50,
+        "latency_ms_p90": p90,
+        "latency_ms_p99": p99,
+        "server": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, default=None, help="An already running server"
+    )
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--pipeline", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="Per client")
+    parser.add_argument("--max-slots-ahead", type=int, default=2)
+    parser.add_argument("--slot-interval", type=float, default=0.1)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--batch-window", type=float, default=0.0)
+    parser.add_argument("--l1-blocks", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    server = results.pop("server")
+    for name, value in results.items():
+        print(
+            f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+        )
+    print("server:")
+    for name, value in server.items():
+        print(
+            f"  {name}: {value:.2f}"
+            if isinstance(value, float)
+            else f"  {name}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+A local fee quote service around the fee model of `fee-model.py`, to test wallet and sequencer integrations against it.
+
+The model is taken from the notebook (running only the `quote_server_refs` cell and the cells it depends on) and advances
+one slot every `slot_interval` seconds over a synthetic L1 trace, building blocks of random size, so it runs offline.
+
+Clients send one JSON request per line over TCP, and get one JSON response per line with the same `id`, e.g.,
+
+    {"id": 1, "method": "mana_base_fee_components", "in_fee_asset": false}
+    {"id": 2, "method": "quote", "slots_ahead": 2}
+    {"id": 3, "method": "metrics"}
+
+Responses can come out of order. Requests that arrive together are answered as a batch against the same slot,
+computing every distinct query once.
+
+    python quote_server.py --port 8551
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import time
+from collections import deque
+
+import numpy as np
+
+NOTEBOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fee-model.py")
+
+# Around the blocks collected in the notebook, the model cannot start at timestamp 0
+SYNTHETIC_START_TIMESTAMP = 1_729_000_000
+
+COMPONENTS = (
+    "sequencer_cost",
+    "prover_cost",
+    "congestion_cost",
+    "congestion_multiplier",
+)
+
+
+def load_model_api(notebook_path: str = NOTEBOOK_PATH) -> dict:
+    """
+    The model classes and functions of the notebook, see the `quote_server_refs` cell.
+    """
+    spec = importlib.util.spec_from_file_location("fee_model_notebook", notebook_path)
+    notebook = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(notebook)
+    _, defs = notebook.quote_server_refs.run()
+    return defs["quote_server_api"]
+
+
+def components_to_json(components) -> dict:
+    return {name: getattr(components, name).value for name in COMPONENTS}
+
+
+class QuoteService:
+    """
+    The fee model moving over an L1 trace. Between slots the model is in the state the next block is built on,
+    e.g., with the L1 fees of the slot photographed, which is the state quotes are computed from.
+    """
+
+    def __init__(self, api: dict, l1_blocks: int = 100_000, seed: int = 0):
+        self.api = api
+        self.rng = random.Random(f"{seed}/quote_service")
+        self.trace = api["generate_l1_trace"](
+            l1_blocks, seed=seed, start_timestamp=SYNTHETIC_START_TIMESTAMP
+        )
+        self.fee_model = api["create_fee_model"](self.trace)
+        self.slots = iter(api["SlotScheduler"].for_model(self.trace, self.fee_model))
+        self.slot_number = None
+        self.block_number = 0
+        self._enter_next_slot()
+
+    def _enter_next_slot(self) -> bool:
+        slot_number, index = next(self.slots, (None, None))
+        if slot_number is None:
+            return False
+        l1_block = self.trace[index]
+        self.fee_model.set_timestamp(l1_block.timestamp)
+        self.fee_model.photograph(
+            self.api["L1Fees"](blob_fee=l1_block.blob_fee, base_fee=l1_block.base_fee)
+        )
+        self.slot_number = slot_number
+        self.l1_block = l1_block
+        return True
+
+    def advance(self) -> bool:
+        """
+        Builds the block of the current slot and moves to the next one, returns False at the end of the trace.
+        """
+        Uint256 = self.api["Uint256"]
+        mana_target = self.fee_model.mana_target.value
+        self.block_number += 1
+        block = self.api["Block"](
+            l1_block_number=self.l1_block.number,
+            block_number=Uint256(self.block_number),
+            slot_number=self.slot_number,
+            timestamp=self.l1_block.timestamp,
+            txs=self.api["TxBatch"](mana_spent=[self.rng.randint(0, 2 * mana_target)]),
+        )
+        oracle_input = self.api["OracleInput"](
+            fee_asset_price_modifier=self.api["Int256"](self.rng.randint(-100, 100))
+        )
+        self.fee_model.add_slot(block, oracle_input)
+        return self._enter_next_slot()
+
+    def answer(self, method: str, slots_ahead: int = 0, in_fee_asset: bool = False):
+        if method == "mana_base_fee_components":
+            components = self.fee_model.mana_base_fee_components(None, in_fee_asset)
+            return {
+                "slot_number": self.slot_number.value,
+                **components_to_json(components),
+            }
+        if method == "quote":
+            if not isinstance(slots_ahead, int) or slots_ahead < 0:
+                raise ValueError(f"Invalid slots_ahead: {slots_ahead}")
+            quote = self.fee_model.quote(self.api["Uint256"](slots_ahead), in_fee_asset)
+            return {
+                "slot_number": self.slot_number.value,
+                "quoted_slot_number": quote.slot_number.value,
+                "current": components_to_json(quote.current),
+                "lower": components_to_json(quote.lower),
+                "upper": components_to_json(quote.upper),
+            }
+        raise ValueError(f"Unknown method: {method}")
+
+
+class QuoteServer:
+    """
+    Serves a `QuoteService` over TCP. The requests go through one queue, and are answered in batches of at most
+    `max_batch`, waiting up to `batch_window` seconds for more requests to join a batch. The model only advances
+    between batches, so a batch is always answered from a single slot.
+    """
+
+    def __init__(
+        self,
+        service: QuoteService,
+        slot_interval: float = 1.0,
+        max_batch: int = 256,
+        batch_window: float = 0.0,
+        latency_samples: int = 10_000,
+    ):
+        self.service = service
+        self.slot_interval = slot_interval
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.queue = asyncio.Queue()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.computed = 0
+        self.latencies = deque(maxlen=latency_samples)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8551):
+        """
+        Starts listening and answering, returns the `asyncio.Server`, e.g., for the port it is bound to with port 0.
+        """
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        self.tasks = [
+            asyncio.create_task(self._answer_batches()),
+            asyncio.create_task(self._advance_slots()),
+        ]
+        return self.server
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8551):
+        await self.start(host, port)
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.server.close()
+
+    async def _handle_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(line: bytes):
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                request = e
+            if isinstance(request, dict):
+                response = await self._submit(request)
+            else:
+                response = {"id": None, "error": f"Expected a JSON object: {request}"}
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _submit(self, request: dict) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((time.perf_counter(), request, future))
+        return await future
+
+    async def _answer_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self._answer(batch)
+            # Let the connections (and the slot clock) in before the next batch
+            await asyncio.sleep(0)
+
+    def _answer(self, batch):
+        # Every distinct query is computed once per batch
+        answers = {}
+        self.batches += 1
+        for received, request, future in batch:
+            try:
+                answer = self._answer_request(request, answers)
+            except Exception as e:
+                # A failing request must neither stop the batch loop nor leave its client waiting
+                answer = {"error": f"Internal error: {type(e).__name__}: {e}"}
+            self.requests += 1
+            if "error" in answer:
+                self.errors += 1
+            self.latencies.append(time.perf_counter() - received)
+            if not future.done():
+                future.set_result({"id": request.get("id"), **answer})
+
+    def _answer_request(self, request: dict, answers: dict) -> dict:
+        method = request.get("method")
+        if method == "metrics":
+            return {"result": self.metrics()}
+        slots_ahead = request.get("slots_ahead", 0)
+        if not isinstance(method, str) or not isinstance(slots_ahead, int):
+            return {"error": f"Invalid request: {request}"}
+
+        key = (method, slots_ahead, bool(request.get("in_fee_asset", False)))
+        if key not in answers:
+            try:
+                answers[key] = {"result": self.service.answer(*key)}
+            except ValueError as e:
+                answers[key] = {"error": str(e)}
+            except Exception as e:
+                answers[key] = {"error": f"Internal error: {type(e).__name__}: {e}"}
+            self.computed += 1
+        return answers[key]
+
+    async def _advance_slots(self):
+        while True:
+            await asyncio.sleep(self.slot_interval)
+            if not self.service.advance():
+                print("Reached the end of the L1 trace, quoting from the last slot")
+                return
+
+    def metrics(self) -> dict:
+        """
+        Counts since the start, and the latency (from receiving a request to answering it) over the recent requests.
+        """
+        uptime = time.perf_counter() - self.started
+        latencies_ms = 1000 * np.array(self.latencies or [np.nan])
+        p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+        return {
+            "slot_number": self.service.slot_number.value,
+            "uptime_s": uptime,
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "computed": self.computed,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "requests_per_s": self.requests / uptime,
+            "latency_ms_p50": p50,
+            "latency_ms_p90": p90,
+            "latency_ms_p99": p99,
+            "latency_ms_max": float(latencies_ms.max()),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8551)
+    parser.add_argument("--slot-interval", type=float, default=1.0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--batch-window", type=float, default=0.0)
+    parser.add_argument("--l1-blocks", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service = QuoteService(load_model_api(), args.l1_blocks, args.seed)
+    server = QuoteServer(
+        service,
+        slot_interval=args.slot_interval,
+        max_batch=args.max_batch,
+        batch_window=args.batch_window,
+    )
+    print(f"Serving fee quotes on {args.host}:{args.port}")
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
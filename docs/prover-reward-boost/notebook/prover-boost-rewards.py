@@ -10,12 +10,25 @@ def _():
     import matplotlib.pyplot as plt
     import random
     import numpy as np
+    import os
+    import sys
 
     from pydantic import StrictInt, field_validator, Field
     from pydantic.dataclasses import dataclass
     from dataclasses import fields
     import json
-    return StrictInt, dataclass, field_validator, json, mo, np, plt, random
+    return (
+        StrictInt,
+        dataclass,
+        field_validator,
+        json,
+        mo,
+        np,
+        os,
+        plt,
+        random,
+        sys,
+    )
 
 
 @app.cell
@@ -24,6 +37,137 @@ def _():
     return (precision,)
 
 
+@app.cell(hide_code=True)
+def _(json, os):
+    class TestVectorExporter:
+        """
+        Streams test vectors to disk in chunks, such that long horizons are never held in memory or in the notebook output.
+        `format="json"` writes `{stem}.json` as `{"config": ..., column: [...], ...}`, assembled from a part file per column on close.
+        `format="binary"` writes `{stem}.{column}.bin` per column as fixed width big endian words, and `{stem}.json` with the config and the column lengths.
+        The words default to 32 bytes, e.g., the `uint256` words that Solidity tests decode with `abi.decode`.
+        An evenly spaced sample of at most `preview_rows` rows is kept as a preview.
+        Used as a context manager, an exception removes the files of the partial vector set rather than closing it.
+        """
+
+        def __init__(
+            self,
+            directory,
+            stem,
+            config,
+            columns,
+            format="json",
+            chunk_size=4096,
+            word_size=32,
+            preview_rows=500,
+        ):
+            if format not in ("json", "binary"):
+                raise ValueError(f"Unknown format {format}")
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, stem)
+            self.config = config
+            self.columns = columns
+            self.format = format
+            self.chunk_size = chunk_size
+            self.word_size = word_size
+            self.preview_rows = preview_rows
+
+            self.rows = 0
+            self.buffers = {c: [] for c in columns}
+            self.parts = {c: open(self._part_path(c), "wb") for c in columns}
+            self.preview = []
+            self.preview_stride = 1
+
+        def _part_path(self, column):
+            if self.format == "binary":
+                return f"{self.path}.{column}.bin"
+            return f"{self.path}.{column}.part"
+
+        def append(self, **row):
+            values = {
+                c: row[c].value if hasattr(row[c], "value") else row[c]
+                for c in self.columns
+            }
+            for c in self.columns:
+                self.buffers[c].append(values[c])
+            if self.rows % self.preview_stride == 0:
+                self.preview.append({"row": self.rows, **values})
+                # Halve the sample (and double the stride) when it grows too large
+                if len(self.preview) > self.preview_rows:
+                    self.preview = self.preview[::2]
+                    self.preview_stride *= 2
+            self.rows += 1
+            if len(self.buffers[self.columns[0]]) >= self.chunk_size:
+                self.flush()
+
+        def flush(self):
+            for c in self.columns:
+                values = self.buffers[c]
+                if not values:
+                    continue
+                if self.format == "binary":
+                    data = b"".join(
+                        int(v).to_bytes(self.word_size, "big") for v in values
+                    )
+                else:
+                    data = ",".join(json.dumps(v) for v in values).encode()
+                    if self.parts[c].tell() > 0:
+                        data = b"," + data
+                self.parts[c].write(data)
+                self.buffers[c] = []
+
+        def close(self):
+            self.flush()
+            for part in self.parts.values():
+                part.close()
+
+            with open(f"{self.path}.json", "wb") as f:
+                if self.format == "binary":
+                    f.write(
+                        json.dumps(
+                            {
+                                "config": self.config,
+                                "rows": self.rows,
+                                "word_size": self.word_size,
+                                "columns": {
+                                    c: os.path.basename(self._part_path(c))
+                                    for c in self.columns
+                                },
+                            }
+                        ).encode()
+                    )
+                    return
+
+                f.write(b'{"config": ' + json.dumps(self.config).encode())
+                for c in self.columns:
+                    f.write(f', "{c}": ['.encode())
+                    with open(self._part_path(c), "rb") as part:
+                        while chunk := part.read(1 << 20):
+                            f.write(chunk)
+                    f.write(b"]")
+                    os.remove(self._part_path(c))
+                f.write(b"}")
+
+        def abort(self):
+            """
+            Removes the files written so far, such that a partial vector set is never mistaken for a complete one.
+            """
+            for part in self.parts.values():
+                part.close()
+            for path in [*map(self._part_path, self.columns), f"{self.path}.json"]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            if exc_info[0] is not None:
+                self.abort()
+                return
+            self.close()
+    return (TestVectorExporter,)
+
+
 @app.cell(hide_code=True)
 def _(StrictInt, dataclass, field_validator):
     def bounded_int(min_value: int, max_value: int):
@@ -144,6 +288,17 @@ def _(StrictInt, dataclass, field_validator):
     return (Uint256,)
 
 
+@app.cell
+def _(mo, sys):
+    # Checked arrays with the semantics of `Uint256` and forked workers, shared with the fee model notebook
+    _shared = str(mo.notebook_dir().parents[1] / "shared")
+    if _shared not in sys.path:
+        sys.path.append(_shared)
+    from uint256_array import Uint256Array
+    from parallel import fork_map
+    return Uint256Array, fork_map
+
+
 @app.cell
 def _(mo, precision):
     mo.md(
@@ -209,45 +364,80 @@ def _(mo):
         value=75,
     )
 
-    mo.hstack([upper_limit, proof_increase, proof_probability])
-    return proof_increase, proof_probability, upper_limit
+    seed = mo.ui.number(label="Seed", start=0, value=0)
+
+    epochs = mo.ui.number(label="Epochs (0 is twice the upper limit)", start=0, value=0)
+
+    export_format = mo.ui.dropdown(
+        label="Test vector format", options=["json", "binary"], value="json"
+    )
+
+    mo.vstack(
+        [
+            mo.hstack([upper_limit, proof_increase, proof_probability, seed]),
+            mo.hstack([epochs, export_format]),
+        ]
+    )
+    return (
+        epochs,
+        export_format,
+        proof_increase,
+        proof_probability,
+        seed,
+        upper_limit,
+    )
 
 
 @app.cell
 def _(
+    TestVectorExporter,
     Uint256,
-    json,
+    epochs,
+    export_format,
     mo,
     plt,
     precision,
     proof_increase,
     proof_probability,
     random,
+    seed,
     upper_limit,
 ):
-    def plot_activity_score(upper_limit=50, p=0.75, proof_increase=2):
+    def plot_activity_score(
+        upper_limit=50, p=0.75, proof_increase=2, seed=0, epochs=None, format="json"
+    ):
+        # Seeded per component, such that different parameters see the same proof production draws
+        proof_rng = random.Random(f"{seed}/proof_production")
         config = {
             "h": Uint256(int(upper_limit * precision)),
             "pi": Uint256(int(proof_increase * precision)),
         }
 
-        X = [Uint256(i) for i in range(upper_limit * 2)]
-        is_proven = [False]
-        Y = [Uint256(0)]
         one = Uint256(precision)
+        y = Uint256(0)
+
+        exporter = TestVectorExporter(
+            "test-vectors",
+            "activity_score",
+            {k: v.to_dict() for k, v in config.items()},
+            ["is_proven", "activity_score"],
+            format=format,
+        )
+        with exporter:
+            exporter.append(is_proven=False, activity_score=y)
+            for _ in range(1, epochs or upper_limit * 2):
+                a = y - one if y > one else Uint256(0)
+                mark = proof_rng.random() <= p
+                r = config["pi"] if mark else Uint256(0)
 
-        for x in X[1:]:
-            a = Y[-1] - one if Y[-1] > one else Uint256(0)
-            mark = random.random() <= p
-            r = config["pi"] if mark else Uint256(0)
-
-            Y.append(min(a + r, config["h"]))
-            is_proven.append(mark)
+                y = min(a + r, config["h"])
+                exporter.append(is_proven=mark, activity_score=y)
 
         fig, ax = plt.subplots(figsize=(12, 4))
 
-        X_r = [x.value for x in X]
-        Y_r = [y.value / precision for y in Y]
+        # Only the sampled rows are plotted, the full vectors are in the files
+        X_r = [row["row"] for row in exporter.preview]
+        Y_r = [row["activity_score"] / precision for row in exporter.preview]
 
         ax.plot(X_r, Y_r)
 
@@ -257,21 +447,24 @@ def _(
         ax.set_ylabel("Activity Score")
         ax.set_xlabel("Epochs")
 
-        data = json.dumps(
-            {
-                "config": {k: v.to_dict() for k, v in config.items()},
-                "is_proven": is_proven,
-                "activity_score": [y.to_dict() for y in Y],
-            }
+        return mo.vstack(
+            [
+                ax,
+                mo.md(
+                    f"Wrote {exporter.rows} rows to `{exporter.path}.*`, sampled preview:"
+                ),
+                mo.ui.table(exporter.preview, selection=None),
+            ]
         )
 
-        return mo.vstack([ax, data])
-
 
     plot_activity_score(
         upper_limit=upper_limit.value,
         p=proof_probability.value / 100,
         proof_increase=proof_increase.value,
+        seed=seed.value,
+        epochs=epochs.value,
+        format=export_format.value,
     )
     return
 
@@ -306,7 +499,19 @@ def _(mo):
 
 
 @app.cell
-def _(Uint256, a, k, mo, np, plt, precision, proof_increase, upper_limit):
+def _(
+    TestVectorExporter,
+    Uint256,
+    a,
+    export_format,
+    k,
+    mo,
+    np,
+    plt,
+    precision,
+    proof_increase,
+    upper_limit,
+):
     def prover_weigth(x, a, k, h, m):
         if x > h:
             return k
@@ -318,7 +523,7 @@ def _(Uint256, a, k, mo, np, plt, precision, proof_increase, upper_limit):
             return max(lhs - rhs, m)
 
 
-    def plot_prover_weigth(a, k, h, m):
+    def plot_prover_weigth(a, k, h, m, format="json"):
         c = {
             "a": Uint256(int(a * precision)),
             "k": Uint256(int(k * precision)),
@@ -328,11 +533,25 @@ def _(Uint256, a, k, mo, np, plt, precision, proof_increase, upper_limit):
 
         step = proof_increase.value - 1
 
-        X = [Uint256(int(i * precision)) for i in np.arange(0, h + 10, step)]
-        Y = [prover_weigth(x, c["a"], c["k"], c["h"], c["m"]) for x in X]
+        config = {
+            **{k: v.to_dict() for k, v in c.items()},
+            "pi": int(proof_increase.value * precision),
+        }
+        exporter = TestVectorExporter(
+            "test-vectors",
+            "prover_weight",
+            config,
+            ["activity_score", "shares"],
+            format=format,
+        )
+        with exporter:
+            for i in np.arange(0, h + 10, step):
+                x = Uint256(int(i * precision))
+                y = prover_weigth(x, c["a"], c["k"], c["h"], c["m"])
+                exporter.append(activity_score=x, shares=y)
 
-        X_r = [x.value / precision for x in X]
-        Y_r = [y.value / precision for y in Y]
+        X_r = [row["activity_score"] / precision for row in exporter.preview]
+        Y_r = [row["shares"] / precision for row in exporter.preview]
 
         fig, ax = plt.subplots(figsize=(12, 4))
         ax.plot(X_r, Y_r)
@@ -343,15 +562,15 @@ def _(Uint256, a, k, mo, np, plt, precision, proof_increase, upper_limit):
         ax.set_ylabel("Shares")
         ax.set_xlabel("Activity Score")
 
-        c["pi"] = Uint256(int(proof_increase.value * precision))
-
-        data = {
-            "config": {k: v.to_dict() for k, v in c.items()},
-            "activity_score": [x.to_dict() for x in X],
-            "shares": [y.to_dict() for y in Y],
-        }
-
-        return mo.vstack([ax, data])
+        return mo.vstack(
+            [
+                ax,
+                mo.md(
+                    f"Wrote {exporter.rows} rows to `{exporter.path}.*`, sampled preview:"
+                ),
+                mo.ui.table(exporter.preview, selection=None),
+            ]
+        )
 
 
     plot_prover_weigth(
@@ -359,6 +578,281 @@ def _(Uint256, a, k, mo, np, plt, precision, proof_increase, upper_limit):
         k=k.value,
         h=upper_limit.value,
         m=1,
+        format=export_format.value,
+    )
+    return (prover_weigth,)
+
+
+@app.cell
+def _(mo):
+    mo.md(
+        r"""
+    # Prover competition
+
+    The plots above follow a single prover, but what we care about is how the boost redistributes the rewards across the whole prover set.
+    So we simulate a population of provers that differ in:
+
+    - `uptime`, the probability that they are online in an epoch,
+    - `cost`, what it costs them to produce a proof, they only prove if the reward they expect (their shares times the last reward per share) covers it,
+    - `stake`, which scales their shares, give everyone the same stake to get the design as described above.
+
+    Every epoch the activity scores are updated as above, and the epoch reward is split among the provers that proved, according to their (stake scaled) shares.
+    The rewards collected over all epochs are then summarised as concentration metrics:
+
+    - the Gini coefficient, 0 when everyone earned the same and 1 when one prover earned everything,
+    - the share of the rewards going to the top N provers,
+    - the Nakamoto coefficient, the smallest number of provers that together earned more than half of the rewards.
+
+    Every seed draws its own population and proof production, shared by all parameter sets such that they are compared on the same provers.
+    The seeds run in parallel.
+    """
+    )
+    return
+
+
+@app.cell
+def _(
+    Uint256,
+    Uint256Array,
+    fork_map,
+    np,
+    precision,
+    prover_weigth,
+):
+    def prover_weigths(x, a, k, h, m):
+        """
+        `prover_weigth` over an array of activity scores, with the same checked integer maths.
+        """
+        d = Uint256Array([h]) - Uint256Array(np.minimum(x, h))
+        rhs = (d * a).mul_div(d, precision**2).values
+        return np.where(x > h, k, np.maximum(k - np.minimum(rhs, k), m))
+
+
+    # The vectorized version must agree with the reference one
+    for _x in (0, 1, 12_345, 25 * precision, 50 * precision, 60 * precision):
+        _c = [int(0.05 * precision), 10 * precision, 50 * precision, precision]
+        assert (
+            prover_weigths(np.array([_x]), *_c)[0]
+            == prover_weigth(Uint256(_x), *[Uint256(v) for v in _c]).value
+        )
+
+
+    def sample_provers(
+        rng, count, uptime=(8, 2), cost_median=0.5, cost_sigma=0.5, stake_sigma=1.0
+    ):
+        """
+        A population of provers. Uptime is Beta distributed, cost and stake are lognormal.
+        The cost is relative to the fair share of an epoch reward (reward / count), the stake has median 1.
+        """
+        return {
+            "uptime": rng.beta(*uptime, size=count),
+            "cost": cost_median / count * rng.lognormal(0, cost_sigma, size=count),
+            "stake": rng.lognormal(0, stake_sigma, size=count),
+        }
+
+
+    def prover_weigths_float(x, a, k, h, m):
+        """
+        `prover_weigths` in float64, with the scores and parameters as plain numbers (not scaled by `precision`).
+        """
+        return np.where(x > h, k, np.maximum(k - a * (h - x) ** 2, m))
+
+
+    def weigth_divergence(x, params):
+        """
+        The largest relative difference between the float64 weights and the exact ones, at the (float) scores `x`.
+        """
+        c = {key: int(value * precision) for key, value in params.items()}
+        exact = prover_weigths(
+            np.round(x * precision).astype(np.int64),
+            c["a"], c["k"], c["h"], c["m"],
+        ) / precision
+        approximate = prover_weigths_float(
+            x, params["a"], params["k"], params["h"], params["m"]
+        )
+        return float(np.max(np.abs(approximate - exact) / exact))
+
+
+    def simulate_competition(
+        provers, params, epochs, rng, approximate=False, check_every=100, samples=64
+    ):
+        """
+        Returns the rewards per prover after `epochs` epochs, with the epoch reward normalised to 1.
+        `params` holds the boost parameters `h` (upper limit), `pi`, `a`, `k` and `m` as in the plots above.
+
+        With `approximate` the scores and weights are float64 rather than the exact integer maths, and every
+        `check_every` epochs the weights of `samples` random provers are checked against the exact ones.
+        Also returns the largest relative divergence seen (0 for the exact maths).
+        """
+        c = {key: int(value * precision) for key, value in params.items()}
+        if approximate:
+            c, one, dtype = dict(params), 1.0, np.float64
+        else:
+            one, dtype = precision, np.int64
+        count = len(provers["uptime"])
+        score = np.zeros(count, dtype=dtype)
+        rewards = np.zeros(count)
+        reward_per_share = 1.0 / count
+        divergence = 0.0
+        check_rng = np.random.default_rng([epochs, count])
+
+        for epoch in range(epochs):
+            decayed = np.maximum(score - one, 0)
+            proved_score = np.minimum(decayed + c["pi"], c["h"])
+            if approximate:
+                weigths = prover_weigths_float(
+                    proved_score, c["a"], c["k"], c["h"], c["m"]
+                )
+                if epoch % check_every == 0:
+                    sampled = check_rng.choice(count, min(samples, count), replace=False)
+                    divergence = max(
+                        divergence, weigth_divergence(proved_score[sampled], params)
+                    )
+            else:
+                weigths = (
+                    prover_weigths(proved_score, c["a"], c["k"], c["h"], c["m"])
+                    / precision
+                )
+            shares = provers["stake"] * weigths
+
+            online = rng.random(count) < provers["uptime"]
+            proving = online & (shares * reward_per_share >= provers["cost"])
+            score = np.where(proving, proved_score, decayed)
+
+            total_shares = shares[proving].sum()
+            if total_shares > 0:
+                reward_per_share = 1.0 / total_shares
+                rewards[proving] += shares[proving] * reward_per_share
+
+        return rewards, divergence
+
+
+    def concentration(rewards, top_n=10):
+        ranked = np.sort(rewards)[::-1]
+        total = ranked.sum()
+        if total == 0:
+            # Nobody proved, e.g., the costs are above the rewards, so there is nothing to be concentrated
+            return {
+                "gini": 0.0,
+                f"top_{top_n}_share": 0.0,
+                "nakamoto_coefficient": 0,
+            }
+        cumulative = np.cumsum(ranked) / total
+        n = len(ranked)
+        # Gini from the ascending ranks: sum((2i - n - 1) * x_i) / (n * sum(x))
+        ascending = ranked[::-1]
+        gini = np.sum((2 * np.arange(1, n + 1) - n - 1) * ascending) / (n * total)
+        return {
+            "gini": float(gini),
+            f"top_{top_n}_share": float(cumulative[top_n - 1]),
+            "nakamoto_coefficient": int(
+                np.searchsorted(cumulative, 0.5, side="right") + 1
+            ),
+        }
+
+
+    def compare_boosts(
+        param_sets, provers=1000, epochs=1000, seeds=4, top_n=10, approximate=False
+    ):
+        """
+        Returns the concentration metrics per parameter set, averaged over the seeds.
+        With `approximate` it runs in float64 and adds the largest divergence from the exact weights (over the seeds).
+        """
+
+        def run_seed(seed):
+            population = sample_provers(np.random.default_rng([seed, 0]), provers)
+            results = {}
+            for name, params in param_sets.items():
+                rewards, divergence = simulate_competition(
+                    population,
+                    params,
+                    epochs,
+                    np.random.default_rng([seed, 1]),
+                    approximate=approximate,
+                )
+                results[name] = concentration(rewards, top_n)
+                if approximate:
+                    results[name]["max_divergence"] = divergence
+            return results
+
+        per_seed = fork_map(run_seed, range(seeds))
+        return {
+            name: {
+                metric: float(
+                    (np.max if metric == "max_divergence" else np.mean)(
+                        [r[name][metric] for r in per_seed]
+                    )
+                )
+                for metric in per_seed[0][name]
+            }
+            for name in param_sets
+        }
+
+    return (compare_boosts,)
+
+
+@app.cell
+def _(mo):
+    competition_provers = mo.ui.number(label="Provers", start=10, value=1000, step=10)
+    competition_epochs = mo.ui.number(label="Epochs", start=10, value=1000, step=10)
+    competition_seeds = mo.ui.number(label="Seeds", start=1, value=4)
+    competition_float64 = mo.ui.checkbox(label="float64 (exploration only)")
+    competition_button = mo.ui.run_button(label="Simulate competition")
+    mo.hstack(
+        [
+            competition_provers,
+            competition_epochs,
+            competition_seeds,
+            competition_float64,
+            competition_button,
+        ]
+    )
+    return (
+        competition_button,
+        competition_epochs,
+        competition_float64,
+        competition_provers,
+        competition_seeds,
+    )
+
+
+@app.cell
+def _(
+    a,
+    compare_boosts,
+    competition_button,
+    competition_epochs,
+    competition_float64,
+    competition_provers,
+    competition_seeds,
+    k,
+    mo,
+    proof_increase,
+    upper_limit,
+):
+    mo.stop(not competition_button.value)
+
+    _current = {
+        "h": upper_limit.value,
+        "pi": proof_increase.value,
+        "a": a.value,
+        "k": k.value,
+        "m": 1,
+    }
+    _metrics = compare_boosts(
+        {
+            "no boost": {**_current, "k": 1},
+            "current": _current,
+            "double k": {**_current, "k": 2 * k.value},
+        },
+        provers=competition_provers.value,
+        epochs=competition_epochs.value,
+        seeds=competition_seeds.value,
+        approximate=competition_float64.value,
+    )
+    mo.ui.table(
+        [{"parameters": name, **m} for name, m in _metrics.items()],
+        selection=None,
     )
     return
 
@@ -0,0 +1,65 @@
+"""
+Forked worker processes, shared by the notebooks.
+
+The workers are forked, such that the function can be anything defined in a notebook (marimo cells are not importable)
+and sees the memory of the caller as it was, e.g., large traces or populations are shared copy-on-write rather than
+pickled per worker. Only the results are pickled back.
+"""
+
+import multiprocessing
+import os
+import queue
+import traceback
+from typing import Optional
+
+
+def fork_map(
+    fn, args, processes: Optional[int] = None, poll_interval: float = 1.0
+) -> list:
+    """
+    Returns `fn(arg)` for every arg, computed by at most `processes` forked worker processes.
+    An exception in `fn` is raised again with the traceback of the worker. A worker that dies without reporting
+    (e.g., killed when running out of memory) is noticed within `poll_interval` seconds.
+    """
+    args = list(args)
+    processes = max(1, min(processes or os.cpu_count(), len(args)))
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    def work(indices):
+        try:
+            for i in indices:
+                results.put((i, fn(args[i]), None))
+        except Exception:
+            results.put((None, None, traceback.format_exc()))
+
+    workers = [
+        context.Process(target=work, args=(range(w, len(args), processes),))
+        for w in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        output = [None] * len(args)
+        remaining = len(args)
+        while remaining:
+            try:
+                i, result, error = results.get(timeout=poll_interval)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.exitcode not in (None, 0):
+                        raise RuntimeError(
+                            f"A worker exited with code {worker.exitcode} with {remaining} results outstanding"
+                        )
+                continue
+            if error is not None:
+                raise RuntimeError(f"A worker failed:\n{error}")
+            output[i] = result
+            remaining -= 1
+    except BaseException:
+        for worker in workers:
+            worker.terminate()
+        raise
+    for worker in workers:
+        worker.join()
+    return output
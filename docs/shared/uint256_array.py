@@ -0,0 +1,221 @@
+"""
+Checked arrays of 256-bit integers, shared by the notebooks.
+
+The notebooks define `Uint256` and `Int256` (through `bounded_int`) as checked scalars. The arrays here apply the
+same checks elementwise, such that batched fee or reward computations behave like the scalar ones (and Solidity),
+and raise with the index of the first offending element.
+
+Values are stored as int64 when they fit, and the operations use int64 when the result cannot overflow it,
+otherwise they fall back to python integers (numpy object arrays). Division floors, like the scalar types.
+"""
+
+import numpy as np
+
+# Operands below this bound can be added or subtracted in int64 without overflowing
+_INT64_SAFE = 2**62
+
+
+class BoundedIntArray:
+    """
+    An array of integers with `MIN_VALUE <= value < MAX_VALUE`, use `Uint256Array` or `Int256Array`.
+    """
+
+    MIN_VALUE = 0
+    MAX_VALUE = 0
+
+    def __init__(self, values):
+        if not isinstance(values, np.ndarray):
+            # Lists of python integers could otherwise be converted to floats
+            values = np.array(values, dtype=object)
+        values = _compact(values.reshape(-1))
+        self._check(values, "value")
+        self.values = values
+
+    @classmethod
+    def zeros(cls, count: int):
+        return cls(np.zeros(count, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self):
+        return (int(v) for v in self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return int(self.values[index])
+        return self._new(self.values[index])
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.tolist()})"
+
+    def tolist(self) -> list[int]:
+        return [int(v) for v in self.values]
+
+    def _new(self, values):
+        result = type(self).__new__(type(self))
+        result.values = _compact(values)
+        return result
+
+    def _check(self, result, operation: str):
+        if len(result) == 0:
+            return
+        too_large = _crosses(result, self.MAX_VALUE, np.greater_equal)
+        if too_large.any():
+            i = int(np.argmax(too_large))
+            raise OverflowError(
+                f"Integer overflow in {operation} at index {i}: {int(result[i])}"
+            )
+        too_small = _crosses(result, self.MIN_VALUE, np.less)
+        if too_small.any():
+            i = int(np.argmax(too_small))
+            raise ValueError(
+                f"Integer underflow in {operation} at index {i}: {int(result[i])}"
+            )
+
+    def _operand(self, other):
+        if isinstance(other, BoundedIntArray):
+            if len(other) != len(self) and 1 not in (len(self), len(other)):
+                raise ValueError(f"Length mismatch: {len(self)} and {len(other)}")
+            return other.values
+        if hasattr(other, "value"):
+            other = other.value
+        if isinstance(other, (int, np.integer)):
+            return _compact(np.array([int(other)], dtype=object))
+        raise TypeError(
+            f"Unsupported operand type for {type(self).__name__}: '{type(other).__name__}'"
+        )
+
+    def _checked(self, result, operation: str):
+        self._check(result, operation)
+        return self._new(result)
+
+    def __add__(self, other):
+        b = self._operand(other)
+        a, b = _widen(self.values, b, _max_abs(self.values) + _max_abs(b))
+        return self._checked(a + b, "add")
+
+    def __sub__(self, other):
+        b = self._operand(other)
+        a, b = _widen(self.values, b, _max_abs(self.values) + _max_abs(b))
+        return self._checked(a - b, "sub")
+
+    def __mul__(self, other):
+        b = self._operand(other)
+        a, b = _widen(self.values, b, _max_abs(self.values) * _max_abs(b))
+        return self._checked(a * b, "mul")
+
+    def _divisor(self, other):
+        b = self._operand(other)
+        zero = np.asarray(b == 0, dtype=bool)
+        if zero.any():
+            raise ZeroDivisionError(f"Division by zero at index {int(np.argmax(zero))}")
+        return b
+
+    def __truediv__(self, other):
+        b = self._divisor(other)
+        a, b = _widen(self.values, b, _max_abs(self.values))
+        return self._checked(a // b, "div")
+
+    def mul_div(self, other, denominator, round_up: bool = False):
+        """
+        `self * other / denominator` without bounding the intermediate product, rounding up if `round_up`.
+        """
+        b = self._operand(other)
+        d = self._divisor(denominator)
+        a, b = _widen(self.values, b, _max_abs(self.values) * _max_abs(b))
+        temp = a * b
+        temp, d = _widen(temp, d, _max_abs(temp))
+        result = temp // d
+        if round_up:
+            result = result + (temp % d != 0)
+        return self._checked(result, "mul_div")
+
+    def __neg__(self):
+        a, _ = _widen(self.values, self.values, _max_abs(self.values))
+        return self._checked(-a, "neg")
+
+    def __abs__(self):
+        a, _ = _widen(self.values, self.values, _max_abs(self.values))
+        return self._checked(abs(a), "abs")
+
+    def sum(self) -> int:
+        total = int(self.values.sum(dtype=object))
+        self._check(np.array([total], dtype=object), "sum")
+        return total
+
+    def _compare(self, other, op):
+        return np.asarray(op(self.values, self._operand(other)), dtype=bool)
+
+    def __eq__(self, other):
+        return self._compare(other, np.equal)
+
+    def __ne__(self, other):
+        return self._compare(other, np.not_equal)
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    __hash__ = None
+
+
+class Uint256Array(BoundedIntArray):
+    # The same (exclusive) bounds as the scalar `Uint256` in the notebooks
+    MIN_VALUE = 0
+    MAX_VALUE = 2**256 - 1
+
+
+class Int256Array(BoundedIntArray):
+    MIN_VALUE = -(2**255)
+    MAX_VALUE = 2**255 - 1
+
+
+def _max_abs(values) -> int:
+    if len(values) == 0:
+        return 0
+    return max(abs(int(values.max())), abs(int(values.min())))
+
+
+def _crosses(values, bound: int, op):
+    # An int64 array cannot cross a bound outside of the int64 range (and older numpy cannot compare to it)
+    if values.dtype == np.int64 and not -(2**63) <= bound < 2**63:
+        return np.zeros(len(values), dtype=bool)
+    return np.asarray(op(values, bound), dtype=bool)
+
+
+def _compact(values):
+    """
+    int64 if every value fits, python integers otherwise.
+    """
+    if values.dtype == np.int64:
+        return values
+    if values.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if values.dtype.kind in "iub" and values.dtype != np.uint64:
+        return values.astype(np.int64)
+    if values.dtype.kind not in "iubO":
+        raise TypeError(f"Expected integers, got {values.dtype}")
+    values = values.astype(object)
+    if not all(isinstance(v, (int, np.integer)) for v in values):
+        raise TypeError("Expected integers")
+    if _max_abs(values) < 2**63:
+        return values.astype(np.int64)
+    return values
+
+
+def _widen(a, b, bound: int):
+    """
+    Returns the operands as int64 if `bound` (on the magnitude of the result) is safely within it, as python integers otherwise.
+    """
+    if a.dtype == np.int64 and b.dtype == np.int64 and bound < _INT64_SAFE:
+        return a, b
+    return a.astype(object), b.astype(object)